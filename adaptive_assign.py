@@ -0,0 +1,217 @@
+# adaptive_assign.py
+# -*- coding: utf-8 -*-
+"""
+按“MOS 置信区间宽度”分配图片（ASSIGN_MODE=adaptive）
+
+固定 R_TARGET 的做法里，评分很一致的图和争议很大的图都评 25 次。
+这里按每张图当前 95% CI 半宽排优先级，CI 已经够窄的图不再分配：
+- 每张图维护 n / Σscore / Σscore²（来自 ratings），外加 pending = 已分配次数 − 已评次数
+- 方差向全体 pooled 方差收缩（n 小的时候样本方差不可靠）
+- 期望半宽 h = Z·s / sqrt(n + pending)：把已经发出去、还没回来的评分也算进去，
+  避免并发注册的人都扎堆拿同一批“最不确定”的图
+- 不再分配：n + pending >= r_max，或 n + pending >= r_min 且 h <= target_ci
+- 选 K 张：先每个 strata 取 cover_m 张 h 最大的（覆盖包），再全局 h 最大的补齐
+所有计算都是 6000 长度的 numpy 向量，单次选择在毫秒级
+"""
+
+import threading
+
+import numpy as np
+
+Z_95 = 1.96
+
+
+class AdaptiveAllocator:
+    def __init__(self, r_min: int, r_max: int, target_ci: float,
+                 prior_sd: float = 1.0, prior_weight: float = 3.0, seed=None):
+        self.r_min = int(r_min)
+        self.r_max = int(r_max)
+        self.target_ci = float(target_ci)
+        self.prior_sd = float(prior_sd)         # 还没有任何评分时用的标准差（1–5 分制）
+        self.prior_weight = float(prior_weight)  # 收缩强度：相当于几条“伪评分”
+        self.rng = np.random.default_rng(seed)
+
+        self.lock = threading.Lock()   # 调用方在整个分配事务期间持有
+        self.last_rowid = 0            # SQLite：ratings 增量读取的位置
+        self.refreshed_at = 0.0        # PG：上次从 image_stats 同步的时间（按 TTL 刷新）
+
+        self.image_ids = np.array([], dtype=object)
+        self.index_of = {}
+        self.strata = np.array([], dtype=np.int64)
+        self.n_strata = 0
+        self.n = np.zeros(0)
+        self.s1 = np.zeros(0)
+        self.s2 = np.zeros(0)
+        self.pending = np.zeros(0)
+
+    # ---------- data ----------
+    @property
+    def loaded(self) -> bool:
+        return len(self.image_ids) > 0
+
+    def load_catalog(self, rows):
+        """rows: (image_id, category, resolution, distortion)；会清空评分统计"""
+        ids, keys = [], []
+        for image_id, cat, res, dist in rows:
+            ids.append(image_id)
+            keys.append((int(cat), str(res), int(dist)))
+        names = sorted(set(keys))
+        code_of = {k: i for i, k in enumerate(names)}
+
+        self.image_ids = np.array(ids, dtype=object)
+        self.index_of = {x: i for i, x in enumerate(ids)}
+        self.strata = np.array([code_of[k] for k in keys], dtype=np.int64)
+        self.n_strata = len(names)
+        n = len(ids)
+        self.n = np.zeros(n)
+        self.s1 = np.zeros(n)
+        self.s2 = np.zeros(n)
+        self.pending = np.zeros(n)
+        self.last_rowid = 0
+
+    def _indices(self, image_ids):
+        idx = [self.index_of.get(x) for x in image_ids]
+        return np.array([i for i in idx if i is not None], dtype=np.int64), [i is not None for i in idx]
+
+    def set_rating_stats(self, rows):
+        """rows: (image_id, n, Σscore, Σscore²)，整体替换"""
+        self.n[:] = 0
+        self.s1[:] = 0
+        self.s2[:] = 0
+        rows = list(rows)
+        if not rows:
+            return
+        idx, ok = self._indices(r[0] for r in rows)
+        vals = np.array([r[1:] for r, keep in zip(rows, ok) if keep], dtype=np.float64).reshape(-1, 3)
+        self.n[idx] = vals[:, 0]
+        self.s1[idx] = vals[:, 1]
+        self.s2[idx] = vals[:, 2]
+
+    def add_scores(self, rows):
+        """rows: (image_id, score)，增量累加"""
+        rows = list(rows)
+        if not rows:
+            return
+        idx, ok = self._indices(r[0] for r in rows)
+        scores = np.array([r[1] for r, keep in zip(rows, ok) if keep], dtype=np.float64)
+        np.add.at(self.n, idx, 1)
+        np.add.at(self.s1, idx, scores)
+        np.add.at(self.s2, idx, scores * scores)
+
+    def set_assigned(self, rows):
+        """
+        rows: (image_id, 累计分配次数)，整体替换
+        pending = 分配次数 − 已评次数，所以要先同步评分再调这个
+        """
+        assigned = np.zeros(len(self.image_ids))
+        rows = list(rows)
+        if rows:
+            idx, ok = self._indices(r[0] for r in rows)
+            assigned[idx] = [r[1] for r, keep in zip(rows, ok) if keep]
+        self.pending = np.maximum(assigned - self.n, 0)
+
+    def set_pending(self, rows):
+        """rows: (image_id, 已分配未评的次数)，整体替换（调用方已经排除了掉队的人）"""
+        self.pending[:] = 0
+        rows = list(rows)
+        if rows:
+            idx, ok = self._indices(r[0] for r in rows)
+            self.pending[idx] = [r[1] for r, keep in zip(rows, ok) if keep]
+
+    def add_pending(self, idx, delta: int = 1):
+        np.add.at(self.pending, np.asarray(idx, dtype=np.int64), delta)
+
+    def strata_counts(self, image_ids) -> dict:
+        """strata 编号 -> 这批图里有几张（分块分配时算参与者还差哪些 strata）"""
+        idx, _ = self._indices(image_ids)
+        counts = np.bincount(self.strata[idx], minlength=self.n_strata)
+        return {s: int(c) for s, c in enumerate(counts) if c}
+
+    # ---------- priority ----------
+    def _sum_sq(self) -> np.ndarray:
+        """每张图的离差平方和 Σ(x − mean)²"""
+        ss = self.s2 - np.divide(self.s1 ** 2, self.n, out=np.zeros_like(self.s1), where=self.n > 0)
+        return np.maximum(ss, 0)
+
+    def _pooled_var(self, ss) -> float:
+        dof = np.maximum(self.n - 1, 0)
+        if dof.sum() <= 0:
+            return self.prior_sd ** 2
+        return float(ss.sum() / dof.sum())
+
+    def halfwidth(self, include_pending: bool = True) -> np.ndarray:
+        """每张图（评完 pending 之后）期望的 95% CI 半宽"""
+        ss = self._sum_sq()
+        pooled = self._pooled_var(ss)
+        dof = np.maximum(self.n - 1, 0)
+        var = (ss + self.prior_weight * pooled) / (dof + self.prior_weight)
+        n_eff = self.n + (self.pending if include_pending else 0)
+        return Z_95 * np.sqrt(var) / np.sqrt(np.maximum(n_eff, 1))
+
+    def eligible(self, h=None) -> np.ndarray:
+        h = self.halfwidth() if h is None else h
+        n_eff = self.n + self.pending
+        converged = (n_eff >= self.r_min) & (h <= self.target_ci)
+        return (n_eff < self.r_max) & ~converged
+
+    # ---------- select ----------
+    def select(self, k: int, cover_m: int, exclude=(), need=None) -> np.ndarray:
+        """
+        返回选中图片的下标（覆盖包在前）；不修改 pending，调用方写库成功后再 add_pending
+        exclude：这个参与者已经拿过的 image_id
+        need：strata 编号 -> 这次覆盖包要几张；None 表示每个 strata cover_m 张
+        """
+        h = self.halfwidth()
+        ok = self.eligible(h)
+        if exclude:
+            ex, _ = self._indices(exclude)
+            ok[ex] = False
+        cand = np.flatnonzero(ok)
+        if len(cand) == 0 or k <= 0:
+            return np.array([], dtype=np.int64)
+
+        # 同一 strata 内按 h 降序；h 相同（比如都还没评过）随机打散
+        tie = self.rng.random(len(cand))
+        order = cand[np.lexsort((tie, -h[cand], self.strata[cand]))]
+
+        # 1) coverage：每个 strata 排名前 quota 的
+        if need is None:
+            quota = np.full(self.n_strata, cover_m)
+        else:
+            quota = np.zeros(self.n_strata, dtype=np.int64)
+            for code, m in need.items():
+                quota[code] = m
+        s = self.strata[order]
+        first = np.r_[0, np.flatnonzero(s[1:] != s[:-1]) + 1]
+        rank = np.arange(len(order)) - np.repeat(first, np.diff(np.r_[first, len(order)]))
+        cover = order[rank < quota[s]][:k]
+
+        # 2) fill：剩下的全局 h 最大
+        need = k - len(cover)
+        if need <= 0:
+            return cover
+        rest_mask = ok.copy()
+        rest_mask[cover] = False
+        rest = np.flatnonzero(rest_mask)
+        if len(rest) > need:
+            key = h[rest] + 1e-9 * self.rng.random(len(rest))
+            rest = rest[np.argpartition(-key, need - 1)[:need]]
+        return np.concatenate([cover, rest])
+
+    def ids(self, idx) -> list:
+        return self.image_ids[np.asarray(idx, dtype=np.int64)].tolist()
+
+    def stats(self) -> dict:
+        if not self.loaded:
+            return {"images": 0}
+        h = self.halfwidth(include_pending=False)
+        rated = self.n > 0
+        return {
+            "images": len(self.image_ids),
+            "ratings": int(self.n.sum()),
+            "pending": int(self.pending.sum()),
+            "eligible": int(self.eligible().sum()),
+            "converged": int(((self.n >= self.r_min) & (h <= self.target_ci)).sum()),
+            "median_ci": float(np.median(h[rated])) if rated.any() else None,
+            "max_ci": float(h.max()),
+        }
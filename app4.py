@@ -8,7 +8,11 @@ from PIL import Image
 import io
 import base64
 import streamlit.components.v1 as components
-import random
+
+from image_cache import ImageCache, IMAGE_CACHE_MAX_MB
+from strata_index import StrataIndex
+from adaptive_assign import AdaptiveAllocator
+import sqlite_assign
 
 st.set_page_config(layout="wide")
 
@@ -37,6 +41,11 @@ N_TARGET = 6000
 K_PER_PERSON = (N_TARGET * R_TARGET) // P   # 500
 COVER_M = 2                                  # 每组合2张（覆盖包强度）
 
+# 分配模式：strata（每张图固定 R_TARGET 次）/ adaptive（按 MOS 置信区间宽度，见 adaptive_assign.py）
+ASSIGN_MODE = os.environ.get("ASSIGN_MODE", "strata").strip().lower()
+ADAPTIVE_R_MIN = int(os.environ.get("ADAPTIVE_R_MIN", "10"))            # 至少评这么多次才看 CI
+ADAPTIVE_TARGET_CI = float(os.environ.get("ADAPTIVE_TARGET_CI", "0.3"))  # 95% CI 半宽目标（1–5 分）
+
 # =========================
 # Database
 # =========================
@@ -113,6 +122,7 @@ def init_db():
     conn.commit()
 
     ensure_ratings_columns(conn)
+    sqlite_assign.init_assign_tables(conn)
     conn.close()
 
 init_db()
@@ -183,8 +193,12 @@ def list_images(folder):
         if f.lower().endswith(VALID_EXTS) and not f.startswith(".")
     )
 
-@st.cache_data(show_spinner=False)
-def image_as_data_url(img_path: str, max_side: int, quality: int = 92) -> str:
+@st.cache_resource
+def get_image_cache():
+    # 有字节上限 + LRU，替代无上限的 st.cache_data
+    return ImageCache(max_bytes=IMAGE_CACHE_MAX_MB * 1024 * 1024)
+
+def _encode_data_url(img_path: str, max_side: int, quality: int) -> str:
     with Image.open(img_path) as im:
         im = im.convert("RGB")
         im.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
@@ -193,6 +207,12 @@ def image_as_data_url(img_path: str, max_side: int, quality: int = 92) -> str:
         b64 = base64.b64encode(buf.getvalue()).decode("utf-8")
         return f"data:image/jpeg;base64,{b64}"
 
+def image_as_data_url(img_path: str, max_side: int, quality: int = 92) -> str:
+    key = ("data_url", img_path, max_side, quality)
+    return get_image_cache().get_or_compute(
+        key, lambda: _encode_data_url(img_path, max_side, quality)
+    )
+
 def get_assigned_image_ids(conn, pid: str):
     cur = conn.cursor()
     cur.execute("SELECT image_id FROM assignments WHERE participant_id=? ORDER BY ord ASC", (pid,))
@@ -204,112 +224,44 @@ def get_image_relpath(conn, image_id: str):
     r = cur.fetchone()
     return r[0] if r else None
 
-def fetch_distinct_axes(conn):
-    """从 images 表里动态取出：类别、分辨率、失真档（避免写死15类/R1R2）"""
-    cur = conn.cursor()
-    cur.execute("SELECT DISTINCT category FROM images ORDER BY category ASC")
-    cats = [int(x[0]) for x in cur.fetchall()]
-
-    cur.execute("SELECT DISTINCT resolution FROM images ORDER BY resolution ASC")
-    ress = [x[0] for x in cur.fetchall()]
+@st.cache_resource
+def get_strata_index():
+    """每个进程一份，按 assign_meta.generation 自动和 DB 同步"""
+    return StrataIndex(R_TARGET)
 
-    cur.execute("SELECT DISTINCT distortion FROM images ORDER BY distortion ASC")
-    dists = [int(x[0]) for x in cur.fetchall()]
 
-    return cats, ress, dists
-
-def build_strata_key(cat: int, res: str, dist: int) -> str:
-    return f"{cat}|{res}|{dist}"
-
-def fetch_available_by_strata(conn):
-    """取出所有还能分配（assigned_count < R_TARGET）的图片，按 strata 分组，并按 assigned_count 少优先"""
-    cur = conn.cursor()
-    cur.execute("""
-      SELECT image_id, category, resolution, distortion, assigned_count
-      FROM images
-      WHERE assigned_count < ?
-    """, (R_TARGET,))
-    strata = {}
-    for image_id, cat, res, dist, assigned_count in cur.fetchall():
-        key = build_strata_key(int(cat), str(res), int(dist))
-        strata.setdefault(key, []).append((image_id, int(assigned_count)))
-
-    for k in strata:
-        strata[k].sort(key=lambda x: x[1])  # assigned_count 少的优先
-    return strata
+@st.cache_resource
+def get_adaptive_allocator():
+    """ASSIGN_MODE=adaptive 用；每个进程一份，评分按 rowid 增量同步"""
+    return AdaptiveAllocator(ADAPTIVE_R_MIN, R_TARGET, ADAPTIVE_TARGET_CI)
 
 def assign_images_for_participant(pid: str):
     """
-    给参与者 pid 分配 K_PER_PERSON=500 张图：
-    - coverage pack：所有 (category × resolution × distortion) 每组合取 COVER_M 张
-    - quota fill：补齐到500，优先选 assigned_count 少的
-    并更新 images.assigned_count
+    给参与者 pid 分配 K_PER_PERSON 张：
+    - coverage：每个 (cat×res×dist) 取 COVER_M
+    - fill：补齐到 K_PER_PERSON，优先 assigned_count 少
+    选图走进程内 strata 堆（见 sqlite_assign.py / strata_index.py）
+    ASSIGN_MODE=adaptive 时 fill 改成“CI 半宽最大优先”，CI 已够窄的图不再分配
     """
     conn = get_conn()
     try:
-        cur = conn.cursor()
-
-        existing = get_assigned_image_ids(conn, pid)
-        if len(existing) >= K_PER_PERSON:
-            return
-
-        # 加锁：避免多人同时注册时抢 quota
-        cur.execute("BEGIN IMMEDIATE")
-
-        cats, ress, dists = fetch_distinct_axes(conn)
-        strata = fetch_available_by_strata(conn)
-
-        cover_ids = []
-        for cat in cats:
-            for res in ress:
-                for dist in dists:
-                    key = build_strata_key(cat, res, dist)
-                    candidates = strata.get(key, [])
-                    take = min(COVER_M, len(candidates))
-                    for _ in range(take):
-                        image_id, _ac = candidates.pop(0)
-                        cover_ids.append(image_id)
-
-        chosen = list(dict.fromkeys(cover_ids))  # 去重
-
-        # 补齐到500
-        if len(chosen) < K_PER_PERSON:
-            pool = []
-            for items in strata.values():
-                for image_id, ac in items:
-                    if image_id not in chosen:
-                        pool.append((image_id, ac))
-            pool.sort(key=lambda x: x[1])
-            need = K_PER_PERSON - len(chosen)
-            chosen.extend([x[0] for x in pool[:need]])
-
-        if len(chosen) < K_PER_PERSON:
-            st.warning(
-                f"可分配图片不足：仅分到 {len(chosen)} 张（目标 {K_PER_PERSON}）。"
-                f"可能是某些 strata 库存不足或配额已接近用尽。"
+        if ASSIGN_MODE == "adaptive":
+            chosen = sqlite_assign.assign_images_adaptive(
+                conn, pid, get_adaptive_allocator(), K_PER_PERSON, COVER_M, retries=1
+            )
+        else:
+            chosen = sqlite_assign.assign_images_for_participant(
+                conn, pid, get_strata_index(), K_PER_PERSON, COVER_M, retries=1
             )
-
-        # 写 assignments + 更新 assigned_count
-        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        random.shuffle(chosen)
-
-        cur.executemany(
-            "INSERT OR IGNORE INTO assignments (participant_id, image_id, ord, assigned_time) VALUES (?, ?, ?, ?)",
-            [(pid, img_id, i, now) for i, img_id in enumerate(chosen)]
-        )
-
-        cur.executemany(
-            "UPDATE images SET assigned_count = assigned_count + 1 WHERE image_id = ?",
-            [(img_id,) for img_id in chosen]
-        )
-
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise e
     finally:
         conn.close()
 
+    if chosen is not None and len(chosen) < K_PER_PERSON:
+        st.warning(
+            f"可分配图片不足：仅分到 {len(chosen)} 张（目标 {K_PER_PERSON}）。"
+            f"可能是某些 strata 库存不足或配额已接近用尽。"
+        )
+
 # =========================
 # Session State Init
 # =========================
@@ -10,11 +10,21 @@ from PIL import Image
 import io
 import base64
 import streamlit.components.v1 as components
-import random
 import time
 
 from streamlit_js_eval import streamlit_js_eval
 
+from image_cache import ImageCache, IMAGE_CACHE_MAX_MB
+from strata_index import StrataIndex
+from adaptive_assign import AdaptiveAllocator
+from image_catalog import ImageCatalog
+import sqlite_assign
+import migrations
+from sqlite_pool import SQLitePool
+from rating_writer import RatingWriter, DeadLetterFile, write_splitting
+from rating_journal import RatingJournal
+from training_page import load_training_manifest, training_manifest_version, training_base_url, render_training_carousel
+
 st.set_page_config(layout="wide")
 
 # =========================
@@ -46,26 +56,67 @@ N_TARGET = 6000
 K_PER_PERSON = (N_TARGET * R_TARGET) // P   # 500
 COVER_M = 2                                  # 每组合2张（覆盖包强度）
 
+# 分配模式：strata（每张图固定 R_TARGET 次）/ adaptive（按 MOS 置信区间宽度，见 adaptive_assign.py）
+ASSIGN_MODE = os.environ.get("ASSIGN_MODE", "strata").strip().lower()
+ADAPTIVE_R_MIN = int(os.environ.get("ADAPTIVE_R_MIN", "10"))            # 至少评这么多次才看 CI
+ADAPTIVE_TARGET_CI = float(os.environ.get("ADAPTIVE_TARGET_CI", "0.3"))  # 95% CI 半宽目标（1–5 分）
+
+# 分块分配：注册时只发 ASSIGN_CHUNK 张，剩 ASSIGN_TOPUP_MARGIN 张时再发下一块（0 = 一次发完 K 张）
+# 超过 ASSIGN_STALE_MIN 分钟没动静的参与者，没评的图收回到池子里（0 = 不回收）
+ASSIGN_CHUNK = int(os.environ.get("ASSIGN_CHUNK", "50"))
+ASSIGN_TOPUP_MARGIN = int(os.environ.get("ASSIGN_TOPUP_MARGIN", "5"))
+ASSIGN_STALE_MIN = int(os.environ.get("ASSIGN_STALE_MIN", "60"))
+
 # SQLite 写入重试参数
 SQLITE_TIMEOUT_SEC = 30
 SQLITE_BUSY_TIMEOUT_MS = 8000
 SQLITE_WRITE_RETRIES = 6
+# 每个进程最多留几条空闲连接（sqlite_pool.py）
+SQLITE_POOL_MAX_IDLE = int(os.environ.get("SQLITE_POOL_MAX_IDLE", "8"))
+
+# 评分写入方式（rating_writer.py）
+#   async : 放进本进程后台线程的队列，攒批写入；点 Next 不用等数据库
+#   sync  : 当场 INSERT + commit（原来的做法）
+RATING_WRITER = os.environ.get("RATING_WRITER", "async").strip().lower()
+RATING_BATCH_SIZE = int(os.environ.get("RATING_BATCH_SIZE", "50"))
+RATING_FLUSH_MS = float(os.environ.get("RATING_FLUSH_MS", "20"))
+RATING_DONE_WAIT_SEC = 10   # 结束页最多等几秒让本人的评分全部落库
+
+# 评分本地预写日志（rating_journal.py）：先追加到本地文件再写库，写库失败 / 进程被杀也不丢；空字符串关闭
+#   文件名和 app_pg 的分开（列顺序不同）；行上另有 schema 标记，回放不认别的 app 写的行
+RATING_JOURNAL = os.environ.get("RATING_JOURNAL", "ratings_journal_sqlite.jsonl").strip()
+RATING_JOURNAL_SCHEMA = "sqlite-ratings-v1"   # INSERT_RATING_SQL 的 7 列
+RATING_JOURNAL_FSYNC_MS = float(os.environ.get("RATING_JOURNAL_FSYNC_MS", "50"))
+RATING_JOURNAL_REPLAY_SEC = float(os.environ.get("RATING_JOURNAL_REPLAY_SEC", "30"))
+# 写不进库的坏行（约束 / 类型错误）挪到这里，不挡后面的评分；锁超时这类错误才重试
+RATING_DEAD_LETTER = os.environ.get("RATING_DEAD_LETTER", "ratings_dead_letter_sqlite.jsonl").strip()
+RATING_TRANSIENT_ERRORS = (sqlite3.OperationalError,)
+
+# Admin 页：URL 加 ?admin=<IQA_ADMIN_TOKEN> 才能看到（没设 token 就不开放）
+ADMIN_TOKEN = os.environ.get("IQA_ADMIN_TOKEN", "").strip()
 
 
 # =========================
 # Database utilities
 # =========================
+@st.cache_resource
+def get_sqlite_pool():
+    # 每个进程一个；连接只在第一次打开时执行 PRAGMA（WAL / busy_timeout 等），之后复用
+    return SQLitePool(DB_PATH, timeout=SQLITE_TIMEOUT_SEC, busy_timeout_ms=SQLITE_BUSY_TIMEOUT_MS,
+                      max_idle=SQLITE_POOL_MAX_IDLE)
+
+
 def get_conn():
     """
-    关键：timeout + WAL + busy_timeout
+    关键：timeout + WAL + busy_timeout（在 sqlite_pool 里只设一次）
     WAL 能显著降低“database is locked”
+    用完调 release_conn 还回去，不要 close
     """
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False, timeout=SQLITE_TIMEOUT_SEC)
-    conn.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
-    conn.execute("PRAGMA journal_mode = WAL")
-    conn.execute("PRAGMA synchronous = NORMAL")
-    conn.execute("PRAGMA temp_store = MEMORY")
-    return conn
+    return get_sqlite_pool().acquire()
+
+
+def release_conn(conn):
+    get_sqlite_pool().release(conn)
 
 
 def execute_write_with_retry(conn: sqlite3.Connection, sql: str, params=None):
@@ -99,76 +150,14 @@ def executemany_write_with_retry(conn: sqlite3.Connection, sql: str, seq_params)
     raise sqlite3.OperationalError("database is locked (exceeded retries)")
 
 
-def ensure_ratings_columns(conn):
-    """
-    旧库迁移：补齐 ratings 必须字段
-    注意：我们现在不再使用 color_correctness
-    """
-    cur = conn.cursor()
-    cur.execute("PRAGMA table_info(ratings)")
-    cols = {row[1] for row in cur.fetchall()}
-
-    if "text_clarity" not in cols:
-        execute_write_with_retry(conn, "ALTER TABLE ratings ADD COLUMN text_clarity TEXT")
-    if "image_id" not in cols:
-        execute_write_with_retry(conn, "ALTER TABLE ratings ADD COLUMN image_id TEXT")
-
-    conn.commit()
-
-
+@st.cache_resource
 def init_db():
+    """每个进程只跑一次：应用 migrations.py 里还没应用的版本（建表、补列、索引）"""
     conn = get_conn()
-    cur = conn.cursor()
-
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS participants (
-        participant_id TEXT PRIMARY KEY,
-        student_id TEXT,
-        device TEXT,
-        screen_resolution TEXT,
-        start_time TEXT
-    )
-    """)
-
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS images (
-        image_id TEXT PRIMARY KEY,
-        rel_path TEXT NOT NULL,
-        category INTEGER NOT NULL,
-        category_name TEXT,
-        resolution TEXT NOT NULL,
-        distortion INTEGER NOT NULL,
-        distortion_name TEXT,
-        assigned_count INTEGER NOT NULL DEFAULT 0
-    )
-    """)
-
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS assignments (
-        participant_id TEXT NOT NULL,
-        image_id TEXT NOT NULL,
-        ord INTEGER NOT NULL,
-        assigned_time TEXT NOT NULL,
-        PRIMARY KEY (participant_id, image_id)
-    )
-    """)
-
-    # ✅ ratings：彻底移除 color_correctness
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS ratings (
-        participant_id TEXT,
-        image_name TEXT,
-        score INTEGER,
-        label TEXT,
-        time TEXT,
-        text_clarity TEXT,
-        image_id TEXT
-    )
-    """)
-
-    conn.commit()
-    ensure_ratings_columns(conn)
-    conn.close()
+    try:
+        return migrations.migrate_sqlite(conn)
+    finally:
+        release_conn(conn)
 
 
 init_db()
@@ -227,7 +216,7 @@ def import_manifest_if_needed():
                 f"若你确实只想用6000张，请确认 {MANIFEST_CSV} 行数。"
             )
     finally:
-        conn.close()
+        release_conn(conn)
 
 
 import_manifest_if_needed()
@@ -246,8 +235,28 @@ def list_images(folder):
 
 
 @st.cache_data(show_spinner=False)
-def image_as_data_url(img_path: str, max_side: int, quality: int = 92) -> str:
-    """Training 页：编码成 data URL 做轮播（避免 rerun），这里会压缩成 JPEG"""
+def load_training_manifest_cached(version):
+    return load_training_manifest()
+
+
+def get_training_manifest():
+    """按 manifest 的 mtime 缓存；还没生成时不缓存，之后跑 build_training_assets.py 不用重启"""
+    version = training_manifest_version()
+    if version is None:
+        return None
+    return load_training_manifest_cached(version)
+
+
+@st.cache_resource
+def get_image_cache():
+    """
+    全进程共享一个有上限的缓存（IMAGE_CACHE_MAX_MB）
+    不用 st.cache_data：它没有字节上限，长时间跑会把所有编码结果都留在内存里
+    """
+    return ImageCache(max_bytes=IMAGE_CACHE_MAX_MB * 1024 * 1024)
+
+
+def _encode_data_url(img_path: str, max_side: int, quality: int) -> str:
     with Image.open(img_path) as im:
         im = im.convert("RGB")
         im.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
@@ -257,6 +266,14 @@ def image_as_data_url(img_path: str, max_side: int, quality: int = 92) -> str:
         return f"data:image/jpeg;base64,{b64}"
 
 
+def image_as_data_url(img_path: str, max_side: int, quality: int = 92) -> str:
+    """Training 页：编码成 data URL 做轮播（避免 rerun），这里会压缩成 JPEG"""
+    key = ("data_url", img_path, max_side, quality)
+    return get_image_cache().get_or_compute(
+        key, lambda: _encode_data_url(img_path, max_side, quality)
+    )
+
+
 def get_assigned_image_ids(conn, pid: str):
     cur = conn.cursor()
     cur.execute("SELECT image_id FROM assignments WHERE participant_id=? ORDER BY ord ASC", (pid,))
@@ -270,39 +287,105 @@ def get_image_relpath(conn, image_id: str):
     return r[0] if r else None
 
 
-def fetch_distinct_axes(conn):
-    cur = conn.cursor()
-    cur.execute("SELECT DISTINCT category FROM images ORDER BY category ASC")
-    cats = [int(x[0]) for x in cur.fetchall()]
+@st.cache_resource(max_entries=2, show_spinner=False)
+def load_image_catalog(version):
+    """整表读一次，所有 session 共用；version 只作缓存 key（images 从 MANIFEST_CSV 导入，用它的 mtime）"""
+    conn = get_conn()
+    try:
+        return ImageCatalog(conn.execute("SELECT image_id, rel_path FROM images").fetchall(), version)
+    finally:
+        release_conn(conn)
 
-    cur.execute("SELECT DISTINCT resolution FROM images ORDER BY resolution ASC")
-    ress = [x[0] for x in cur.fetchall()]
 
-    cur.execute("SELECT DISTINCT distortion FROM images ORDER BY distortion ASC")
-    dists = [int(x[0]) for x in cur.fetchall()]
+def get_image_catalog():
+    return load_image_catalog(os.path.getmtime(MANIFEST_CSV))
 
-    return cats, ress, dists
 
+@st.cache_resource
+def get_strata_index():
+    """每个进程一份，按 assign_meta.generation 自动和 DB 同步"""
+    return StrataIndex(R_TARGET)
 
-def build_strata_key(cat: int, res: str, dist: int) -> str:
-    return f"{cat}|{res}|{dist}"
 
+@st.cache_resource
+def get_adaptive_allocator():
+    """ASSIGN_MODE=adaptive 用；每个进程一份，评分按 rowid 增量同步"""
+    return AdaptiveAllocator(ADAPTIVE_R_MIN, R_TARGET, ADAPTIVE_TARGET_CI)
+
+
+# (participant_id, image_id) 已经有评分就跳过：评分日志回放和正常写入重叠时不会多一条
+INSERT_RATING_SQL = """
+INSERT INTO ratings (participant_id, image_name, score, label, time, text_clarity, image_id)
+SELECT ?1, ?2, ?3, ?4, ?5, ?6, ?7
+WHERE NOT EXISTS (SELECT 1 FROM ratings WHERE participant_id = ?1 AND image_id = ?7)
+"""
+
+
+def insert_ratings_with(sqlite_pool, rows):
+    """一个事务写一批；后台线程里用，所以直接传池进来"""
+    conn = sqlite_pool.acquire()
+    try:
+        executemany_write_with_retry(conn, INSERT_RATING_SQL, rows)
+        conn.commit()
+    finally:
+        sqlite_pool.release(conn)
+
+
+@st.cache_resource
+def get_rating_dead_letter():
+    return DeadLetterFile(RATING_DEAD_LETTER)
+
+
+@st.cache_resource
+def get_rating_journal():
+    """RATING_JOURNAL 非空时用；启动时先把上次没写进库（没 ack）的回放掉，坏行进 dead-letter"""
+    if not RATING_JOURNAL:
+        return None
+    sqlite_pool = get_sqlite_pool()
+    dead_letter = get_rating_dead_letter()
+    journal = RatingJournal(RATING_JOURNAL, RATING_JOURNAL_SCHEMA, fsync_ms=RATING_JOURNAL_FSYNC_MS)
+    journal.start_replayer(
+        lambda rows: write_splitting(lambda r: insert_ratings_with(sqlite_pool, r), rows,
+                                     RATING_TRANSIENT_ERRORS, dead_letter),
+        interval_sec=RATING_JOURNAL_REPLAY_SEC,
+    )
+    return journal
+
+
+@st.cache_resource
+def get_rating_writer():
+    """RATING_WRITER=async 用；每个进程一个后台线程，一批评分一个事务，写完在日志里 ack"""
+    sqlite_pool = get_sqlite_pool()   # 后台线程里不调 st.cache_resource，直接拿池
+    return RatingWriter(lambda records: insert_ratings_with(sqlite_pool, records),
+                        batch_size=RATING_BATCH_SIZE, flush_ms=RATING_FLUSH_MS,
+                        transient_errors=RATING_TRANSIENT_ERRORS, dead_letter=get_rating_dead_letter(),
+                        journal=get_rating_journal())
+
+
+def save_rating(record):
+    """record 按 INSERT_RATING_SQL 的列顺序；async 模式下把 ticket 记进 session，页面据此显示是否已落库"""
+    journal = get_rating_journal()
+    journal_id = journal.append(record) if journal is not None else None
+    if RATING_WRITER == "async":
+        st.session_state.rating_tickets.append(get_rating_writer().submit(record, journal_id))
+        return
+    conn = get_conn()
+    try:
+        execute_write_with_retry(conn, INSERT_RATING_SQL, record)
+        conn.commit()
+    finally:
+        release_conn(conn)
+    if journal is not None:
+        journal.ack([journal_id])
 
-def fetch_available_by_strata(conn):
-    cur = conn.cursor()
-    cur.execute("""
-      SELECT image_id, category, resolution, distortion, assigned_count
-      FROM images
-      WHERE assigned_count < ?
-    """, (R_TARGET,))
-    strata = {}
-    for image_id, cat, res, dist, assigned_count in cur.fetchall():
-        key = build_strata_key(int(cat), str(res), int(dist))
-        strata.setdefault(key, []).append((image_id, int(assigned_count)))
 
-    for k in strata:
-        strata[k].sort(key=lambda x: x[1])
-    return strata
+def rating_save_status():
+    """去掉已落库的 ticket，返回 (还没落库的条数, 最近一次写库错误)"""
+    if RATING_WRITER != "async" or not st.session_state.rating_tickets:
+        return 0, None
+    writer = get_rating_writer()
+    st.session_state.rating_tickets = writer.pending(st.session_state.rating_tickets)
+    return len(st.session_state.rating_tickets), writer.stats()["last_error"]
 
 
 def assign_images_for_participant(pid: str):
@@ -310,79 +393,33 @@ def assign_images_for_participant(pid: str):
     给参与者 pid 分配 K_PER_PERSON 张：
     - coverage：每个 (cat×res×dist) 取 COVER_M
     - fill：补齐到 K_PER_PERSON，优先 assigned_count 少
+    选图走进程内 strata 堆（见 sqlite_assign.py / strata_index.py）
+    ASSIGN_MODE=adaptive 时 fill 改成“CI 半宽最大优先”，CI 已够窄的图不再分配
+    ASSIGN_CHUNK > 0 时每次只发一块，评分页快做完时再调一次
     """
     conn = get_conn()
     try:
-        cur = conn.cursor()
-
-        existing = get_assigned_image_ids(conn, pid)
-        if len(existing) >= K_PER_PERSON:
-            return
-
-        # BEGIN IMMEDIATE + 重试
-        for i in range(SQLITE_WRITE_RETRIES):
-            try:
-                cur.execute("BEGIN IMMEDIATE")
-                break
-            except sqlite3.OperationalError as e:
-                if "locked" in str(e).lower():
-                    time.sleep(0.15 * (2 ** i))
-                    continue
-                raise
-
-        cats, ress, dists = fetch_distinct_axes(conn)
-        strata = fetch_available_by_strata(conn)
-
-        cover_ids = []
-        for cat in cats:
-            for res in ress:
-                for dist in dists:
-                    key = build_strata_key(cat, res, dist)
-                    candidates = strata.get(key, [])
-                    take = min(COVER_M, len(candidates))
-                    for _ in range(take):
-                        image_id, _ac = candidates.pop(0)
-                        cover_ids.append(image_id)
-
-        chosen = list(dict.fromkeys(cover_ids))
-
-        if len(chosen) < K_PER_PERSON:
-            pool = []
-            for items in strata.values():
-                for image_id, ac in items:
-                    if image_id not in chosen:
-                        pool.append((image_id, ac))
-            pool.sort(key=lambda x: x[1])
-            need = K_PER_PERSON - len(chosen)
-            chosen.extend([x[0] for x in pool[:need]])
-
-        if len(chosen) < K_PER_PERSON:
-            st.warning(
-                f"可分配图片不足：仅分到 {len(chosen)} 张（目标 {K_PER_PERSON}）。"
-                f"可能是某些 strata 库存不足或配额已接近用尽。"
+        want = sqlite_assign.next_chunk_size(len(get_assigned_image_ids(conn, pid)), K_PER_PERSON, ASSIGN_CHUNK)
+        opts = dict(retries=SQLITE_WRITE_RETRIES, chunk=ASSIGN_CHUNK, stale_min=ASSIGN_STALE_MIN)
+        if ASSIGN_MODE == "adaptive":
+            chosen = sqlite_assign.assign_images_adaptive(
+                conn, pid, get_adaptive_allocator(), K_PER_PERSON, COVER_M, **opts
+            )
+        else:
+            chosen = sqlite_assign.assign_images_for_participant(
+                conn, pid, get_strata_index(), K_PER_PERSON, COVER_M, **opts
             )
-
-        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        random.shuffle(chosen)
-
-        executemany_write_with_retry(
-            conn,
-            "INSERT OR IGNORE INTO assignments (participant_id, image_id, ord, assigned_time) VALUES (?, ?, ?, ?)",
-            [(pid, img_id, i, now) for i, img_id in enumerate(chosen)]
-        )
-
-        executemany_write_with_retry(
-            conn,
-            "UPDATE images SET assigned_count = assigned_count + 1 WHERE image_id = ?",
-            [(img_id,) for img_id in chosen]
-        )
-
-        conn.commit()
-    except Exception:
-        conn.rollback()
-        raise
     finally:
-        conn.close()
+        release_conn(conn)
+
+    if chosen is not None and not chosen:
+        # 池子里已经没有能给这个人的图了，评分页别再反复要
+        st.session_state.assign_exhausted = True
+    if chosen is not None and len(chosen) < want:
+        st.warning(
+            f"可分配图片不足：仅分到 {len(chosen)} 张（本次目标 {want}）。"
+            f"可能是某些 strata 库存不足或配额已接近用尽。"
+        )
 
 
 # =========================
@@ -394,6 +431,8 @@ if "participant_id" not in st.session_state:
     st.session_state.participant_id = None
 if "idx" not in st.session_state:
     st.session_state.idx = 0
+if "rating_tickets" not in st.session_state:
+    st.session_state.rating_tickets = []
 
 
 # =========================
@@ -468,7 +507,7 @@ def render_intro():
         )
         conn.commit()
     finally:
-        conn.close()
+        release_conn(conn)
 
     assign_images_for_participant(pid)
 
@@ -497,64 +536,70 @@ def render_training():
         unsafe_allow_html=True,
     )
 
-    train_imgs = list_images(TRAIN_DIR)
-    if len(train_imgs) < 5:
-        st.error(f"训练图目录 {TRAIN_DIR}/ 下至少需要 5 张图。当前：{len(train_imgs)}")
-        st.stop()
-
-    train_imgs = train_imgs[:5]
-    urls = [image_as_data_url(os.path.join(TRAIN_DIR, f), max_side=2400, quality=88) for f in train_imgs]
     caps = [f"{i+1} — {LABELS[i+1]}" for i in range(5)]
 
-    components.html(
-        f"""
-        <div style="width:100%; display:flex; justify-content:center;">
-          <div style="width:min(1800px, 98vw); text-align:center;">
-            <img id="trainImg"
-                 style="
-                    width:100%;
-                    height:auto;
-                    max-height: 78vh;
-                    object-fit: contain;
-                    border-radius:18px;
-                    border:1px solid rgba(0,0,0,0.10);
-                    box-shadow:0 18px 48px rgba(0,0,0,0.18);
-                    background:#fff;
-                 " />
-            <div id="trainCap"
-                 style="margin-top:12px; font-size:22px; font-weight:950;"></div>
-            <div style="opacity:0.65; font-weight:800; font-size:13px; margin-top:6px;">
-              Training only · No scores recorded
+    # ✅ 优先用 build_training_assets.py 预生成的素材（只传 URL，不传几 MB 的 data URL）
+    manifest = get_training_manifest()
+    if manifest:
+        render_training_carousel(manifest, caps, training_base_url(), interval_ms=TRAIN_INTERVAL_MS, height=820)
+    else:
+        train_imgs = list_images(TRAIN_DIR)
+        if len(train_imgs) < 5:
+            st.error(f"训练图目录 {TRAIN_DIR}/ 下至少需要 5 张图。当前：{len(train_imgs)}")
+            st.stop()
+
+        train_imgs = train_imgs[:5]
+        urls = [image_as_data_url(os.path.join(TRAIN_DIR, f), max_side=2400, quality=88) for f in train_imgs]
+
+        components.html(
+            f"""
+            <div style="width:100%; display:flex; justify-content:center;">
+              <div style="width:min(1800px, 98vw); text-align:center;">
+                <img id="trainImg"
+                     style="
+                        width:100%;
+                        height:auto;
+                        max-height: 78vh;
+                        object-fit: contain;
+                        border-radius:18px;
+                        border:1px solid rgba(0,0,0,0.10);
+                        box-shadow:0 18px 48px rgba(0,0,0,0.18);
+                        background:#fff;
+                     " />
+                <div id="trainCap"
+                     style="margin-top:12px; font-size:22px; font-weight:950;"></div>
+                <div style="opacity:0.65; font-weight:800; font-size:13px; margin-top:6px;">
+                  Training only · No scores recorded
+                </div>
+              </div>
             </div>
-          </div>
-        </div>
 
-        <script>
-          const urls = {urls};
-          const caps = {caps};
-          const interval = {TRAIN_INTERVAL_MS};
+            <script>
+              const urls = {urls};
+              const caps = {caps};
+              const interval = {TRAIN_INTERVAL_MS};
 
-          const img = document.getElementById("trainImg");
-          const cap = document.getElementById("trainCap");
+              const img = document.getElementById("trainImg");
+              const cap = document.getElementById("trainCap");
 
-          let i = 0;
-          function show() {{
-            img.src = urls[i];
-            cap.textContent = caps[i];
-          }}
+              let i = 0;
+              function show() {{
+                img.src = urls[i];
+                cap.textContent = caps[i];
+              }}
 
-          show();
-
-          setTimeout(() => {{
-            setInterval(() => {{
-              i = (i + 1) % urls.length;
               show();
-            }}, interval);
-          }}, 700);
-        </script>
-        """,
-        height=760,
-    )
+
+              setTimeout(() => {{
+                setInterval(() => {{
+                  i = (i + 1) % urls.length;
+                  show();
+                }}, interval);
+              }}, 700);
+            </script>
+            """,
+            height=760,
+        )
 
     st.markdown("<div style='height: 10px;'></div>", unsafe_allow_html=True)
     if st.button("Next → Start Rating"):
@@ -567,16 +612,31 @@ def render_training():
 # =========================
 # Stage 2 — Rating
 # =========================
+def load_assigned_image_ids(pid: str):
+    conn = get_conn()
+    try:
+        return get_assigned_image_ids(conn, pid)
+    finally:
+        release_conn(conn)
+
+
 def render_rating():
     pid = st.session_state.participant_id
     if not pid:
         st.error("No participant id.")
         st.stop()
 
-    conn = get_conn()
-    assigned_ids = get_assigned_image_ids(conn, pid)
+    assigned_ids = load_assigned_image_ids(pid)
+
+    # 分块分配：当前这块快做完了就要下一块（assign 自己借连接，这里不能还占着一条）
+    if (ASSIGN_CHUNK > 0 and len(assigned_ids) < K_PER_PERSON
+            and not st.session_state.get("assign_exhausted")
+            and st.session_state.idx >= len(assigned_ids) - ASSIGN_TOPUP_MARGIN):
+        assign_images_for_participant(pid)
+        assigned_ids = load_assigned_image_ids(pid)
 
     total = len(assigned_ids)
+    target = max(total, K_PER_PERSON) if ASSIGN_CHUNK > 0 and not st.session_state.get("assign_exhausted") else total
     done = st.session_state.idx
 
     if "rating_start_ts" not in st.session_state:
@@ -585,25 +645,32 @@ def render_rating():
     elapsed = time.time() - st.session_state.rating_start_ts
     done_for_avg = max(1, done)
     sec_per = elapsed / done_for_avg
-    remaining_sec = max(0, (total - done) * sec_per)
+    remaining_sec = max(0, (target - done) * sec_per)
 
-    st.progress(done / total if total else 0, text=f"Progress: {done}/{total} images completed")
+    st.progress(min(done / target, 1.0) if target else 0, text=f"Progress: {done}/{target} images completed")
     st.caption(f"Elapsed: {elapsed/60:.1f} min · Avg: {sec_per:.1f}s/image · ETA: {remaining_sec/60:.1f} min")
+    unsaved, save_error = rating_save_status()
+    if unsaved and save_error:
+        st.caption(f"⏳ {unsaved} 条评分正在保存（数据库暂时写不进去，会自动重试）")
 
     if total == 0:
-        conn.close()
         st.error("该参与者没有分配到图片（assignments为空）。请检查 manifest 导入与分配流程。")
         st.stop()
 
     if st.session_state.idx >= total:
-        conn.close()
         st.session_state.stage = "done"
         st.rerun()
         return
 
     image_id = assigned_ids[st.session_state.idx]
-    rel_path = get_image_relpath(conn, image_id)
-    conn.close()
+    # 进程内目录里没有（manifest 之外手工加的图）才查库
+    rel_path = get_image_catalog().rel_path(image_id)
+    if not rel_path:
+        conn = get_conn()
+        try:
+            rel_path = get_image_relpath(conn, image_id)
+        finally:
+            release_conn(conn)
 
     if not rel_path:
         st.error("Image not found in DB (rel_path missing).")
@@ -647,27 +714,15 @@ def render_rating():
         )
 
     if next_clicked:
-        conn = get_conn()
-        try:
-            execute_write_with_retry(
-                conn,
-                """
-                INSERT INTO ratings (participant_id, image_name, score, label, time, text_clarity, image_id)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    pid,
-                    rel_path,  # image_name 用 rel_path 更稳
-                    int(score),
-                    LABELS[int(score)],
-                    datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    str(text_clarity),
-                    image_id,
-                )
-            )
-            conn.commit()
-        finally:
-            conn.close()
+        save_rating((
+            pid,
+            rel_path,  # image_name 用 rel_path 更稳
+            int(score),
+            LABELS[int(score)],
+            datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            str(text_clarity),
+            image_id,
+        ))
 
         st.session_state.idx += 1
         st.rerun()
@@ -680,14 +735,97 @@ def render_done():
     if "rating_start_ts" in st.session_state:
         del st.session_state["rating_start_ts"]
 
+    if RATING_WRITER == "async" and st.session_state.rating_tickets:
+        with st.spinner("Saving your last ratings… / 正在保存最后几条评分…"):
+            get_rating_writer().wait(max(st.session_state.rating_tickets), RATING_DONE_WAIT_SEC)
+        if rating_save_status()[0]:
+            st.warning("部分评分还在保存中，请稍等几秒再关闭页面。")
+
     st.success("Thank you for participating! / 感谢参与！")
     st.write("You may now close this page.")
 
 
+# =========================
+# Admin — 运行指标
+# =========================
+def render_admin():
+    st.title("Admin · Runtime metrics")
+
+    st.markdown("### Image cache")
+    stats = get_image_cache().stats()
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("Entries", stats["entries"])
+    c2.metric("Size", f"{stats['bytes'] / 1024 / 1024:.1f} / {stats['max_bytes'] / 1024 / 1024:.0f} MB")
+    c3.metric("Hit rate", f"{stats['hit_rate'] * 100:.1f}%")
+    c4.metric("Evictions", stats["evictions"])
+    st.caption(
+        f"hits={stats['hits']} · misses={stats['misses']} · "
+        f"rejected(单张超过上限)={stats['rejected']}"
+    )
+
+    c = get_image_catalog().stats()
+    st.caption(f"Image catalog: {c['images']} images · version {c['version']}")
+
+    if st.button("Clear image cache"):
+        get_image_cache().clear()
+        st.rerun()
+
+    st.markdown("### SQLite connections")
+    p = get_sqlite_pool().stats()
+    locks = sqlite_assign.lock_stats()
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("Open", p["idle"] + p["in_use"])
+    c2.metric("Idle / in use", f"{p['idle']} / {p['in_use']}")
+    c3.metric("Opened / reused", f"{p['opened']} / {p['reused']}")
+    c4.metric("Lock retries", locks["retries"])
+    st.caption(
+        f"closed={p['closed']} · health_failed={p['health_failed']} · "
+        f"rolled_back(归还时未提交)={p['rolled_back']} · lock gave_up={locks['gave_up']}"
+    )
+
+    if RATING_WRITER == "async":
+        st.markdown("### Rating writer")
+        w = get_rating_writer().stats()
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("Queued", w["queued"])
+        c2.metric("Written", f"{w['written']} / {w['submitted']}")
+        c3.metric("Batches", w["batches"])
+        c4.metric("Last flush", f"{w['last_flush_ms']:.1f} ms")
+        st.caption(f"flush_errors={w['flush_errors']} · dead_lettered={w['dead_lettered']} "
+                   f"({RATING_DEAD_LETTER}) · last_error={w['last_error'] or '—'}")
+
+    if RATING_JOURNAL:
+        st.markdown("### Rating journal")
+        j = get_rating_journal().stats()
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("Appended", j["appended"])
+        c2.metric("Replayed", j["replayed"])
+        c3.metric("Backlog", f"{j['backlog_bytes'] / 1024:.0f} KB")
+        c4.metric("File", f"{j['bytes'] / 1024 / 1024:.1f} MB")
+        st.caption(f"acks={j['acks']} · skipped_acked={j['skipped_acked']} · foreign={j['foreign']} · "
+                   f"fsyncs={j['fsyncs']} · replay_runs={j['replay_runs']} · "
+                   f"replay_errors={j['replay_errors']} · last_error={j['last_error'] or '—'}")
+
+    if ASSIGN_MODE == "adaptive":
+        st.markdown("### Adaptive assignment")
+        a = get_adaptive_allocator().stats()
+        if a["images"]:
+            c1, c2, c3, c4 = st.columns(4)
+            c1.metric("Converged", f"{a['converged']} / {a['images']}")
+            c2.metric("Still eligible", a["eligible"])
+            c3.metric("Median CI", f"±{a['median_ci']:.2f}" if a["median_ci"] is not None else "—")
+            c4.metric("Ratings / pending", f"{a['ratings']} / {a['pending']}")
+            st.caption(f"target ±{ADAPTIVE_TARGET_CI} after ≥{ADAPTIVE_R_MIN} ratings · cap {R_TARGET}")
+        else:
+            st.caption("本进程还没有做过分配")
+
+
 # =========================
 # Router
 # =========================
-if st.session_state.stage == "intro":
+if ADMIN_TOKEN and st.query_params.get("admin") == ADMIN_TOKEN:
+    render_admin()
+elif st.session_state.stage == "intro":
     render_intro()
 elif st.session_state.stage == "training":
     render_training()
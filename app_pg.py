@@ -3,7 +3,9 @@
 
 import os
 import time
-from datetime import datetime
+import random
+import threading
+from datetime import datetime, timedelta
 from uuid import uuid4
 
 import streamlit as st
@@ -14,6 +16,20 @@ import psycopg
 from psycopg_pool import ConnectionPool
 from psycopg_pool import PoolTimeout
 
+from iqa_components import r2_prefetch, cached_img_script, progressive_image
+from build_hash_index import hashed_rel_path, HASH_LEN
+from build_previews import preview_rel_path
+from training_page import load_training_manifest, training_manifest_version, training_base_url, render_training_carousel
+from adaptive_assign import AdaptiveAllocator
+from image_catalog import ImageCatalog
+import pg_slots
+import migrations
+import pg_prepare
+from rating_writer import RatingWriter, DeadLetterFile, write_splitting
+from rating_journal import RatingJournal
+from circuit_breaker import CircuitBreaker, CircuitOpenError, QueryMetrics, is_connection_error, jittered_delay
+from pool_monitor import PoolMetrics, PoolAutosizer, warmup
+
 st.set_page_config(layout="wide")
 
 # =========================
@@ -27,6 +43,18 @@ if not DSN:
 R2_PUBLIC_BASE_URL = os.environ.get("R2_PUBLIC_BASE_URL", "").rstrip("/")
 USE_R2 = bool(R2_PUBLIC_BASE_URL)
 
+# 图片 URL 形式（内容寻址后 R2 对象可以设 Cache-Control: immutable, max-age=1年）
+#   plain      : {base}/{rel_path}
+#   hash_query : {base}/{rel_path}?v=<hash16>     （对象不用改名，只是换缓存 key）
+#   hash_path  : {base}/{stem}.<hash16>{ext}      （需要按 build_hash_index.py --copy-to 重新上传）
+# images.content_hash 为空的图自动退回 plain
+R2_URL_MODE = os.environ.get("R2_URL_MODE", "plain").strip().lower()
+
+# 评分页图片下发方式
+#   direct      : 直接显示原图
+#   progressive : 先显示 previews/ 下的低清占位图（build_previews.py 生成），原图 decode 完才能点 Next
+IMAGE_DELIVERY = os.environ.get("IMAGE_DELIVERY", "direct").strip().lower()
+
 TRAIN_DIR = "training_images"
 TRAIN_FILES = [
     "1bad.png",
@@ -48,10 +76,94 @@ LABELS = {
 # DB tuning knobs
 # =========================
 # 关键：Supabase（尤其 free）不适合开很大的真实 PG 连接数
+POOL_MIN_SIZE = int(os.environ.get("PG_POOL_MIN_SIZE", "2"))
 POOL_MAX_SIZE = int(os.environ.get("PG_POOL_MAX_SIZE", "4"))
 POOL_TIMEOUT_SEC = float(os.environ.get("PG_POOL_TIMEOUT_SEC", "8"))
+POOL_WARMUP_SEC = float(os.environ.get("PG_POOL_WARMUP_SEC", "5"))    # 启动时最多等几秒拿到第一条连接
 CONNECT_TIMEOUT_SEC = int(os.environ.get("PG_CONNECT_TIMEOUT_SEC", "5"))
 
+# 池自动调 max_size（pool_monitor.py）：默认关，先看 admin 页的等待直方图再决定要不要开
+#   有排队 / 超时 / 等待超过 PG_POOL_SLOW_WAIT_MS 且服务端剩余连接 > PG_POOL_HEADROOM_RESERVE 时 +1，
+#   长时间空闲 −1；范围 [PG_POOL_MAX_SIZE, PG_POOL_AUTOSIZE_MAX]
+PG_POOL_AUTOSIZE = os.environ.get("PG_POOL_AUTOSIZE", "0").strip() == "1"
+PG_POOL_AUTOSIZE_MAX = int(os.environ.get("PG_POOL_AUTOSIZE_MAX", str(POOL_MAX_SIZE * 2)))
+PG_POOL_AUTOSIZE_SEC = float(os.environ.get("PG_POOL_AUTOSIZE_SEC", "30"))
+PG_POOL_HEADROOM_RESERVE = int(os.environ.get("PG_POOL_HEADROOM_RESERVE", "10"))
+PG_POOL_SLOW_WAIT_MS = float(os.environ.get("PG_POOL_SLOW_WAIT_MS", "100"))
+
+# 熔断 / 重试 / 降级直连（circuit_breaker.py）
+#   连续 PG_BREAKER_FAILURES 次连不上就熔断 PG_BREAKER_RESET_SEC 秒：期间直接报“繁忙”，不再往库上压
+#   池里的连接断了按 jitter 退避重试；池超时不重试，直接降级直连，但同时最多 PG_FALLBACK_MAX_CONN 条
+PG_BREAKER_FAILURES = int(os.environ.get("PG_BREAKER_FAILURES", "5"))
+PG_BREAKER_RESET_SEC = float(os.environ.get("PG_BREAKER_RESET_SEC", "10"))
+PG_RETRY_ATTEMPTS = int(os.environ.get("PG_RETRY_ATTEMPTS", "2"))
+PG_RETRY_BASE_SEC = 0.2
+PG_RETRY_CAP_SEC = 2.0
+PG_FALLBACK_MAX_CONN = int(os.environ.get("PG_FALLBACK_MAX_CONN", "1"))
+PG_FALLBACK_WAIT_SEC = 2.0
+
+# Admin 页：URL 加 ?admin=<IQA_ADMIN_TOKEN> 才能看到（没设 token 就不开放）
+ADMIN_TOKEN = os.environ.get("IQA_ADMIN_TOKEN", "").strip()
+
+# 服务端 prepared statement（见 pg_prepare.py）
+#   off : 默认，任何连接池 / pgbouncer 前面都安全
+#   on  : 确认是直连或 session 模式时显式打开；同一条 SQL 在一条连接上跑满 PG_PREPARE_THRESHOLD 次后自动 prepare
+#   auto: 旧值，按 off 处理
+PG_PREPARE_MODE = os.environ.get("PG_PREPARE_MODE", "off").strip().lower()
+PG_PREPARE_THRESHOLD = int(os.environ.get("PG_PREPARE_THRESHOLD", str(pg_prepare.DEFAULT_PREPARE_THRESHOLD)))
+if PG_PREPARE_MODE not in pg_prepare.PREPARE_MODES:
+    st.error(f"PG_PREPARE_MODE 只能是 {'/'.join(pg_prepare.PREPARE_MODES)}，当前是 {PG_PREPARE_MODE!r}")
+    st.stop()
+PG_PREPARED = pg_prepare.use_prepared(PG_PREPARE_MODE)
+PG_PREPARE = pg_prepare.execute_prepare_arg(PG_PREPARED)
+
+# =========================
+# Client-side prefetch
+# =========================
+# 评分页后台预取接下来多少张（含当前这张），以及浏览器端并发下载数
+PREFETCH_WINDOW = int(os.environ.get("PREFETCH_WINDOW", "12"))
+PREFETCH_CONCURRENCY = int(os.environ.get("PREFETCH_CONCURRENCY", "4"))
+
+# =========================
+# Assignment mode
+# =========================
+#   plan     : 按 assignment_plan 的 slot 拷贝（每张图固定 r_target 次）
+#   adaptive : 按每张图 MOS 的 95% CI 半宽选图（adaptive_assign.py），CI 已够窄的图不再分配
+ASSIGN_MODE = os.environ.get("ASSIGN_MODE", "plan").strip().lower()
+ADAPTIVE_R_MIN = int(os.environ.get("ADAPTIVE_R_MIN", "10"))
+ADAPTIVE_TARGET_CI = float(os.environ.get("ADAPTIVE_TARGET_CI", "0.3"))
+ADAPTIVE_REFRESH_SEC = float(os.environ.get("ADAPTIVE_REFRESH_SEC", "30"))  # 多久从 DB 同步一次统计
+# 超过这么多分钟没分配 / 评分的人，手上没评的图不再算 pending（否则中途走掉的人永远占着名额）
+ADAPTIVE_PENDING_STALE_MIN = float(os.environ.get("ADAPTIVE_PENDING_STALE_MIN", "60"))
+COVER_M = 2
+
+# slot 分配方式（见 pg_slots.py）
+#   counter  : slot_counter 单行 FOR UPDATE 轮转（默认；所有注册在这一行上串行，但回滚 / 重试不丢号）
+#   sequence : nextval('slot_seq') % p_total 轮转，不拿行锁；nextval 不随事务回滚，
+#              熔断重试 / 降级重跑 / 注册失败都会白白跳过 slot，plan 的每图次数就不均了
+#   lease    : 租约——优先给没人持有 / 租约过期里完成度最低的 slot，评分时续租
+# 本地 PG 16 上 100 人同时注册（池 4）：counter p99 84–119ms，sequence 36–58ms，差距不值得丢号
+PG_SLOT_MODE = os.environ.get("PG_SLOT_MODE", "counter").strip().lower()
+PG_SLOT_LEASE_MIN = int(os.environ.get("PG_SLOT_LEASE_MIN", str(pg_slots.SLOT_LEASE_MIN)))
+
+# 评分写入方式（rating_writer.py）
+#   async : 放进本进程后台线程的队列，攒批 executemany（一个事务）；点 Next 不用等池 / 网络
+#   sync  : 当场 pg_exec（原来的做法）
+RATING_WRITER = os.environ.get("RATING_WRITER", "async").strip().lower()
+RATING_BATCH_SIZE = int(os.environ.get("RATING_BATCH_SIZE", "50"))
+RATING_FLUSH_MS = float(os.environ.get("RATING_FLUSH_MS", "20"))
+RATING_DONE_WAIT_SEC = 10   # 结束页最多等几秒让本人的评分全部落库
+
+# 评分本地预写日志（rating_journal.py）：先追加到本地文件再写库，库挂了也不丢；空字符串关闭
+#   文件名和 app5 的分开（列顺序不同）；行上另有 schema 标记，回放不认别的 app 写的行
+RATING_JOURNAL = os.environ.get("RATING_JOURNAL", "ratings_journal_pg.jsonl").strip()
+RATING_JOURNAL_SCHEMA = "pg-ratings-v1"   # INSERT_RATING_SQL 的 7 列；lease 模式再加 3 个续租参数
+RATING_JOURNAL_FSYNC_MS = float(os.environ.get("RATING_JOURNAL_FSYNC_MS", "50"))
+RATING_JOURNAL_REPLAY_SEC = float(os.environ.get("RATING_JOURNAL_REPLAY_SEC", "30"))
+# 写不进库的坏行（约束 / 类型错误）挪到这里，不挡后面的评分；连不上 / 熔断 / 锁超时才重试
+RATING_DEAD_LETTER = os.environ.get("RATING_DEAD_LETTER", "ratings_dead_letter_pg.jsonl").strip()
+RATING_TRANSIENT_ERRORS = (PoolTimeout, CircuitOpenError, psycopg.OperationalError, psycopg.InterfaceError)
+
 # =========================
 # One-time schema check (NO POOL)
 # =========================
@@ -62,74 +174,15 @@ def ensure_schema_once():
     ✅ 不依赖 psycopg_pool（避免启动阶段 pool 就卡死）
     """
     with psycopg.connect(DSN, connect_timeout=CONNECT_TIMEOUT_SEC) as conn:
+        migrations.migrate_pg(conn)
         with conn.cursor() as cur:
-            cur.execute("""
-            CREATE TABLE IF NOT EXISTS participants (
-                participant_id TEXT PRIMARY KEY,
-                student_id TEXT,
-                device TEXT,
-                screen_resolution TEXT,
-                start_time TIMESTAMP,
-                slot INTEGER
-            );
-            """)
-
-            cur.execute("""
-            CREATE TABLE IF NOT EXISTS assignments (
-                participant_id TEXT NOT NULL,
-                image_id TEXT NOT NULL,
-                ord INTEGER NOT NULL,
-                assigned_time TIMESTAMP NOT NULL,
-                PRIMARY KEY (participant_id, image_id)
-            );
-            """)
-
-            cur.execute("""
-            CREATE TABLE IF NOT EXISTS ratings (
-                participant_id TEXT,
-                image_id TEXT,
-                image_name TEXT,
-                score INTEGER,
-                label TEXT,
-                time TIMESTAMP,
-                text_clarity TEXT
-            );
-            """)
-
-            cur.execute("""
-            CREATE TABLE IF NOT EXISTS slot_counter (
-                id INTEGER PRIMARY KEY DEFAULT 1,
-                next_slot INTEGER NOT NULL
-            );
-            """)
-            cur.execute("""
-            INSERT INTO slot_counter (id, next_slot)
-            VALUES (1, 1)
-            ON CONFLICT (id) DO NOTHING;
-            """)
-
-            cur.execute("""
-            CREATE TABLE IF NOT EXISTS exp_config (
-                id INTEGER PRIMARY KEY DEFAULT 1,
-                p_total INTEGER NOT NULL,
-                r_target INTEGER NOT NULL,
-                n_images INTEGER NOT NULL,
-                k_per_person INTEGER NOT NULL,
-                updated_at TIMESTAMP NOT NULL
-            );
-            """)
-
-            cur.execute("""
-            DO $$
-            BEGIN
-                IF NOT EXISTS (
-                    SELECT 1 FROM information_schema.columns
-                    WHERE table_name='participants' AND column_name='slot'
-                ) THEN
-                    ALTER TABLE participants ADD COLUMN slot INTEGER;
-                END IF;
-            END $$;
-            """)
+            pg_slots.init_slot_seq(cur)
+            if PG_SLOT_MODE == "lease":
+                pg_slots.init_slots(cur)
+                cur.execute("SELECT to_regclass('assignment_plan') IS NOT NULL, EXISTS (SELECT 1 FROM slots)")
+                has_plan, has_slots = cur.fetchone()
+                if has_plan and not has_slots:
+                    pg_slots.sync_slots(cur)
         conn.commit()
 
 ensure_schema_once()
@@ -141,15 +194,95 @@ ensure_schema_once()
 def get_pool():
     # ✅ 小池 + 短超时：避免把 Supabase 撑爆
     # ✅ connect_timeout：避免握手卡住占用连接
-    return ConnectionPool(
+    # ✅ 预热：先借一条连接探一下再接请求；失败只记下来（池不关），之后交给熔断器
+    p = ConnectionPool(
         conninfo=DSN,
-        min_size=2,
+        min_size=POOL_MIN_SIZE,
         max_size=POOL_MAX_SIZE,
         timeout=POOL_TIMEOUT_SEC,
-        kwargs={"connect_timeout": CONNECT_TIMEOUT_SEC},
+        kwargs={"connect_timeout": CONNECT_TIMEOUT_SEC, **pg_prepare.connect_kwargs(PG_PREPARED, PG_PREPARE_THRESHOLD)},
     )
+    return p, warmup(p, POOL_WARMUP_SEC)
+
+pool, pool_warmup = get_pool()
+
+@st.cache_resource
+def get_db_guard():
+    """每个进程一份：熔断器、查询统计、池统计、降级直连的并发上限"""
+    return (
+        CircuitBreaker(PG_BREAKER_FAILURES, PG_BREAKER_RESET_SEC),
+        QueryMetrics(),
+        PoolMetrics(PG_POOL_SLOW_WAIT_MS),
+        threading.BoundedSemaphore(PG_FALLBACK_MAX_CONN),
+    )
+
+breaker, query_metrics, pool_metrics, fallback_slots = get_db_guard()
+
+
+def _with_pool_or_fallback(op):
+    """
+    op(cur, prepare) 在一个事务里执行（连接的 with 块正常退出时 commit）
+    1) 池连接：连接坏了（is_connection_error）jitter 退避重试；池超时不重试
+       服务端正常返回的 OperationalError（语句被取消、锁超时、死锁）直接抛出，不重试也不降级
+    2) 降级：direct psycopg.connect，但受 fallback_slots 限制，拿不到就当池超时
+    等池连接的时间 / 超时 / 降级次数记进 pool_metrics
+    """
+    for attempt in range(PG_RETRY_ATTEMPTS):
+        t_wait = time.perf_counter()
+        try:
+            with pool.connection(timeout=POOL_TIMEOUT_SEC) as conn:
+                pool_metrics.checkout(time.perf_counter() - t_wait)
+                try:
+                    with conn.cursor() as cur:
+                        return op(cur, PG_PREPARE)
+                finally:
+                    pool_metrics.checkin()
+        except PoolTimeout:
+            pool_metrics.timeout()
+            break
+        except (psycopg.OperationalError, psycopg.InterfaceError) as e:
+            if not is_connection_error(e):
+                raise
+            if attempt + 1 < PG_RETRY_ATTEMPTS:
+                time.sleep(jittered_delay(attempt, PG_RETRY_BASE_SEC, PG_RETRY_CAP_SEC))
+
+    if not fallback_slots.acquire(timeout=PG_FALLBACK_WAIT_SEC):
+        raise PoolTimeout("pool exhausted and all fallback connections busy")
+    pool_metrics.fallback()
+    try:
+        with psycopg.connect(DSN, connect_timeout=CONNECT_TIMEOUT_SEC, prepare_threshold=None) as conn:
+            with conn.cursor() as cur:
+                return op(cur, False)
+    finally:
+        fallback_slots.release()
+
+
+def _guarded(name: str, op):
+    """
+    熔断检查 + 统计；熔断中抛 CircuitOpenError（页面显示“繁忙”，评分留在本地队列 / 日志里）
+    每条放行的调用都要给熔断器一个结果，否则 half_open 的探测名额一直占着
+    """
+    breaker.check()
+    t0 = time.perf_counter()
+    try:
+        result = _with_pool_or_fallback(op)
+    except psycopg.Error as e:
+        # 连不上 / 池超时计入熔断；SQL 本身的错说明数据库还活着
+        if is_connection_error(e):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        query_metrics.record(name, time.perf_counter() - t0, False)
+        raise
+    except BaseException:
+        # 不是数据库的错（代码 bug、中断）：状态不变，探测名额还回去
+        breaker.release()
+        query_metrics.record(name, time.perf_counter() - t0, False)
+        raise
+    breaker.record_success()
+    query_metrics.record(name, time.perf_counter() - t0, True)
+    return result
 
-pool = get_pool()
 
 def _execute_with_fallback(fetch: str, sql: str, params=()):
     """
@@ -157,44 +290,17 @@ def _execute_with_fallback(fetch: str, sql: str, params=()):
       - "one": fetchone
       - "all": fetchall
       - "none": no fetch, commit
-    关键修复：
-    1) 先尝试 pool.connection()
-    2) 如果 PoolTimeout / 连接异常：降级为 direct psycopg.connect 执行一次
+    池连接按 PG_PREPARE_MODE 决定是否 prepare；降级的一次性连接始终 prepare=False
     """
-    # --- 1) try pool ---
-    try:
-        with pool.connection(timeout=POOL_TIMEOUT_SEC) as conn:
-            with conn.cursor() as cur:
-                cur.execute(sql, params, prepare=False)
-                if fetch == "one":
-                    return cur.fetchone()
-                if fetch == "all":
-                    return cur.fetchall()
-            # fetch == "none"
-            conn.commit()
-            return None
-    except PoolTimeout:
-        # --- 2) fallback direct connect ---
-        with psycopg.connect(DSN, connect_timeout=CONNECT_TIMEOUT_SEC) as conn:
-            with conn.cursor() as cur:
-                cur.execute(sql, params, prepare=False)
-                if fetch == "one":
-                    return cur.fetchone()
-                if fetch == "all":
-                    return cur.fetchall()
-            conn.commit()
-            return None
-    except psycopg.Error:
-        # pool 里的某些连接坏掉/断开时，直接降级也能救
-        with psycopg.connect(DSN, connect_timeout=CONNECT_TIMEOUT_SEC) as conn:
-            with conn.cursor() as cur:
-                cur.execute(sql, params, prepare=False)
-                if fetch == "one":
-                    return cur.fetchone()
-                if fetch == "all":
-                    return cur.fetchall()
-            conn.commit()
-            return None
+    def op(cur, prepare):
+        cur.execute(sql, params, prepare=prepare)
+        if fetch == "one":
+            return cur.fetchone()
+        if fetch == "all":
+            return cur.fetchall()
+        return None
+
+    return _guarded(QueryMetrics.name_of(sql), op)
 
 def pg_fetchall(sql, params=()):
     return _execute_with_fallback("all", sql, params)
@@ -205,46 +311,81 @@ def pg_fetchone(sql, params=()):
 def pg_exec(sql, params=()):
     _execute_with_fallback("none", sql, params)
 
+def pg_execmany(sql, seq_params):
+    """一个事务写一批（后台评分写入用）；熔断 / 重试 / 降级和上面一样"""
+    seq_params = list(seq_params)
+    return _guarded("executemany: " + QueryMetrics.name_of(sql), lambda cur, _prepare: cur.executemany(sql, seq_params))
+
+def pg_connection_headroom() -> int:
+    """服务端还能再开几条连接（max_connections − 保留给超级用户的 − 当前已用）"""
+    return pg_fetchone(
+        "SELECT current_setting('max_connections')::int"
+        " - current_setting('superuser_reserved_connections')::int"
+        " - (SELECT COUNT(*) FROM pg_stat_activity)"
+    )[0]
+
+@st.cache_resource
+def get_pool_autosizer():
+    return PoolAutosizer(
+        pool, pool_metrics, pg_connection_headroom,
+        floor=POOL_MAX_SIZE, ceiling=PG_POOL_AUTOSIZE_MAX,
+        reserve=PG_POOL_HEADROOM_RESERVE, interval_sec=PG_POOL_AUTOSIZE_SEC,
+    )
+
+if PG_POOL_AUTOSIZE:
+    get_pool_autosizer()
+
 # =========================
 # Core helpers
 # =========================
 @st.cache_data(ttl=10, show_spinner=False)
 def get_exp_config_cached():
-    r = pg_fetchone("SELECT n_images, k_per_person, p_total, r_target FROM exp_config WHERE id=1")
+    r = pg_fetchone("SELECT n_images, k_per_person, p_total, r_target, updated_at FROM exp_config WHERE id=1")
     return r
 
+@st.cache_data(show_spinner=False)
+def load_training_manifest_cached(version):
+    return load_training_manifest()
+
+def get_training_manifest():
+    """按 manifest 的 mtime 缓存；还没生成时不缓存，之后跑 build_training_assets.py 不用重启"""
+    version = training_manifest_version()
+    if version is None:
+        return None
+    return load_training_manifest_cached(version)
+
 def get_exp_config():
     r = get_exp_config_cached()
     if not r:
-        st.error("数据库缺少 exp_config（你需要先运行 make_assignment_plan_from_manifest.py 导入）")
+        st.error("数据库缺少 exp_config（你需要先运行 import_plan_to_pg.py 导入）")
         st.stop()
-    n_images, k_per, p_total, r_target = r
+    n_images, k_per, p_total, r_target = r[:4]
     return int(n_images), int(k_per), int(p_total), int(r_target)
 
 def allocate_next_slot(p_total: int) -> int:
+    """轮转：counter 模式走 slot_counter 单行，sequence 模式走 slot_seq（无行锁，但重试会跳号）"""
     if p_total <= 0:
         return 1
-    row = pg_fetchone(
-        """
-        WITH s AS (
-            SELECT next_slot
-            FROM slot_counter
-            WHERE id=1
-            FOR UPDATE
-        ),
-        u AS (
-            UPDATE slot_counter
-            SET next_slot = (s.next_slot %% %s) + 1
-            FROM s
-            WHERE id=1
-            RETURNING s.next_slot AS slot_assigned
-        )
-        SELECT slot_assigned FROM u;
-        """,
-        (p_total,)
-    )
+    sql = pg_slots.COUNTER_SLOT_SQL if PG_SLOT_MODE == "counter" else pg_slots.SEQUENCE_SLOT_SQL
+    row = pg_fetchone(sql, (p_total,))
     return int(row[0]) if row and row[0] is not None else 1
 
+def lease_slot(pid: str):
+    """PG_SLOT_MODE=lease：拿一个 slot 并记 pid 为持有者；没有空闲 slot 返回 None"""
+    for _ in range(3):   # 极少数情况下抢输了（返回 0 行）就再选一次
+        row = pg_fetchone(pg_slots.LEASE_SLOT_SQL, (pid, PG_SLOT_LEASE_MIN))
+        if row:
+            return int(row[0])
+    return None
+
+def allocate_slot(pid: str, p_total: int) -> int:
+    if PG_SLOT_MODE == "lease":
+        slot = lease_slot(pid)
+        if slot is not None:
+            return slot
+        # 所有 slot 都有人在做或已经做完：退回 slot_seq 轮转，多出来的人给已有 slot 加评分
+    return allocate_next_slot(p_total)
+
 def get_plan_image_ids_for_slot(slot: int):
     rows = pg_fetchall(
         "SELECT image_id FROM assignment_plan WHERE slot=%s ORDER BY ord ASC",
@@ -252,9 +393,81 @@ def get_plan_image_ids_for_slot(slot: int):
     )
     return [r[0] for r in rows]
 
-def get_rel_path(image_id: str):
-    r = pg_fetchone("SELECT rel_path FROM images WHERE image_id=%s", (image_id,))
-    return r[0] if r else None
+def get_rel_paths(image_ids):
+    """一次查一批（预取窗口用），避免 N 次 round-trip"""
+    if not image_ids:
+        return {}
+    rows = pg_fetchall(
+        "SELECT image_id, rel_path, content_hash FROM images WHERE image_id = ANY(%s)",
+        (list(image_ids),)
+    )
+    return {r[0]: (r[1], r[2]) for r in rows}
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def load_image_catalog(version):
+    """整表读一次，所有 session 共用；version 只作缓存 key（exp_config.updated_at，重新导入后会变）"""
+    return ImageCatalog(pg_fetchall("SELECT image_id, rel_path, content_hash FROM images"), version)
+
+def get_image_catalog():
+    r = get_exp_config_cached()
+    return load_image_catalog(r[4] if r else None)
+
+def lookup_rel_paths(image_ids):
+    """image_id -> (rel_path, content_hash)；目录里没有的（改了 images 却没更新 exp_config）才查库"""
+    catalog = get_image_catalog()
+    refs = {i: catalog.get(i) for i in image_ids}
+    missing = [i for i, r in refs.items() if r is None]
+    if missing:
+        refs.update(get_rel_paths(missing))
+    return refs
+
+def image_url(rel_path: str, content_hash=None) -> str:
+    if content_hash and R2_URL_MODE == "hash_path":
+        return f"{R2_PUBLIC_BASE_URL}/{hashed_rel_path(rel_path, content_hash)}"
+    if content_hash and R2_URL_MODE == "hash_query":
+        return f"{R2_PUBLIC_BASE_URL}/{rel_path}?v={content_hash[:HASH_LEN]}"
+    return f"{R2_PUBLIC_BASE_URL}/{rel_path}"
+
+@st.cache_resource
+def get_adaptive_allocator(r_target: int):
+    return AdaptiveAllocator(ADAPTIVE_R_MIN, r_target, ADAPTIVE_TARGET_CI)
+
+def pick_adaptive_image_ids(k_per: int, r_target: int):
+    """
+    每 ADAPTIVE_REFRESH_SEC 秒同步一次：
+    - 评分统计读 image_stats（触发器维护，6000 行主键扫描），不再 GROUP BY 整张 ratings
+    - pending 只数最近 ADAPTIVE_PENDING_STALE_MIN 分钟有动静、还没做完的人手上没评的图
+      （idx_progress_activity 找人，assignments / ratings 主键逐人查），和历史总量无关
+    两次同步之间本进程发出去的图记在 pending 里，下次同步以 DB 为准
+    """
+    alloc = get_adaptive_allocator(r_target)
+    with alloc.lock:
+        if not alloc.loaded or time.time() - alloc.refreshed_at > ADAPTIVE_REFRESH_SEC:
+            if not alloc.loaded:
+                alloc.load_catalog(pg_fetchall("SELECT image_id, category, resolution, distortion FROM images"))
+            alloc.set_rating_stats(pg_fetchall("SELECT image_id, n, s1, s2 FROM image_stats"))
+            alloc.set_pending(pg_fetchall(
+                """
+                SELECT a.image_id, COUNT(*)
+                FROM participant_progress pp
+                JOIN assignments a ON a.participant_id = pp.participant_id
+                WHERE pp.last_activity > %s
+                  AND pp.done < pp.total
+                  AND NOT EXISTS (
+                      SELECT 1 FROM ratings r
+                      WHERE r.participant_id = a.participant_id AND r.image_id = a.image_id
+                  )
+                GROUP BY a.image_id
+                """,
+                (datetime.now() - timedelta(minutes=ADAPTIVE_PENDING_STALE_MIN),)
+            ))
+            alloc.refreshed_at = time.time()
+
+        idx = alloc.select(k_per, COVER_M)
+        alloc.add_pending(idx)
+    image_ids = alloc.ids(idx)
+    random.shuffle(image_ids)
+    return image_ids
 
 def get_assigned_image_ids(pid: str):
     rows = pg_fetchall(
@@ -271,10 +484,22 @@ def assign_images_for_participant(pid: str, slot: int):
     if exist:
         return
 
-    image_ids = get_plan_image_ids_for_slot(slot)
-    if not image_ids:
-        st.error(f"assignment_plan 里找不到 slot={slot} 的数据（请检查 plan 导入）")
-        st.stop()
+    if ASSIGN_MODE == "adaptive":
+        _n_images, k_per, _p_total, r_target = get_exp_config()
+        image_ids = pick_adaptive_image_ids(k_per, r_target)
+        if not image_ids:
+            st.error("所有图片的 MOS 置信区间都已达到目标，暂时没有需要评分的图片")
+            st.stop()
+    elif PG_SLOT_MODE == "lease":
+        # 接手过期 slot 时，上一个持有者已经评过的图不再发
+        image_ids = [r[0] for r in pg_fetchall(pg_slots.UNRATED_PLAN_IMAGES_SQL, (slot,))]
+        if not image_ids:
+            image_ids = get_plan_image_ids_for_slot(slot)
+    else:
+        image_ids = get_plan_image_ids_for_slot(slot)
+        if not image_ids:
+            st.error(f"assignment_plan 里找不到 slot={slot} 的数据（请检查 import_plan_to_pg.py 导入）")
+            st.stop()
 
     now = datetime.now()
     ords = list(range(len(image_ids)))
@@ -289,57 +514,122 @@ def assign_images_for_participant(pid: str, slot: int):
         (pid, now, image_ids, ords)
     )
 
-def get_existing_participant_by_student(student_id: str):
-    row = pg_fetchone(
-        """
-        SELECT p.participant_id, p.slot
-        FROM participants p
-        JOIN (
-          SELECT participant_id, COUNT(*) AS n_assign
-          FROM assignments
-          GROUP BY participant_id
-        ) a ON a.participant_id = p.participant_id
-        LEFT JOIN (
-          SELECT participant_id, COUNT(*) AS n_rate
-          FROM ratings
-          GROUP BY participant_id
-        ) r ON r.participant_id = p.participant_id
-        WHERE p.student_id = %s
-          AND COALESCE(r.n_rate, 0) < a.n_assign
-        ORDER BY p.start_time DESC
-        LIMIT 1
-        """,
-        (student_id,)
-    )
-    if row:
-        return row[0], int(row[1])
+# 老同学回来：一条语句拿齐 participant / slot / 进度 / 已分配列表
+# 只碰这个学号自己的行：participants 走 idx_participants_student，
+# done / total 是 participant_progress 的主键读（触发器维护），ARRAY 走 assignments 主键，和全表评分数无关
+# 优先最近一次没做完的；都做完了就返回最近一次（image_ids 为空）
+BOOTSTRAP_SQL = """
+WITH mine AS (
+    SELECT p.participant_id, p.slot, p.start_time,
+           COALESCE(pp.total, 0) AS total,
+           COALESCE(pp.done, 0) AS done
+    FROM participants p
+    LEFT JOIN participant_progress pp ON pp.participant_id = p.participant_id
+    WHERE p.student_id = %s
+),
+pick AS (
+    SELECT *
+    FROM mine
+    ORDER BY (total > 0 AND done < total) DESC, start_time DESC
+    LIMIT 1
+)
+SELECT participant_id, slot, done, total,
+       CASE WHEN done < total THEN
+           ARRAY(SELECT a.image_id FROM assignments a WHERE a.participant_id = pick.participant_id ORDER BY a.ord)
+       END AS image_ids
+FROM pick;
+"""
+
+def get_participant_bootstrap(student_id: str):
+    """返回 (participant_id, slot, done, total, image_ids)；这个学号没来过返回 None"""
+    row = pg_fetchone(BOOTSTRAP_SQL, (student_id,))
+    if not row:
+        return None
+    pid, slot, done, total, image_ids = row
+    return pid, int(slot), int(done), int(total), list(image_ids or [])
+
+def restore_session(pid: str, slot: int, done: int, total: int, image_ids):
+    st.session_state.participant_id = pid
+    st.session_state.slot = slot
+    st.session_state.idx = done
+    st.session_state.stage = "rating" if done < total else "done"
+    # 评分页直接用，不用再查一次 assignments
+    st.session_state.assigned_ids = image_ids
+    st.session_state.assigned_pid = pid
 
-    row2 = pg_fetchone(
-        """
-        SELECT participant_id, slot
-        FROM participants
-        WHERE student_id=%s
-        ORDER BY start_time DESC
-        LIMIT 1
-        """,
-        (student_id,)
+# (participant_id, image_id) 已经有评分就跳过（唯一索引 idx_ratings_pid_image，见 migrations.py）：
+# 评分日志回放和正常写入重叠、甚至并发时都不会多一条
+INSERT_RATING_SQL = """
+INSERT INTO ratings (participant_id, image_id, image_name, score, label, time, text_clarity)
+VALUES (%s::text, %s::text, %s::text, %s::int, %s::text, %s::timestamp, %s::text)
+ON CONFLICT (participant_id, image_id) DO NOTHING
+"""
+
+
+def insert_ratings(rows):
+    """lease 模式的行多 3 个续租参数；按长度分开写（日志里可能混着切换模式前的行）"""
+    plain = [r for r in rows if len(r) == 7]
+    lease = [r for r in rows if len(r) == 10]
+    if plain:
+        pg_execmany(INSERT_RATING_SQL, plain)
+    if lease:
+        pg_execmany(pg_slots.INSERT_RATING_AND_RENEW_SQL, lease)
+
+
+@st.cache_resource
+def get_rating_dead_letter():
+    return DeadLetterFile(RATING_DEAD_LETTER)
+
+
+@st.cache_resource
+def get_rating_journal():
+    """RATING_JOURNAL 非空时用；启动时先把上次没写进库（没 ack）的回放掉，坏行进 dead-letter"""
+    if not RATING_JOURNAL:
+        return None
+    dead_letter = get_rating_dead_letter()
+    journal = RatingJournal(RATING_JOURNAL, RATING_JOURNAL_SCHEMA, fsync_ms=RATING_JOURNAL_FSYNC_MS)
+    journal.start_replayer(
+        lambda rows: write_splitting(insert_ratings, rows, RATING_TRANSIENT_ERRORS, dead_letter),
+        interval_sec=RATING_JOURNAL_REPLAY_SEC,
     )
-    if row2:
-        return row2[0], int(row2[1])
+    return journal
 
-    return None
 
-def get_progress(pid: str):
-    done = pg_fetchone("SELECT COUNT(*) FROM ratings WHERE participant_id=%s", (pid,))[0]
-    total = pg_fetchone("SELECT COUNT(*) FROM assignments WHERE participant_id=%s", (pid,))[0]
-    return int(done), int(total)
+@st.cache_resource
+def get_rating_writer():
+    """RATING_WRITER=async 用；每个进程一个后台线程。lease 模式下每条评分同时续租（同一条 CTE）"""
+    return RatingWriter(insert_ratings, batch_size=RATING_BATCH_SIZE, flush_ms=RATING_FLUSH_MS,
+                        transient_errors=RATING_TRANSIENT_ERRORS, dead_letter=get_rating_dead_letter(),
+                        journal=get_rating_journal())
+
+
+def save_rating(pid, image_id, rel_path, score, text_clarity):
+    # 时间用字符串：要写进评分日志（JSON），SQL 里 ::timestamp 转回来
+    now = datetime.now().isoformat(sep=" ")
+    row = (pid, image_id, rel_path, int(score), LABELS[int(score)], now, str(text_clarity))
+    if PG_SLOT_MODE == "lease":
+        row += (pid, PG_SLOT_LEASE_MIN, st.session_state.slot)
+    journal = get_rating_journal()
+    journal_id = journal.append(row) if journal is not None else None
+    if RATING_WRITER == "async":
+        st.session_state.rating_tickets.append(get_rating_writer().submit(row, journal_id))
+        return
+    if PG_SLOT_MODE == "lease":
+        pg_exec(pg_slots.INSERT_RATING_AND_RENEW_SQL, row)
+    else:
+        pg_exec(INSERT_RATING_SQL, row)
+    if journal is not None:
+        journal.ack([journal_id])
+
+
+def rating_save_status():
+    """去掉已落库的 ticket，返回 (还没落库的条数, 最近一次写库错误)"""
+    if RATING_WRITER != "async" or not st.session_state.rating_tickets:
+        return 0, None
+    writer = get_rating_writer()
+    st.session_state.rating_tickets = writer.pending(st.session_state.rating_tickets)
+    return len(st.session_state.rating_tickets), writer.stats()["last_error"]
 
-def restore_session(pid: str, slot: int):
-    done, total = get_progress(pid)
-    st.session_state.participant_id = pid
-    st.session_state.slot = slot
-    st.session_state.idx = done
-    st.session_state.stage = "rating" if done < total else "done"
 
 # =========================
 # Session State
@@ -352,6 +642,8 @@ if "slot" not in st.session_state:
     st.session_state.slot = None
 if "idx" not in st.session_state:
     st.session_state.idx = 0
+if "rating_tickets" not in st.session_state:
+    st.session_state.rating_tickets = []
 
 # =========================
 # Pages
@@ -411,19 +703,18 @@ def render_intro():
 
     sid = student_id.strip()
 
-    existing = get_existing_participant_by_student(sid)
+    existing = get_participant_bootstrap(sid)
     if existing:
-        old_pid, old_slot = existing
-        done, total = get_progress(old_pid)
+        old_pid, old_slot, done, total, image_ids = existing
         if total > 0 and done < total:
             st.success(f"检测到你之前未完成的进度：{done}/{total}，已为你继续。")
-            restore_session(old_pid, old_slot)
+            restore_session(old_pid, old_slot, done, total, image_ids)
             st.rerun()
             return
         st.info("检测到你之前已经完成过本实验。本次将开始新一轮。")
 
     pid = str(uuid4())
-    slot = allocate_next_slot(p_total)
+    slot = allocate_slot(pid, p_total)
 
     pg_exec(
         """
@@ -466,6 +757,14 @@ def render_training():
         f"5 — {LABELS[5]}",
     ]
 
+    # ✅ 有 build_training_assets.py 生成的素材就直接引用 URL（本地 static / R2 都行）
+    # Prev / Next 在 iframe 里切换，不触发 rerun
+    manifest = get_training_manifest()
+    if manifest:
+        render_training_carousel(manifest, caps, training_base_url(R2_PUBLIC_BASE_URL))
+        start_rating_button()
+        return
+
     if not USE_R2:
         st.error("Training 阶段需要 R2_PUBLIC_BASE_URL（建议走 R2）")
         st.stop()
@@ -522,6 +821,9 @@ def render_training():
         height=820,
     )
 
+    start_rating_button()
+
+def start_rating_button():
     st.markdown("<div style='height: 10px;'></div>", unsafe_allow_html=True)
 
     if st.button("Next → Start Rating"):
@@ -560,6 +862,9 @@ def render_rating():
 
     st.progress(done / total, text=f"Progress: {done}/{total} images completed")
     st.caption(f"Elapsed: {elapsed/60:.1f} min · Avg: {sec_per:.1f}s/image · ETA: {remaining_sec/60:.1f} min")
+    unsaved, save_error = rating_save_status()
+    if unsaved and save_error:
+        st.caption(f"⏳ {unsaved} 条评分正在保存（数据库暂时写不进去，会自动重试）")
 
     if done >= total:
         st.session_state.stage = "done"
@@ -567,65 +872,64 @@ def render_rating():
         return
 
     image_id = assigned_ids[done]
-    rel_key = f"rel_{image_id}"
-    if rel_key not in st.session_state:
-        st.session_state[rel_key] = get_rel_path(image_id)
-    rel_path = st.session_state[rel_key]
+    # 当前这张 + 预取窗口一起从进程内目录取，不查库、不往 session 里存
+    window_ids = assigned_ids[done:done + PREFETCH_WINDOW]
+    refs = lookup_rel_paths(window_ids)
+    ref = refs.get(image_id)
 
-    if not rel_path:
+    if not ref:
         st.error(f"images 表里找不到 image_id={image_id}")
         st.stop()
+    rel_path, content_hash = ref
 
     left, right = st.columns([3.6, 1.4], gap="large")
 
     with left:
         if USE_R2:
-            img_url = f"{R2_PUBLIC_BASE_URL}/{rel_path}"
-
-            img_url = f"{R2_PUBLIC_BASE_URL}/{rel_path}"
+            img_url = image_url(rel_path, content_hash)
 
-            # 预取下一张（如果有）
-            next_url = None
-            if done + 1 < total:
-                next_id = assigned_ids[done + 1]
-                next_rel = st.session_state.get(f"rel_{next_id}")
-                if not next_rel:
-                    next_rel = get_rel_path(next_id)
-                    st.session_state[f"rel_{next_id}"] = next_rel
-                if next_rel:
-                    next_url = f"{R2_PUBLIC_BASE_URL}/{next_rel}"
+            # ✅ 预取窗口：当前这张 + 后面 PREFETCH_WINDOW-1 张
+            window_urls = [image_url(*refs[i]) for i in window_ids if refs.get(i)]
 
             # st.image(img_url, caption=rel_path, use_container_width=True)
-            preload_html = ""
-            if next_url:
-                preload_html = f'<link rel="preload" as="image" href="{next_url}">'
-            
-            components.html(
-                f"""
-                <head>
-                  {preload_html}
-                </head>
-                <div style="
-                    width:100%;
-                    height:78vh;
-                    border:1px solid #eee;
-                    border-radius:8px;
-                    display:flex;
-                    justify-content:center;
-                    align-items:center;
-                    background:#fafafa;
-                    overflow:hidden;
-                ">
-                  <img src="{img_url}"
-                       style="max-width:1600px; max-height:100%; width:auto; height:auto; object-fit:contain;"
-                       decoding="async"
-                       loading="eager"
-                  />
-                </div>
-                <div style="font-size:12px; opacity:0.7; margin-top:6px;">{rel_path}</div>
-                """,
-                height=860,
-            )
+            prefetch = r2_prefetch(window_urls, concurrency=PREFETCH_CONCURRENCY)
+            if prefetch:
+                st.caption(f"Prefetched: {prefetch['ready']}/{prefetch['total']}")
+
+            if IMAGE_DELIVERY == "progressive":
+                loaded = progressive_image(
+                    image_id,
+                    full_url=img_url,
+                    preview_url=f"{R2_PUBLIC_BASE_URL}/{preview_rel_path(rel_path)}",
+                    caption=rel_path,
+                )
+                full_ready = bool(loaded and loaded.get("image_id") == image_id and loaded.get("decoded"))
+            else:
+                full_ready = True
+                components.html(
+                    f"""
+                    <div style="
+                        width:100%;
+                        height:78vh;
+                        border:1px solid #eee;
+                        border-radius:8px;
+                        display:flex;
+                        justify-content:center;
+                        align-items:center;
+                        background:#fafafa;
+                        overflow:hidden;
+                    ">
+                      <img id="rateImg"
+                           style="max-width:1600px; max-height:100%; width:auto; height:auto; object-fit:contain;"
+                           decoding="async"
+                           loading="eager"
+                      />
+                    </div>
+                    <div style="font-size:12px; opacity:0.7; margin-top:6px;">{rel_path}</div>
+                    {cached_img_script("rateImg", img_url)}
+                    """,
+                    height=860,
+                )
 
         else:
             st.error("缺少 R2_PUBLIC_BASE_URL（线上必须走 R2）")
@@ -683,37 +987,120 @@ def render_rating():
                 label_visibility="collapsed",
             )
     
-            submitted = st.form_submit_button("Next")
+            # progressive 模式：原图完全 decode 之前不许提交（保证打分看到的是原图）
+            submitted = st.form_submit_button("Next", disabled=not full_ready)
+            if not full_ready:
+                st.caption("Loading full-resolution image… / 原图加载中…")
 
     # ✅ 提交后再校验（这是关键）
     if submitted:
         if score is None or text_clarity is None:
             st.warning("Please select both image quality and text clarity.")
             st.stop()
+        if not full_ready:
+            st.warning("Please wait until the full-resolution image has loaded.")
+            st.stop()
 
-        pg_exec(
-            """
-            INSERT INTO ratings (participant_id, image_id, image_name, score, label, time, text_clarity)
-            VALUES (%s,%s,%s,%s,%s,%s,%s)
-            """,
-            (pid, image_id, rel_path, int(score), LABELS[int(score)], datetime.now(), str(text_clarity))
-        )
+        save_rating(pid, image_id, rel_path, score, text_clarity)
         st.session_state.idx += 1
         st.rerun()
 
 
 def render_done():
+    if RATING_WRITER == "async" and st.session_state.rating_tickets:
+        with st.spinner("Saving your last ratings… / 正在保存最后几条评分…"):
+            get_rating_writer().wait(max(st.session_state.rating_tickets), RATING_DONE_WAIT_SEC)
+        if rating_save_status()[0]:
+            st.warning("部分评分还在保存中，请稍等几秒再关闭页面。")
+
     st.success("Thank you for participating! / 感谢参与！")
     st.write("You may now close this page.")
 
+def render_admin():
+    st.title("Admin · Database")
+
+    st.markdown("### Circuit breaker")
+    b = breaker.stats()
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("State", b["state"])
+    c2.metric("Consecutive failures", b["failures"])
+    c3.metric("Times opened", b["opened"])
+    c4.metric("Rejected", b["rejected"])
+    if b["state"] == "open":
+        st.caption(f"half-open probe in {b['retry_in_sec']:.1f}s")
+
+    st.markdown(f"### Pool (pid {os.getpid()})")
+    p = pool.get_stats()
+    m = pool_metrics.stats()
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("Size / max", f"{p.get('pool_size', 0)} / {p.get('pool_max', POOL_MAX_SIZE)}")
+    c2.metric("Available", p.get("pool_available", 0))
+    c3.metric("Waiting", p.get("requests_waiting", 0))
+    c4.metric("Active (peak)", f"{m['active']} ({m['peak_active']})")
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("Checkouts", m["checkouts"])
+    c2.metric("Wait avg / p95", f"{m['wait_avg_ms']:.1f} / {m['wait_p95_ms']:.0f} ms")
+    c3.metric("Timeouts", m["timeouts"])
+    c4.metric("Fallbacks", m["fallbacks"])
+    st.bar_chart(m["wait_hist"])
+    w = pool_warmup
+    st.caption(f"warmup {'ok' if w['ok'] else 'failed'} in {w['ms']:.0f} ms{' · ' + w['error'] if w['error'] else ''} · "
+               f"prepare={'on' if PG_PREPARED else 'off'} (PG_PREPARE_MODE={PG_PREPARE_MODE}) · "
+               f"fallback connections ≤ {PG_FALLBACK_MAX_CONN}")
+    if PG_POOL_AUTOSIZE:
+        a = get_pool_autosizer().stats()
+        st.caption(f"autosize max_size={a['max_size']} in [{a['floor']}, {a['ceiling']}] · "
+                   f"grown={a['grown']} shrunk={a['shrunk']} · server headroom={a['last_headroom']} · "
+                   f"last: {a['last_decision']}")
+
+    st.markdown("### Image catalog")
+    c = get_image_catalog().stats()
+    st.caption(f"{c['images']} images · {c['with_hash']} with content hash · version {c['version']}")
+
+    st.markdown("### Queries")
+    rows = query_metrics.snapshot()
+    if rows:
+        st.dataframe(rows, use_container_width=True, hide_index=True)
+    else:
+        st.caption("本进程还没有查询")
+
+    if RATING_WRITER == "async":
+        st.markdown("### Rating writer")
+        w = get_rating_writer().stats()
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("Queued", w["queued"])
+        c2.metric("Written", f"{w['written']} / {w['submitted']}")
+        c3.metric("Batches", w["batches"])
+        c4.metric("Last flush", f"{w['last_flush_ms']:.1f} ms")
+        st.caption(f"flush_errors={w['flush_errors']} · dead_lettered={w['dead_lettered']} "
+                   f"({RATING_DEAD_LETTER}) · last_error={w['last_error'] or '—'}")
+
+    if RATING_JOURNAL:
+        st.markdown("### Rating journal")
+        j = get_rating_journal().stats()
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("Appended", j["appended"])
+        c2.metric("Replayed", j["replayed"])
+        c3.metric("Backlog", f"{j['backlog_bytes'] / 1024:.0f} KB")
+        c4.metric("File", f"{j['bytes'] / 1024 / 1024:.1f} MB")
+        st.caption(f"acks={j['acks']} · skipped_acked={j['skipped_acked']} · foreign={j['foreign']} · "
+                   f"fsyncs={j['fsyncs']} · replay_runs={j['replay_runs']} · "
+                   f"replay_errors={j['replay_errors']} · last_error={j['last_error'] or '—'}")
+
 # =========================
 # Router
 # =========================
-if st.session_state.stage == "intro":
-    render_intro()
-elif st.session_state.stage == "training":
-    render_training()
-elif st.session_state.stage == "rating":
-    render_rating()
-else:
-    render_done()
+try:
+    if ADMIN_TOKEN and st.query_params.get("admin") == ADMIN_TOKEN:
+        render_admin()
+    elif st.session_state.stage == "intro":
+        render_intro()
+    elif st.session_state.stage == "training":
+        render_training()
+    elif st.session_state.stage == "rating":
+        render_rating()
+    else:
+        render_done()
+except CircuitOpenError:
+    # 熔断中：不再往数据库上压；已提交的评分在本地队列 / 日志里，恢复后自动写入
+    st.warning("The server is busy, please wait a few seconds and refresh. / 服务器繁忙，请稍等几秒后刷新页面。")
@@ -0,0 +1,118 @@
+import time
+import random
+import argparse
+from datetime import datetime
+from uuid import uuid4
+
+import numpy as np
+import psycopg
+
+import pg_prepare
+
+# app_pg 热路径 3 条语句的单次延迟：prepare 关（每次解析 + 规划）vs 开（prepare_threshold 后走 prepared statement）
+# 在独立 schema（默认 bench_prepare）里建 images / assignments / ratings，不碰线上数据
+# 对着 transaction pooler（Supabase 6543 / pgbouncer）跑 on 模式会报错——所以 app_pg 默认 off
+#
+#   python bench_pg_prepare.py --dsn postgresql://... --iters 2000
+
+HOT_QUERIES = {
+    "get_rel_path": "SELECT rel_path, content_hash FROM images WHERE image_id=%s",
+    "get_progress": "SELECT COUNT(*) FROM ratings WHERE participant_id=%s",
+    "insert_rating": """
+        INSERT INTO ratings (participant_id, image_id, image_name, score, label, time, text_clarity)
+        VALUES (%s,%s,%s,%s,%s,%s,%s)
+    """,
+}
+
+
+def setup_schema(dsn, schema, n_images, n_participants, k_per):
+    with psycopg.connect(dsn) as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+            cur.execute(f"CREATE SCHEMA {schema}")
+            cur.execute(f"SET search_path TO {schema}")
+            cur.execute("CREATE TABLE images (image_id TEXT PRIMARY KEY, rel_path TEXT NOT NULL, content_hash TEXT)")
+            cur.execute("""
+            CREATE TABLE ratings (
+                id BIGSERIAL PRIMARY KEY, participant_id TEXT, image_id TEXT, image_name TEXT,
+                score INTEGER, label TEXT, time TIMESTAMP, text_clarity TEXT
+            )
+            """)
+            cur.execute("CREATE INDEX idx_ratings_pid_image ON ratings (participant_id, image_id)")
+            cur.execute(
+                "INSERT INTO images SELECT 'img' || g, 'cat/img' || g || '.png', md5(g::text) "
+                "FROM generate_series(1, %s) g",
+                (n_images,)
+            )
+            pids = [str(uuid4()) for _ in range(n_participants)]
+            with cur.copy("COPY ratings (participant_id, image_id, score) FROM STDIN") as cp:
+                for pid in pids:
+                    for i in random.sample(range(1, n_images + 1), k_per):
+                        cp.write_row((pid, f"img{i}", random.randint(1, 5)))
+            cur.execute("ANALYZE")
+        conn.commit()
+    return pids
+
+
+def params_for(name, n_images, pids):
+    image_id = f"img{random.randint(1, n_images)}"
+    pid = random.choice(pids)
+    if name == "get_rel_path":
+        return (image_id,)
+    if name == "get_progress":
+        return (pid,)
+    return (pid, image_id, f"cat/{image_id}.png", 3, "Fair", datetime.now(), "clear")
+
+
+def run_mode(dsn, schema, prepared, threshold, iters, n_images, pids):
+    out = {}
+    kwargs = pg_prepare.connect_kwargs(prepared, threshold)
+    prepare = pg_prepare.execute_prepare_arg(prepared)
+    with psycopg.connect(dsn, options=f"-c search_path={schema}", **kwargs) as conn:
+        for name, sql in HOT_QUERIES.items():
+            lat = []
+            for _ in range(iters):
+                params = params_for(name, n_images, pids)
+                t0 = time.perf_counter()
+                with conn.cursor() as cur:
+                    cur.execute(sql, params, prepare=prepare)
+                    if cur.description:
+                        cur.fetchall()
+                conn.commit()   # 和 app_pg 一样每条语句一个事务
+                lat.append(time.perf_counter() - t0)
+            # 前 threshold 次还没 prepare，不计入
+            ms = np.array(lat[threshold:]) * 1000
+            out[name] = (float(np.percentile(ms, 50)), float(np.percentile(ms, 95)), float(ms.mean()))
+    return out
+
+
+def main(dsn, schema, iters, threshold, n_images, n_participants, k_per):
+    pids = setup_schema(dsn, schema, n_images, n_participants, k_per)
+    res = {
+        "off": run_mode(dsn, schema, False, threshold, iters, n_images, pids),
+        "on": run_mode(dsn, schema, True, threshold, iters, n_images, pids),
+    }
+    print(f"iters={iters}  threshold={threshold}  images={n_images}  ratings={n_participants * k_per}")
+    print(f"{'query':<14} {'mode':<4} {'p50 ms':>8} {'p95 ms':>8} {'mean ms':>8}")
+    for name in HOT_QUERIES:
+        for mode in ("off", "on"):
+            p50, p95, mean = res[mode][name]
+            print(f"{name:<14} {mode:<4} {p50:>8.3f} {p95:>8.3f} {mean:>8.3f}")
+        gain = 1 - res["on"][name][2] / res["off"][name][2]
+        print(f"{'':<14} → mean {gain * 100:+.1f}% faster with prepare")
+
+    with psycopg.connect(dsn) as conn:
+        conn.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--dsn", required=True, help="直连或 session 模式；会建删 --schema")
+    ap.add_argument("--schema", default="bench_prepare")
+    ap.add_argument("--iters", type=int, default=2000, help="每条语句每种模式执行几次")
+    ap.add_argument("--threshold", type=int, default=pg_prepare.DEFAULT_PREPARE_THRESHOLD)
+    ap.add_argument("--images", type=int, default=6000)
+    ap.add_argument("--participants", type=int, default=300)
+    ap.add_argument("--k", type=int, default=500)
+    args = ap.parse_args()
+    main(args.dsn, args.schema, args.iters, args.threshold, args.images, args.participants, args.k)
@@ -0,0 +1,158 @@
+import time
+import argparse
+import threading
+from uuid import uuid4
+
+import numpy as np
+import psycopg
+from psycopg_pool import ConnectionPool
+
+import pg_slots
+
+# 模拟“一个班 100 人同时点 Start”：N 个线程在同一个 barrier 后一起注册
+# 每次注册 = 从连接池拿连接 → 分配 slot → 写 participants → commit（和 app_pg 一样的池大小）
+# 在独立 schema（默认 bench_slots）里建表，不碰线上数据；每种模式前都重建
+#
+#   python bench_slot_allocation.py --dsn postgresql://... --threads 100 --pool 4
+
+MODES = ("counter", "sequence", "lease")
+
+
+def setup_schema(dsn, schema, p_total):
+    with psycopg.connect(dsn) as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+            cur.execute(f"CREATE SCHEMA {schema}")
+            cur.execute(f"SET search_path TO {schema}")
+            cur.execute("""
+            CREATE TABLE participants (
+                participant_id TEXT PRIMARY KEY,
+                student_id TEXT,
+                device TEXT,
+                screen_resolution TEXT,
+                start_time TIMESTAMP,
+                slot INTEGER
+            )
+            """)
+            cur.execute("CREATE TABLE ratings (participant_id TEXT, image_id TEXT)")
+            cur.execute("CREATE TABLE slot_counter (id INTEGER PRIMARY KEY DEFAULT 1, next_slot INTEGER NOT NULL)")
+            cur.execute("INSERT INTO slot_counter (id, next_slot) VALUES (1, 1)")
+            pg_slots.init_slot_seq(cur)
+            pg_slots.init_slots(cur)
+            cur.execute(
+                "INSERT INTO slots (slot, n_total) SELECT g, 500 FROM generate_series(1, %s) g",
+                (p_total,)
+            )
+        conn.commit()
+
+
+def allocate(cur, mode, pid, p_total, lease_min):
+    if mode == "counter":
+        cur.execute(pg_slots.COUNTER_SLOT_SQL, (p_total,), prepare=False)
+    elif mode == "sequence":
+        cur.execute(pg_slots.SEQUENCE_SLOT_SQL, (p_total,), prepare=False)
+    else:
+        cur.execute(pg_slots.LEASE_SLOT_SQL, (pid, lease_min), prepare=False)
+    row = cur.fetchone()
+    return int(row[0]) if row else None
+
+
+def run_mode(dsn, schema, mode, threads, pool_size, p_total, lease_min):
+    setup_schema(dsn, schema, p_total)
+    pool = ConnectionPool(
+        conninfo=dsn,
+        min_size=pool_size,
+        max_size=pool_size,
+        timeout=60,
+        kwargs={"options": f"-c search_path={schema}"},
+    )
+    pool.wait()
+
+    barrier = threading.Barrier(threads)
+    lat = [None] * threads
+    slots = [None] * threads
+    errors = []
+
+    def worker(i):
+        pid = str(uuid4())
+        barrier.wait()
+        t0 = time.perf_counter()
+        try:
+            with pool.connection() as conn:
+                with conn.cursor() as cur:
+                    slot = allocate(cur, mode, pid, p_total, lease_min)
+                    cur.execute(
+                        "INSERT INTO participants (participant_id, student_id, device, screen_resolution, start_time, slot) "
+                        "VALUES (%s, %s, 'bench', 'bench', now(), %s)",
+                        (pid, f"s{i}", slot),
+                        prepare=False,
+                    )
+            slots[i] = slot
+        except Exception as e:   # 记进报告，不让一个线程打断整轮
+            errors.append(repr(e))
+        lat[i] = time.perf_counter() - t0
+
+    ts = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    t_start = time.perf_counter()
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    wall = time.perf_counter() - t_start
+    pool.close()
+
+    ms = np.array(lat) * 1000
+    got = [s for s in slots if s is not None]
+    return {
+        "mode": mode,
+        "wall_s": wall,
+        "p50": float(np.percentile(ms, 50)),
+        "p95": float(np.percentile(ms, 95)),
+        "p99": float(np.percentile(ms, 99)),
+        "max": float(ms.max()),
+        "slots": len(got),
+        "distinct": len(set(got)),
+        "no_slot": threads - len(got) - len(errors),
+        "errors": errors,
+    }
+
+
+def main(dsn, schema, modes, threads, pool_size, p_total, lease_min, target_p99_ms):
+    print(f"threads={threads}  pool={pool_size}  p_total={p_total}  schema={schema}")
+    print(f"{'mode':<9} {'wall s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}  slots")
+    ok = True
+    for mode in modes:
+        r = run_mode(dsn, schema, mode, threads, pool_size, p_total, lease_min)
+        print(
+            f"{r['mode']:<9} {r['wall_s']:>7.2f} {r['p50']:>8.1f} {r['p95']:>8.1f} {r['p99']:>8.1f} {r['max']:>8.1f}  "
+            f"{r['slots']} got / {r['distinct']} distinct / {r['no_slot']} none"
+        )
+        if r["errors"]:
+            print(f"   ⚠️ {len(r['errors'])} errors, e.g. {r['errors'][0]}")
+        # lease 模式下同一个 slot 不能发给两个人
+        if mode == "lease" and r["distinct"] != r["slots"]:
+            print("   ❌ lease 模式出现重复 slot")
+            ok = False
+        if target_p99_ms and r["p99"] > target_p99_ms:
+            print(f"   ❌ p99 {r['p99']:.1f}ms > {target_p99_ms}ms")
+            ok = False
+
+    with psycopg.connect(dsn) as conn:
+        conn.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+    return ok
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--dsn", required=True, help="建议用本地 / 测试库；会建删 --schema")
+    ap.add_argument("--schema", default="bench_slots")
+    ap.add_argument("--modes", default=",".join(MODES))
+    ap.add_argument("--threads", type=int, default=100, help="同时注册的人数")
+    ap.add_argument("--pool", type=int, default=4, help="连接池大小（app_pg 默认 PG_POOL_MAX_SIZE=4）")
+    ap.add_argument("--p-total", type=int, default=300)
+    ap.add_argument("--lease-min", type=int, default=pg_slots.SLOT_LEASE_MIN)
+    ap.add_argument("--target-p99-ms", type=float, default=0, help="给了就检查 p99，超了退出码 1")
+    args = ap.parse_args()
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    ok = main(args.dsn, args.schema, modes, args.threads, args.pool, args.p_total, args.lease_min, args.target_p99_ms)
+    raise SystemExit(0 if ok else 1)
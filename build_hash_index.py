@@ -0,0 +1,122 @@
+import os
+import csv
+import shutil
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+# 内容寻址 URL：文件内容变了 hash 就变，URL 也跟着变
+# 这样 R2 / CDN / 浏览器都可以放心缓存一年（Cache-Control: immutable）
+HASH_LEN = 16
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def file_sha256(path: str, chunk: int = 1024 * 1024) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            b = f.read(chunk)
+            if not b:
+                break
+            h.update(b)
+    return h.hexdigest()
+
+
+def hashed_rel_path(rel_path: str, content_hash: str) -> str:
+    """1080_M/AD/img_20.png -> 1080_M/AD/img_20.<hash16>.png"""
+    stem, ext = os.path.splitext(rel_path)
+    return f"{stem}.{content_hash[:HASH_LEN]}{ext}"
+
+
+def read_manifest(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [(r["image_id"].strip(), r["rel_path"].strip()) for r in csv.DictReader(f)]
+
+
+def update_pg(dsn, rows):
+    """把 content_hash 写进 Postgres 的 images 表（一次 UPDATE ... FROM unnest）"""
+    import psycopg
+
+    ids = [r["image_id"] for r in rows]
+    hashes = [r["content_hash"] for r in rows]
+    with psycopg.connect(dsn) as conn:
+        with conn.cursor() as cur:
+            cur.execute("ALTER TABLE images ADD COLUMN IF NOT EXISTS content_hash TEXT")
+            cur.execute(
+                """
+                UPDATE images AS i
+                SET content_hash = x.content_hash
+                FROM unnest(%s::text[], %s::text[]) AS x(image_id, content_hash)
+                WHERE i.image_id = x.image_id
+                """,
+                (ids, hashes),
+            )
+            n = cur.rowcount
+            # 让各进程的图片目录缓存失效（exp_config.updated_at 作为版本号）
+            cur.execute("UPDATE exp_config SET updated_at = now() WHERE id = 1")
+        conn.commit()
+    print(f"✅ updated content_hash for {n} rows in images")
+
+
+def main(manifest, root, out_csv, copy_to=None, dsn=None, workers=8):
+    items = read_manifest(manifest)
+    print(f"✅ manifest rows: {len(items)}")
+
+    def work(item):
+        image_id, rel_path = item
+        src = os.path.join(root, rel_path)
+        if not os.path.exists(src):
+            return None
+        return {
+            "image_id": image_id,
+            "rel_path": rel_path,
+            "content_hash": file_sha256(src),
+            "bytes": os.path.getsize(src),
+        }
+
+    rows, missing = [], []
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        for i, (item, r) in enumerate(zip(items, ex.map(work, items)), 1):
+            if r is None:
+                missing.append(item[1])
+            else:
+                r["hashed_path"] = hashed_rel_path(r["rel_path"], r["content_hash"])
+                rows.append(r)
+            if i % 500 == 0 or i == len(items):
+                print(f"Progress: {i}/{len(items)} | missing={len(missing)}")
+
+    fieldnames = ["image_id", "rel_path", "content_hash", "hashed_path", "bytes"]
+    with open(out_csv, "w", newline="", encoding="utf-8") as f:
+        w = csv.DictWriter(f, fieldnames=fieldnames)
+        w.writeheader()
+        w.writerows(rows)
+    print(f"✅ wrote {len(rows)} rows to {out_csv}")
+
+    if missing:
+        print(f"⚠️ {len(missing)} files missing under {root}, e.g. {missing[:5]}")
+
+    if copy_to:
+        # 生成按 hashed_path 命名的目录，直接整目录上传到 R2
+        for r in rows:
+            dst = os.path.join(copy_to, r["hashed_path"])
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            if not os.path.exists(dst):
+                shutil.copy2(os.path.join(root, r["rel_path"]), dst)
+        print(f"✅ hashed tree written to {copy_to}")
+        print("   上传时带上长缓存头，例如：")
+        print(f'   rclone copy {copy_to} r2:<bucket> --header-upload "Cache-Control: {IMMUTABLE_CACHE_CONTROL}"')
+
+    if dsn:
+        update_pg(dsn, rows)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--manifest", default="manifest_6000.csv")
+    ap.add_argument("--root", required=True, help="图片根目录（rel_path 相对于它）")
+    ap.add_argument("--out", default="hash_index.csv", help="输出 hash 索引 CSV")
+    ap.add_argument("--copy-to", default=None, help="可选：把图片按 hashed_path 复制到这个目录，用于 path 模式上传")
+    ap.add_argument("--dsn", default="", help="可选：写回 Postgres images.content_hash")
+    ap.add_argument("--workers", type=int, default=8)
+    args = ap.parse_args()
+    main(args.manifest, args.root, args.out, copy_to=args.copy_to, dsn=args.dsn or None, workers=args.workers)
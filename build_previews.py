@@ -0,0 +1,68 @@
+import os
+import csv
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+# 渐进式显示用的低清占位图：
+#   <out>/<rel_path 去扩展名>.jpg   （长边 PREVIEW_MAX_SIDE，JPEG 低质量，通常几十 KB）
+# 上传到 R2 的 previews/ 目录下，app_pg 在 IMAGE_DELIVERY=progressive 时先显示它
+PREVIEW_PREFIX = "previews"
+PREVIEW_MAX_SIDE = 640
+PREVIEW_QUALITY = 60
+
+
+def preview_rel_path(rel_path: str) -> str:
+    """1080_M/AD/img_20.png -> previews/1080_M/AD/img_20.jpg"""
+    stem = os.path.splitext(rel_path)[0]
+    return f"{PREVIEW_PREFIX}/{stem}.jpg"
+
+
+def make_preview(args):
+    src, dst, max_side, quality = args
+    if os.path.exists(dst):
+        return "skip"
+    if not os.path.exists(src):
+        return "missing"
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    with Image.open(src) as im:
+        im = im.convert("RGB")
+        im.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+        im.save(dst, format="JPEG", quality=quality, optimize=True, progressive=True)
+    return "ok"
+
+
+def main(manifest, root, out_root, max_side, quality, workers):
+    with open(manifest, "r", encoding="utf-8") as f:
+        rel_paths = [r["rel_path"].strip() for r in csv.DictReader(f)]
+    rel_paths = list(dict.fromkeys(rel_paths))
+
+    # out_root 对应 R2 bucket 根目录，所以目标路径里带 previews/ 前缀
+    jobs = [
+        (os.path.join(root, rp), os.path.join(out_root, preview_rel_path(rp)), max_side, quality)
+        for rp in rel_paths
+    ]
+
+    counts = {"ok": 0, "skip": 0, "missing": 0}
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        for i, res in enumerate(ex.map(make_preview, jobs, chunksize=16), 1):
+            counts[res] += 1
+            if i % 500 == 0 or i == len(jobs):
+                print(f"Progress: {i}/{len(jobs)} | {counts}")
+
+    print(f"✅ previews written under {os.path.join(out_root, PREVIEW_PREFIX)}")
+    if counts["missing"]:
+        print(f"⚠️ {counts['missing']} source files missing under {root}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--manifest", default="manifest_6000.csv")
+    ap.add_argument("--root", required=True, help="原图根目录（rel_path 相对于它）")
+    ap.add_argument("--out", required=True, help="输出根目录（对应 R2 bucket 根，会写到 <out>/previews/...）")
+    ap.add_argument("--max-side", type=int, default=PREVIEW_MAX_SIDE)
+    ap.add_argument("--quality", type=int, default=PREVIEW_QUALITY)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    args = ap.parse_args()
+    main(args.manifest, args.root, args.out, args.max_side, args.quality, args.workers)
@@ -0,0 +1,83 @@
+import os
+import io
+import json
+import hashlib
+import argparse
+
+from PIL import Image
+
+# Training 页素材只生成一次：
+#   static/training/<stem>_<w>.<hash8>.jpg   多个宽度的 JPEG（文件名带内容 hash，可长缓存）
+#   static/training/manifest.json            前端按它拼 URL / srcset
+# 本地：Streamlit 开了 enableStaticServing，URL 是 app/static/training/...
+# R2：把 static/training 整个目录上传到 <bucket>/training_assets/
+
+VALID_EXTS = (".png", ".jpg", ".jpeg", ".bmp", ".tiff", ".webp")
+DEFAULT_WIDTHS = (1280, 1920, 2560)
+N_TRAIN = 5
+
+
+def list_train_images(folder):
+    return sorted(
+        f for f in os.listdir(folder)
+        if f.lower().endswith(VALID_EXTS) and not f.startswith(".")
+    )
+
+
+def encode_variant(src_path: str, width: int, quality: int):
+    with Image.open(src_path) as im:
+        im = im.convert("RGB")
+        # 不放大：原图比目标小就保持原尺寸
+        im.thumbnail((width, width), Image.Resampling.LANCZOS)
+        buf = io.BytesIO()
+        im.save(buf, format="JPEG", quality=quality, optimize=True, progressive=True)
+        return buf.getvalue(), im.size
+
+
+def main(train_dir, out_dir, widths, quality):
+    files = list_train_images(train_dir)
+    if len(files) < N_TRAIN:
+        raise RuntimeError(f"训练图目录 {train_dir}/ 下至少需要 {N_TRAIN} 张图。当前：{len(files)}")
+    files = files[:N_TRAIN]
+
+    os.makedirs(out_dir, exist_ok=True)
+    items = []
+    version = hashlib.sha256()
+    total_bytes = 0
+
+    for score, fn in enumerate(files, 1):
+        stem = os.path.splitext(fn)[0]
+        variants = []
+        seen_sizes = set()
+        for w in sorted(widths):
+            data, (vw, vh) = encode_variant(os.path.join(train_dir, fn), w, quality)
+            if (vw, vh) in seen_sizes:
+                continue   # 原图太小，多个宽度编码出来一样
+            seen_sizes.add((vw, vh))
+            h8 = hashlib.sha256(data).hexdigest()[:8]
+            out_name = f"{stem}_{vw}.{h8}.jpg"
+            with open(os.path.join(out_dir, out_name), "wb") as f:
+                f.write(data)
+            version.update(data)
+            total_bytes += len(data)
+            variants.append({"file": out_name, "w": vw, "h": vh, "bytes": len(data)})
+        items.append({"score": score, "source": fn, "variants": variants})
+        print(f"✅ {fn}: {[v['w'] for v in variants]}")
+
+    manifest = {"version": version.hexdigest()[:12], "items": items}
+    with open(os.path.join(out_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    print(f"✅ wrote {sum(len(i['variants']) for i in items)} files ({total_bytes / 1024 / 1024:.1f} MB) to {out_dir}")
+    print(f"✅ manifest version: {manifest['version']}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--train-dir", default="training_images")
+    ap.add_argument("--out", default=os.path.join("static", "training"))
+    ap.add_argument("--widths", default=",".join(str(w) for w in DEFAULT_WIDTHS), help="逗号分隔，如 1280,1920,2560")
+    ap.add_argument("--quality", type=int, default=88)
+    args = ap.parse_args()
+    widths = [int(x) for x in args.widths.split(",") if x.strip()]
+    main(args.train_dir, args.out, widths, args.quality)
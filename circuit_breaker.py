@@ -0,0 +1,158 @@
+# circuit_breaker.py
+# -*- coding: utf-8 -*-
+"""
+app_pg 的熔断 + 每条查询的延迟 / 错误统计
+
+原来池超时就为这一条查询新开一条直连：数据库越忙，连接越多，越忙
+- CircuitBreaker：closed → 连续 failure_threshold 次失败 → open（reset_sec 内直接拒绝，不碰数据库）
+  → half_open（放 half_open_max 个探测请求）→ 成功就 closed，失败重新 open
+- 只有“连不上 / 超时”算失败（is_connection_error）；SQL 本身的错（约束冲突、语句被取消、锁超时、死锁）
+  说明数据库是好的，不计入
+- half_open 放出去的探测必须有结果：调用方对非数据库异常调 release() 把名额还回来；
+  探测超过 probe_timeout_sec 还没结果（线程卡住）也当它没了，再放一个
+- QueryMetrics：按查询名记次数、错误数、最近 window 次的延迟（p50 / p95）
+"""
+
+import random
+import threading
+import time
+from collections import deque
+
+import psycopg
+from psycopg_pool import PoolTimeout
+
+
+class CircuitOpenError(Exception):
+    """熔断中：这次请求没有发给数据库"""
+
+
+# 连接类 SQLSTATE：08xxx 连接异常；57P01–57P03 服务端关闭 / 正在启动；53300 连接数已满
+CONNECTION_SQLSTATES = ("57P01", "57P02", "57P03", "53300")
+
+# 没有 SQLSTATE 时只有这几类算连接问题（握手超时、连接断了、池超时、连接已关）
+CONNECTIVITY_ERRORS = (psycopg.OperationalError, psycopg.InterfaceError, PoolTimeout)
+
+
+def is_connection_error(exc) -> bool:
+    """
+    psycopg 的 OperationalError 里很多是服务端正常返回的错误（QueryCanceled、LockNotAvailable、
+    DeadlockDetected），只有连不上 / 连接断了才算；客户端侧的连接失败没有 SQLSTATE
+    其他没有 SQLSTATE 的（客户端适配参数失败的 ProgrammingError / DataError 等）是这一行数据的问题：
+    算成失败的话，后台写入二分一条坏行的那几次重写就能把熔断器打开
+    """
+    state = getattr(exc, "sqlstate", None)
+    if state is None:
+        return isinstance(exc, CONNECTIVITY_ERRORS)
+    return state.startswith("08") or state in CONNECTION_SQLSTATES
+
+
+def jittered_delay(attempt: int, base_sec: float, cap_sec: float) -> float:
+    """full jitter：uniform(0, min(cap, base·2^attempt))，并发重试不会同时撞上去"""
+    return random.uniform(0, min(cap_sec, base_sec * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_sec: float = 10, half_open_max: int = 1,
+                 probe_timeout_sec: float = None):
+        self.failure_threshold = int(failure_threshold)
+        self.reset_sec = float(reset_sec)
+        self.half_open_max = int(half_open_max)
+        self.probe_timeout_sec = float(probe_timeout_sec if probe_timeout_sec is not None else 3 * reset_sec)
+
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_at = 0.0
+        self._stats = {"opened": 0, "rejected": 0, "stale_probes": 0}
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.time() - self._opened_at < self.reset_sec:
+                    self._stats["rejected"] += 1
+                    return False
+                self.state = self.HALF_OPEN
+                self._probes = 0
+            if self.state == self.HALF_OPEN:
+                if self._probes >= self.half_open_max and time.time() - self._probe_at > self.probe_timeout_sec:
+                    self._stats["stale_probes"] += 1
+                    self._probes = 0
+                if self._probes >= self.half_open_max:
+                    self._stats["rejected"] += 1
+                    return False
+                self._probes += 1
+                self._probe_at = time.time()
+            return True
+
+    def check(self):
+        if not self.allow():
+            raise CircuitOpenError(f"database circuit open (retry in ≤{self.reset_sec:.0f}s)")
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probes = 0
+
+    def release(self):
+        """这次调用没能说明数据库好坏（非数据库异常）：状态不变，half_open 的探测名额还回去"""
+        with self._lock:
+            if self.state == self.HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self._stats["opened"] += 1
+                self.state = self.OPEN
+                self._opened_at = time.time()
+
+    def stats(self) -> dict:
+        with self._lock:
+            left = max(self.reset_sec - (time.time() - self._opened_at), 0) if self.state == self.OPEN else 0
+            return {"state": self.state, "failures": self._failures, "retry_in_sec": left, **self._stats}
+
+
+class QueryMetrics:
+    def __init__(self, window: int = 200):
+        self.window = int(window)
+        self._lock = threading.Lock()
+        self._by_name = {}
+
+    @staticmethod
+    def name_of(sql: str, width: int = 60) -> str:
+        return " ".join(sql.split())[:width]
+
+    def record(self, name: str, seconds: float, ok: bool):
+        with self._lock:
+            m = self._by_name.get(name)
+            if m is None:
+                m = self._by_name[name] = {"calls": 0, "errors": 0, "lat": deque(maxlen=self.window)}
+            m["calls"] += 1
+            if not ok:
+                m["errors"] += 1
+            m["lat"].append(seconds)
+
+    def snapshot(self) -> list:
+        """按调用次数降序；延迟单位 ms"""
+        with self._lock:
+            items = [(name, m["calls"], m["errors"], sorted(m["lat"])) for name, m in self._by_name.items()]
+        out = []
+        for name, calls, errors, lat in sorted(items, key=lambda x: -x[1]):
+            pick = (lambda q: lat[min(int(q * len(lat)), len(lat) - 1)] * 1000) if lat else (lambda q: 0.0)
+            out.append({
+                "query": name,
+                "calls": calls,
+                "errors": errors,
+                "p50_ms": round(pick(0.5), 1),
+                "p95_ms": round(pick(0.95), 1),
+            })
+        return out
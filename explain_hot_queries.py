@@ -0,0 +1,122 @@
+import os
+import shutil
+import sqlite3
+import argparse
+import tempfile
+
+import migrations
+
+# 看热路径查询有没有走 migrations.py 建的索引
+#   sqlite: 把 --db 复制到临时目录，应用 migrations 后 EXPLAIN QUERY PLAN（不改原库）
+#   pg    : 对 --dsn 直接 EXPLAIN（只读；--migrate 时先应用 migrations）
+# 计划里出现对大表的全表扫描（SQLite 的 "SCAN <table>" 不带 INDEX，PG 的 Seq Scan）就标 ❌
+#
+#   python explain_hot_queries.py sqlite --db results.db
+#   python explain_hot_queries.py pg --dsn postgresql://...
+
+PID = "00000000-0000-0000-0000-000000000000"
+STUDENT = "s000"
+IMAGE = "img0"
+
+SQLITE_QUERIES = {
+    "progress (ratings by pid)": ("SELECT COUNT(*) FROM ratings WHERE participant_id=?", (PID,)),
+    "rating dedupe": ("SELECT 1 FROM ratings WHERE participant_id=? AND image_id=?", (PID, IMAGE)),
+    "assigned ids": ("SELECT image_id FROM assignments WHERE participant_id=? ORDER BY ord ASC", (PID,)),
+    "rel_path": ("SELECT rel_path FROM images WHERE image_id=?", (IMAGE,)),
+    "student lookup": (
+        "SELECT participant_id FROM participants WHERE student_id=? ORDER BY start_time DESC LIMIT 1",
+        (STUDENT,),
+    ),
+    "per-image MOS": ("SELECT image_id, COUNT(*), AVG(score) FROM ratings GROUP BY image_id", ()),
+    "stale participants": (
+        "SELECT participant_id FROM participant_progress WHERE last_activity < ? AND done < total",
+        ("2000-01-01 00:00:00",),
+    ),
+}
+
+# 和 app_pg 里的语句一致（进度读 participant_progress 主键，这里另列按 participant_id 数评分的查询）
+PG_QUERIES = {
+    "progress (ratings by pid)": ("SELECT COUNT(*) FROM ratings WHERE participant_id=%s", (PID,)),
+    "rating dedupe": ("SELECT 1 FROM ratings WHERE participant_id=%s AND image_id=%s", (PID, IMAGE)),
+    "assigned ids": ("SELECT image_id FROM assignments WHERE participant_id=%s ORDER BY ord ASC", (PID,)),
+    "bootstrap (by student)": ("""
+        WITH mine AS (
+            SELECT p.participant_id, p.slot, p.start_time,
+                   COALESCE(pp.total, 0) AS total, COALESCE(pp.done, 0) AS done
+            FROM participants p
+            LEFT JOIN participant_progress pp ON pp.participant_id = p.participant_id
+            WHERE p.student_id = %s
+        )
+        SELECT * FROM mine ORDER BY (total > 0 AND done < total) DESC, start_time DESC LIMIT 1
+    """, (STUDENT,)),
+    "adaptive stats": ("SELECT image_id, n, s1, s2 FROM image_stats", ()),
+    "adaptive pending (active)": ("""
+        SELECT a.image_id, COUNT(*)
+        FROM participant_progress pp
+        JOIN assignments a ON a.participant_id = pp.participant_id
+        WHERE pp.last_activity > now() - interval '60 minutes' AND pp.done < pp.total
+          AND NOT EXISTS (
+              SELECT 1 FROM ratings r WHERE r.participant_id = a.participant_id AND r.image_id = a.image_id
+          )
+        GROUP BY a.image_id
+    """, ()),
+}
+
+
+def explain_sqlite(db_path):
+    tmp = tempfile.mkdtemp(prefix="iqa_explain_")
+    try:
+        path = os.path.join(tmp, "explain.db")
+        shutil.copy(db_path, path)
+        conn = sqlite3.connect(path)
+        print(f"migrations applied to the copy: {migrations.migrate_sqlite(conn) or 'none (up to date)'}")
+        conn.execute("ANALYZE")
+        ok = True
+        for name, (sql, params) in SQLITE_QUERIES.items():
+            plan = [r[3] for r in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+            full_scan = any(p.startswith("SCAN") and "INDEX" not in p for p in plan)
+            ok &= not full_scan
+            print(f"{'❌' if full_scan else '✅'} {name}")
+            for p in plan:
+                print(f"     {p}")
+        conn.close()
+        return ok
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def explain_pg(dsn, migrate):
+    import psycopg
+
+    with psycopg.connect(dsn) as conn:
+        if migrate:
+            print(f"migrations applied: {migrations.migrate_pg(conn) or 'none (up to date)'}")
+        ok = True
+        with conn.cursor() as cur:
+            for name, (sql, params) in PG_QUERIES.items():
+                cur.execute("EXPLAIN " + sql, params)
+                plan = [r[0] for r in cur.fetchall()]
+                full_scan = any(f"Seq Scan on {t}" in p for p in plan for t in ("ratings", "participants", "assignments"))
+                ok &= not full_scan
+                print(f"{'❌' if full_scan else '✅'} {name}")
+                for p in plan:
+                    print(f"     {p}")
+        conn.rollback()
+    return ok
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("backend", choices=["sqlite", "pg"])
+    ap.add_argument("--db", default="results.db")
+    ap.add_argument("--dsn", default="")
+    ap.add_argument("--migrate", action="store_true", help="pg：先应用 migrations（会改库）")
+    args = ap.parse_args()
+
+    if args.backend == "sqlite":
+        ok = explain_sqlite(args.db)
+    else:
+        if not args.dsn:
+            ap.error("pg 模式需要 --dsn")
+        ok = explain_pg(args.dsn, args.migrate)
+    raise SystemExit(0 if ok else 1)
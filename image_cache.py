@@ -0,0 +1,90 @@
+# image_cache.py
+# -*- coding: utf-8 -*-
+"""
+进程内图片缓存（替代没有上限的 @st.cache_data）
+
+- 按字节数设上限（IMAGE_CACHE_MAX_MB），超出后按 LRU 淘汰最久没用过的
+- 线程安全：Streamlit 每个会话的 rerun 跑在不同线程里
+- stats() 给 admin 页展示：entries / bytes / hit rate / evictions
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+IMAGE_CACHE_MAX_MB = int(os.environ.get("IMAGE_CACHE_MAX_MB", "256"))
+
+
+def sizeof_value(value) -> int:
+    """只统计 payload 本身（bytes / data URL 字符串），够用来控内存"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value)
+    return 0
+
+
+class ImageCache:
+    def __init__(self, max_bytes: int = IMAGE_CACHE_MAX_MB * 1024 * 1024):
+        self.max_bytes = int(max_bytes)
+        self._lock = threading.Lock()
+        self._items = OrderedDict()   # key -> (value, nbytes)
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejected = 0             # 单张就超过上限的，不进缓存
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value):
+        nbytes = sizeof_value(value)
+        with self._lock:
+            if nbytes > self.max_bytes:
+                self.rejected += 1
+                return
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._items[key] = (value, nbytes)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes and self._items:
+                _k, (_v, n) = self._items.popitem(last=False)
+                self._bytes -= n
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        if value is not None:
+            return value
+        # 编码放在锁外面：慢的 PIL 操作不阻塞其他会话读缓存
+        value = compute()
+        self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._items),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "evictions": self.evictions,
+                "rejected": self.rejected,
+            }
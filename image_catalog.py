@@ -0,0 +1,54 @@
+# image_catalog.py
+# -*- coding: utf-8 -*-
+"""
+进程内共享的图片目录（image_id → rel_path / content_hash）
+
+images 表在一次实验里基本不变（6000 行），没必要每张图查一次库、再在每个 session 里各存一份
+- 每个进程整表读一次，放进 st.cache_resource（调用方按版本号做缓存 key，版本变了自动重新读）
+  app_pg：版本 = exp_config.updated_at（import_plan_to_pg.py 导入时更新）
+  app5  ：版本 = manifest CSV 的 mtime（images 表从它导入）
+- 存成几个平行的 tuple + 一个 id → 下标的 dict；image_id 做 sys.intern，
+  和 session 里 assigned_ids 的字符串比较 / 哈希更快
+- 目录是只读的，多线程直接读，不需要锁
+"""
+
+import sys
+
+
+class ImageCatalog:
+    __slots__ = ("version", "ids", "rel_paths", "hashes", "index")
+
+    def __init__(self, rows, version=None):
+        """rows: (image_id, rel_path) 或 (image_id, rel_path, content_hash)"""
+        ids, rel_paths, hashes = [], [], []
+        for r in rows:
+            ids.append(sys.intern(str(r[0])))
+            rel_paths.append(r[1])
+            hashes.append(r[2] if len(r) > 2 else None)
+        self.version = version
+        self.ids = tuple(ids)
+        self.rel_paths = tuple(rel_paths)
+        self.hashes = tuple(hashes)
+        self.index = {x: i for i, x in enumerate(self.ids)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, image_id):
+        return image_id in self.index
+
+    def rel_path(self, image_id: str):
+        i = self.index.get(image_id)
+        return None if i is None else self.rel_paths[i]
+
+    def get(self, image_id: str):
+        """返回 (rel_path, content_hash)；找不到返回 None"""
+        i = self.index.get(image_id)
+        return None if i is None else (self.rel_paths[i], self.hashes[i])
+
+    def stats(self) -> dict:
+        return {
+            "images": len(self.ids),
+            "with_hash": sum(h is not None for h in self.hashes),
+            "version": str(self.version),
+        }
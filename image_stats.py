@@ -0,0 +1,106 @@
+# image_stats.py
+# -*- coding: utf-8 -*-
+"""
+每张图的评分累计：image_stats (image_id, n, s1, s2)，给 app_pg 的 adaptive 模式用
+
+- n / s1 / s2 = 这张图的评分条数 / Σscore / Σscore²（image_id 或 score 为空的行不算）
+- 和 participant_progress 一样由语句级触发器在同一个事务里维护：
+  后台 writer 一批几十条只 UPSERT 一次，按 image_id 排序加锁，并发批次不会互相死锁
+- adaptive 每 ADAPTIVE_REFRESH_SEC 秒读一遍这张 6000 行的小表，不再 GROUP BY 整张 ratings
+- 建表 / 触发器 / 首次回填由 migrations.py 做；对不上时用这里的 rebuild 从 ratings 重算：
+
+    python image_stats.py --dsn postgresql://...
+"""
+
+import argparse
+
+PG_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS image_stats (
+        image_id TEXT PRIMARY KEY,
+        n INTEGER NOT NULL DEFAULT 0,
+        s1 DOUBLE PRECISION NOT NULL DEFAULT 0,
+        s2 DOUBLE PRECISION NOT NULL DEFAULT 0
+    )
+    """,
+    # INSERT 加、DELETE 减（TG_ARGV[0] = 1 / -1）
+    """
+    CREATE OR REPLACE FUNCTION image_stats_apply() RETURNS trigger AS $$
+    DECLARE
+        sign INTEGER := TG_ARGV[0]::INTEGER;
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            INSERT INTO image_stats AS st (image_id, n, s1, s2)
+            SELECT image_id, COUNT(*), SUM(score), SUM(score * score)
+            FROM new_rows
+            WHERE image_id IS NOT NULL AND score IS NOT NULL
+            GROUP BY image_id
+            ORDER BY image_id
+            ON CONFLICT (image_id) DO UPDATE SET
+                n = st.n + EXCLUDED.n,
+                s1 = st.s1 + EXCLUDED.s1,
+                s2 = st.s2 + EXCLUDED.s2;
+        ELSE
+            UPDATE image_stats AS st
+            SET n = GREATEST(st.n + sign * d.n, 0),
+                s1 = st.s1 + sign * d.s1,
+                s2 = st.s2 + sign * d.s2
+            FROM (
+                SELECT image_id, COUNT(*) AS n, SUM(score) AS s1, SUM(score * score) AS s2
+                FROM old_rows
+                WHERE image_id IS NOT NULL AND score IS NOT NULL
+                GROUP BY image_id
+            ) d
+            WHERE st.image_id = d.image_id;
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS trg_image_stats_ins ON ratings",
+    """
+    CREATE TRIGGER trg_image_stats_ins AFTER INSERT ON ratings
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT
+    EXECUTE FUNCTION image_stats_apply('1')
+    """,
+    "DROP TRIGGER IF EXISTS trg_image_stats_del ON ratings",
+    """
+    CREATE TRIGGER trg_image_stats_del AFTER DELETE ON ratings
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT
+    EXECUTE FUNCTION image_stats_apply('-1')
+    """,
+]
+
+PG_REBUILD = [
+    "LOCK TABLE ratings IN SHARE MODE",
+    "DELETE FROM image_stats",
+    """
+    INSERT INTO image_stats (image_id, n, s1, s2)
+    SELECT image_id, COUNT(*), SUM(score), SUM(score * score)
+    FROM ratings
+    WHERE image_id IS NOT NULL AND score IS NOT NULL
+    GROUP BY image_id
+    """,
+]
+
+
+def rebuild_pg(conn) -> int:
+    """从 ratings 重算；返回有评分的图片数"""
+    with conn.cursor() as cur:
+        for sql in PG_REBUILD:
+            cur.execute(sql)
+        cur.execute("SELECT COUNT(*) FROM image_stats")
+        n = cur.fetchone()[0]
+    conn.commit()
+    return int(n)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--dsn", required=True)
+    args = ap.parse_args()
+
+    import psycopg
+    with psycopg.connect(args.dsn) as conn:
+        n = rebuild_pg(conn)
+    print(f"✅ image_stats rebuilt: {n} images")
@@ -0,0 +1,219 @@
+import csv
+import time
+import argparse
+from collections import Counter
+
+from pg_slots import sync_slots
+
+# 把 manifest（images）+ assignment_plan + exp_config 一次性导入 Postgres（app_pg 用）
+# - 文件先在本地读完、校验完，再连数据库：连接只占用“传数据 + 换表”那几秒
+# - COPY ... FROM STDIN 流式写入 *_new 临时表，建好主键后在同一个事务里 rename 换掉旧表
+#   读者要么看到完整的旧数据，要么看到完整的新数据；任何一步失败整个事务回滚，旧表不动
+# - 15 万行 plan 走 COPY 是秒级，逐行 INSERT / executemany 在 free tier 上要几分钟
+
+IMAGE_COLS = ["image_id", "rel_path", "category", "category_name", "resolution",
+              "distortion", "distortion_name", "content_hash"]
+PLAN_COLS = ["slot", "ord", "image_id"]
+
+# 换表时拿不到 ACCESS EXCLUSIVE 锁就放弃，不让线上查询排在后面一直等
+SWAP_LOCK_TIMEOUT = "5s"
+
+
+def read_manifest(path, hashes):
+    rows = []
+    with open(path, "r", encoding="utf-8") as f:
+        for r in csv.DictReader(f):
+            image_id = r["image_id"].strip()
+            rows.append((
+                image_id,
+                r["rel_path"].strip(),
+                int(r["category"]),
+                (r.get("category_name") or "").strip() or None,
+                r["resolution"].strip(),
+                int(r["distortion"]),
+                (r.get("distortion_name") or "").strip() or None,
+                hashes.get(image_id),
+            ))
+    return rows
+
+
+def read_hash_index(path):
+    """build_hash_index.py 的输出；没有就返回空 dict（content_hash 沿用线上 images 里的旧值）"""
+    if not path:
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return {r["image_id"].strip(): r["content_hash"].strip() for r in csv.DictReader(f)}
+
+
+def read_plan(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [(int(r["slot"]), int(r["ord"]), r["image_id"].strip()) for r in csv.DictReader(f)]
+
+
+def check_inputs(images, plan):
+    """返回 (p_total, r_target, n_images, k_per_person)；数据不一致直接报错，不碰数据库"""
+    ids = [r[0] for r in images]
+    dup = [x for x, c in Counter(ids).items() if c > 1]
+    if dup:
+        raise RuntimeError(f"manifest 里 image_id 重复：{dup[:5]}")
+
+    known = set(ids)
+    unknown = {r[2] for r in plan} - known
+    if unknown:
+        raise RuntimeError(f"plan 里有 {len(unknown)} 张图不在 manifest 中，例如 {sorted(unknown)[:5]}")
+
+    if len({(r[0], r[1]) for r in plan}) != len(plan):
+        raise RuntimeError("plan 里 (slot, ord) 有重复")
+
+    per_slot = Counter(r[0] for r in plan)
+    sizes = set(per_slot.values())
+    if len(sizes) != 1:
+        raise RuntimeError(f"每个 slot 的张数不一致：{sorted(sizes)[:5]}")
+
+    slots = sorted(per_slot)
+    if slots != list(range(1, len(slots) + 1)):
+        raise RuntimeError("slot 必须从 1 开始连续编号（allocate_next_slot 的约定）")
+
+    counts = Counter(r[2] for r in plan)
+    return len(slots), max(counts.values()), len(ids), sizes.pop()
+
+
+def copy_rows(cur, table, cols, rows):
+    with cur.copy(f"COPY {table} ({', '.join(cols)}) FROM STDIN") as cp:
+        for row in rows:
+            cp.write_row(row)
+
+
+def carry_over_hashes(cur) -> int:
+    """images_new 里没给 content_hash 的行，沿用旧 images 同 image_id、同 rel_path 的值
+
+    不带 --hash-index 重导 plan 是常见操作，不能顺手把 R2 内容寻址 URL 用的哈希清空；
+    rel_path 变了说明文件可能换了，旧哈希不可信，留 NULL 等下次 build_hash_index
+    """
+    cur.execute("SELECT to_regclass('images') IS NOT NULL")
+    if not cur.fetchone()[0]:
+        return 0
+    cur.execute("""
+    UPDATE images_new n
+    SET content_hash = o.content_hash
+    FROM images o
+    WHERE n.image_id = o.image_id
+      AND n.rel_path = o.rel_path
+      AND n.content_hash IS NULL
+      AND o.content_hash IS NOT NULL
+    """)
+    return cur.rowcount
+
+
+def swap_table(cur, name):
+    """{name}_new -> {name}；旧表删掉，主键索引跟着改名"""
+    cur.execute(f"DROP TABLE IF EXISTS {name}")
+    cur.execute(f"ALTER TABLE {name}_new RENAME TO {name}")
+    cur.execute(f"ALTER INDEX {name}_new_pkey RENAME TO {name}_pkey")
+
+
+def import_to_pg(dsn, images, plan, cfg):
+    import psycopg
+
+    p_total, r_target, n_images, k_per = cfg
+    with psycopg.connect(dsn) as conn:
+        with conn.cursor() as cur:
+            t0 = time.perf_counter()
+
+            # 1) staging：先灌数据再建主键，比边插边维护索引快
+            cur.execute("DROP TABLE IF EXISTS images_new")
+            cur.execute("""
+            CREATE TABLE images_new (
+                image_id TEXT NOT NULL,
+                rel_path TEXT NOT NULL,
+                category INTEGER NOT NULL,
+                category_name TEXT,
+                resolution TEXT NOT NULL,
+                distortion INTEGER NOT NULL,
+                distortion_name TEXT,
+                content_hash TEXT
+            )
+            """)
+            cur.execute("DROP TABLE IF EXISTS assignment_plan_new")
+            cur.execute("""
+            CREATE TABLE assignment_plan_new (
+                slot INTEGER NOT NULL,
+                ord INTEGER NOT NULL,
+                image_id TEXT NOT NULL
+            )
+            """)
+
+            copy_rows(cur, "images_new", IMAGE_COLS, images)
+            copy_rows(cur, "assignment_plan_new", PLAN_COLS, plan)
+            n_kept = carry_over_hashes(cur)
+            cur.execute("ALTER TABLE images_new ADD CONSTRAINT images_new_pkey PRIMARY KEY (image_id)")
+            cur.execute("ALTER TABLE assignment_plan_new ADD CONSTRAINT assignment_plan_new_pkey PRIMARY KEY (slot, ord)")
+            t1 = time.perf_counter()
+
+            # 2) swap：只有这一段会挡住线上读
+            cur.execute(f"SET LOCAL lock_timeout = '{SWAP_LOCK_TIMEOUT}'")
+            swap_table(cur, "images")
+            swap_table(cur, "assignment_plan")
+
+            # slot 租约表（PG_SLOT_MODE=lease 时存在）按新 plan 重算 n_total / n_rated
+            cur.execute("SELECT to_regclass('slots') IS NOT NULL")
+            if cur.fetchone()[0]:
+                sync_slots(cur)
+
+            # 3) exp_config；updated_at 变了，各进程的图片目录缓存会失效
+            cur.execute("""
+            CREATE TABLE IF NOT EXISTS exp_config (
+                id INTEGER PRIMARY KEY DEFAULT 1,
+                p_total INTEGER NOT NULL,
+                r_target INTEGER NOT NULL,
+                n_images INTEGER NOT NULL,
+                k_per_person INTEGER NOT NULL,
+                updated_at TIMESTAMP NOT NULL
+            )
+            """)
+            cur.execute(
+                """
+                INSERT INTO exp_config (id, p_total, r_target, n_images, k_per_person, updated_at)
+                VALUES (1, %s, %s, %s, %s, now())
+                ON CONFLICT (id) DO UPDATE SET
+                    p_total = EXCLUDED.p_total,
+                    r_target = EXCLUDED.r_target,
+                    n_images = EXCLUDED.n_images,
+                    k_per_person = EXCLUDED.k_per_person,
+                    updated_at = EXCLUDED.updated_at
+                """,
+                (p_total, r_target, n_images, k_per),
+            )
+        conn.commit()
+        t2 = time.perf_counter()
+
+    print(f"✅ COPY {len(images)} images + {len(plan)} plan rows in {t1 - t0:.2f}s, swap + commit in {t2 - t1:.2f}s")
+    if n_kept:
+        print(f"   kept {n_kept} content_hash values from the previous images table")
+
+
+def main(manifest, plan_path, hash_index, dsn):
+    t0 = time.perf_counter()
+    images = read_manifest(manifest, read_hash_index(hash_index))
+    plan = read_plan(plan_path)
+    cfg = check_inputs(images, plan)
+    p_total, r_target, n_images, k_per = cfg
+    n_hashed = sum(1 for r in images if r[-1])
+    print(f"✅ read {n_images} images ({n_hashed} with content_hash), {len(plan)} plan rows "
+          f"in {time.perf_counter() - t0:.2f}s")
+    print(f"   P={p_total}  K={k_per}  R={r_target}")
+
+    if not dsn:
+        print("ℹ️ 没有 --dsn，只做了本地校验")
+        return
+    import_to_pg(dsn, images, plan, cfg)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--manifest", default="manifest_6000.csv")
+    ap.add_argument("--plan", default="assignment_plan.csv", help="make_assignment_plan_from_manifest.py / optimize_assignment_plan.py 的输出")
+    ap.add_argument("--hash-index", default="", help="可选：build_hash_index.py 的输出，一起写入 content_hash；没给的图沿用线上旧值")
+    ap.add_argument("--dsn", default="", help="Postgres 连接串；不给就只做本地校验（会替换线上表，所以不默认读 DATABASE_URL）")
+    args = ap.parse_args()
+    main(args.manifest, args.plan, args.hash_index or None, args.dsn.strip())
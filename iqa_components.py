@@ -0,0 +1,84 @@
+# iqa_components.py
+# -*- coding: utf-8 -*-
+"""
+自定义 Streamlit 组件（前端在 frontend/ 下，纯 HTML+JS，不需要 npm build）
+"""
+
+import os
+
+import streamlit.components.v1 as components
+
+_FRONTEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "frontend")
+
+# 评分页 iframe 和预取 iframe 同源，共用这个 Cache API 名字
+PREFETCH_CACHE_NAME = "iqa-prefetch-v1"
+
+_r2_prefetch = components.declare_component(
+    "r2_prefetch",
+    path=os.path.join(_FRONTEND_DIR, "r2_prefetch"),
+)
+
+
+def r2_prefetch(urls, concurrency: int = 4, key: str = "r2_prefetch"):
+    """
+    后台预取一批图片 URL 到浏览器 Cache API
+    返回 {"ready": n, "failed": m, "total": t}（队列没跑完之前是 None）
+    key 要固定：iframe 不重建，队列状态才能跨 rerun 保留
+    """
+    return _r2_prefetch(
+        urls=list(urls),
+        concurrency=int(concurrency),
+        cache_name=PREFETCH_CACHE_NAME,
+        key=key,
+        default=None,
+    )
+
+
+def cached_img_script(img_dom_id: str, url: str) -> str:
+    """
+    给 components.html 用：如果预取组件已经把 url 放进 Cache API，
+    就直接用 blob URL 显示，不再走网络
+    """
+    return f"""
+    <script>
+      (async () => {{
+        const img = document.getElementById("{img_dom_id}");
+        const url = "{url}";
+        try {{
+          if ("caches" in window) {{
+            const cache = await caches.open("{PREFETCH_CACHE_NAME}");
+            const hit = await cache.match(url);
+            if (hit) {{
+              img.src = URL.createObjectURL(await hit.blob());
+              return;
+            }}
+          }}
+        }} catch (e) {{}}
+        img.src = url;
+      }})();
+    </script>
+    """
+
+
+_progressive_image = components.declare_component(
+    "progressive_image",
+    path=os.path.join(_FRONTEND_DIR, "progressive_image"),
+)
+
+
+def progressive_image(image_id: str, full_url: str, preview_url=None,
+                      caption: str = "", height: int = 800, key=None):
+    """
+    先显示低清占位图，原图下载 + decode 完成后替换
+    返回 {"image_id", "decoded": True, "ms"}；原图还没好时返回 None
+    """
+    return _progressive_image(
+        image_id=image_id,
+        full_url=full_url,
+        preview_url=preview_url,
+        caption=caption,
+        height=int(height),
+        cache_name=PREFETCH_CACHE_NAME,
+        key=key or f"progressive_{image_id}",
+        default=None,
+    )
@@ -0,0 +1,203 @@
+import csv
+import argparse
+from collections import Counter
+from datetime import datetime
+
+import numpy as np
+
+# 离线生成 app_pg 用的 assignment_plan（P 个 slot × 每人 K 张）
+# 约束：
+#   1) 每张图恰好出现 R_TARGET 次
+#   2) 每个 slot 内不重复
+#   3) 每个 slot 在每个 (category × resolution × distortion) 至少 COVER_M 张
+#      （库存不够 P×COVER_M 的 strata 做不到，就尽量平均摊开，并在输出里列出来）
+# 做法：每个 strata 的 n_s×R 个“名额”按比例切给 P 个 slot（余数轮转分配，保证每行正好 K），
+#      然后把该 strata 的图片循环排列 R 遍，按 slot 顺序切块 —— 块长 ≤ n_s，所以块内不会重复
+
+P = 300
+R_TARGET = 25
+COVER_M = 2
+
+
+def build_strata_key(cat, res, dist) -> str:
+    return f"{cat}|{res}|{dist}"
+
+
+def read_manifest(path):
+    image_ids, keys = [], []
+    with open(path, "r", encoding="utf-8") as f:
+        for r in csv.DictReader(f):
+            image_ids.append(r["image_id"].strip())
+            keys.append(build_strata_key(int(r["category"]), r["resolution"].strip(), int(r["distortion"])))
+    strata_names = sorted(set(keys))
+    code_of = {k: i for i, k in enumerate(strata_names)}
+    strata = np.array([code_of[k] for k in keys], dtype=np.int32)
+    return np.array(image_ids, dtype=object), strata, strata_names
+
+
+def slot_quotas(n_per_strata: np.ndarray, p: int, r: int) -> np.ndarray:
+    """
+    quota[slot, s]：slot 从 strata s 拿几张
+    每列和 = n_s × R；每行和 = K；同一列里最多差 1
+    """
+    total = n_per_strata * r
+    base = total // p
+    rem = total % p
+    # 余数名额在 slot 上轮转：strata s 的 +1 落在 [start_s, start_s + rem_s) mod P
+    start = (np.cumsum(rem) - rem) % p
+    slot_idx = np.arange(p)[:, None]
+    extra = ((slot_idx - start[None, :]) % p) < rem[None, :]
+    return base[None, :] + extra.astype(np.int64)
+
+
+def build_plan(strata: np.ndarray, p: int, r: int, k: int, seed: int = 42) -> np.ndarray:
+    n = len(strata)
+    if n * r != p * k:
+        raise ValueError(f"N×R ({n}×{r}={n * r}) 必须等于 P×K ({p}×{k}={p * k})")
+    if r > p:
+        raise ValueError("R_TARGET 不能大于 P（同一 slot 会重复）")
+
+    rng = np.random.default_rng(seed)
+    n_s = np.bincount(strata)
+    quota = slot_quotas(n_s, p, r)
+    assert (quota.sum(axis=1) == k).all()
+    assert (quota <= n_s[None, :]).all()
+
+    slots_all, imgs_all = [], []
+    for s in range(len(n_s)):
+        members = rng.permutation(np.flatnonzero(strata == s))
+        seq = np.tile(members, r)                               # 每张图恰好 R 次
+        slots_all.append(np.repeat(np.arange(p), quota[:, s]))   # 连续切块给各 slot
+        imgs_all.append(seq)
+
+    slots_all = np.concatenate(slots_all)
+    imgs_all = np.concatenate(imgs_all)
+    order = np.argsort(slots_all, kind="stable")
+    plan = imgs_all[order].reshape(p, k)
+
+    # slot 内顺序打乱（对应 SQLite 版的 random.shuffle(chosen)）
+    return rng.permuted(plan, axis=1)
+
+
+def validate_plan(plan: np.ndarray, strata: np.ndarray, r: int, cover_m: int, strata_names):
+    p, k = plan.shape
+    n = len(strata)
+
+    counts = np.bincount(plan.ravel(), minlength=n)
+    assert (counts == r).all(), f"有图片出现次数 != {r}：min={counts.min()} max={counts.max()}"
+
+    srt = np.sort(plan, axis=1)
+    assert not (srt[:, 1:] == srt[:, :-1]).any(), "有 slot 内重复的图片"
+
+    n_strata = len(strata_names)
+    per_slot = np.zeros((p, n_strata), dtype=np.int64)
+    np.add.at(per_slot, (np.repeat(np.arange(p), k), strata[plan.ravel()]), 1)
+    min_per_strata = per_slot.min(axis=0)
+
+    n_s = np.bincount(strata, minlength=n_strata)
+    feasible = n_s * r >= p * cover_m
+    bad = [strata_names[s] for s in range(n_strata) if feasible[s] and min_per_strata[s] < cover_m]
+    assert not bad, f"可行的 strata 没达到 COVER_M：{bad[:5]}"
+    short = [
+        (strata_names[s], int(n_s[s]), int(min_per_strata[s]))
+        for s in range(n_strata) if min_per_strata[s] < cover_m
+    ]
+    return per_slot, short
+
+
+def write_plan_csv(plan, image_ids, out_plan):
+    p_, k_ = plan.shape
+    with open(out_plan, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["slot", "ord", "image_id"])
+        slots = np.repeat(np.arange(1, p_ + 1), k_)   # slot 从 1 开始（allocate_next_slot 的约定）
+        ords = np.tile(np.arange(k_), p_)
+        w.writerows(zip(slots.tolist(), ords.tolist(), image_ids[plan.ravel()].tolist()))
+
+
+def read_plan_csv(path, image_ids):
+    """assignment_plan.csv -> (P, K) 的图片下标矩阵（按 slot, ord 排）"""
+    index_of = {x: i for i, x in enumerate(image_ids.tolist())}
+    rows = []
+    with open(path, "r", encoding="utf-8") as f:
+        for r in csv.DictReader(f):
+            rows.append((int(r["slot"]), int(r["ord"]), index_of[r["image_id"].strip()]))
+    rows.sort()
+    slots = sorted({r[0] for r in rows})
+    k = len(rows) // len(slots)
+    return np.array([r[2] for r in rows], dtype=np.int64).reshape(len(slots), k)
+
+
+def write_outputs(plan, image_ids, out_plan, out_config, p, r, k):
+    write_plan_csv(plan, image_ids, out_plan)
+
+    with open(out_config, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["p_total", "r_target", "n_images", "k_per_person"])
+        w.writerow([p, r, len(image_ids), k])
+
+
+def write_exp_config_pg(dsn, p, r, n, k):
+    import psycopg
+
+    with psycopg.connect(dsn) as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO exp_config (id, p_total, r_target, n_images, k_per_person, updated_at)
+                VALUES (1, %s, %s, %s, %s, %s)
+                ON CONFLICT (id) DO UPDATE SET
+                    p_total = EXCLUDED.p_total,
+                    r_target = EXCLUDED.r_target,
+                    n_images = EXCLUDED.n_images,
+                    k_per_person = EXCLUDED.k_per_person,
+                    updated_at = EXCLUDED.updated_at
+                """,
+                (p, r, n, k, datetime.now()),
+            )
+        conn.commit()
+    print("✅ exp_config row written to Postgres")
+
+
+def main(manifest, out_plan, out_config, p, r, k, cover_m, seed, dsn=None):
+    t0 = datetime.now()
+    image_ids, strata, strata_names = read_manifest(manifest)
+    n = len(image_ids)
+    if len(set(image_ids.tolist())) != n:
+        dup = [x for x, c in Counter(image_ids.tolist()).items() if c > 1]
+        raise RuntimeError(f"manifest 里 image_id 重复：{dup[:5]}")
+    if k is None:
+        if (n * r) % p:
+            raise RuntimeError(f"N×R={n * r} 不能被 P={p} 整除，请显式指定 --k 或调整参数")
+        k = n * r // p
+
+    plan = build_plan(strata, p, r, k, seed=seed)
+    per_slot, short = validate_plan(plan, strata, r, cover_m, strata_names)
+    write_outputs(plan, image_ids, out_plan, out_config, p, r, k)
+
+    dt = (datetime.now() - t0).total_seconds()
+    print(f"✅ plan: P={p} × K={k}  (N={n}, R={r}, strata={len(strata_names)})  in {dt:.2f}s")
+    print(f"✅ every image appears exactly {r} times; no duplicates within a slot")
+    print(f"✅ wrote {out_plan} and {out_config}")
+    if short:
+        print(f"⚠️ {len(short)} strata 库存不足 P×COVER_M，无法每人 {cover_m} 张（已尽量平均）：")
+        for name, n_s, mn in short[:10]:
+            print(f"   {name}: n={n_s}, 每个 slot 最少 {mn} 张")
+
+    if dsn:
+        write_exp_config_pg(dsn, p, r, n, k)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--manifest", default="manifest_6000.csv")
+    ap.add_argument("--out", default="assignment_plan.csv")
+    ap.add_argument("--config-out", default="exp_config.csv")
+    ap.add_argument("--p", type=int, default=P, help="slot 数（参与者数）")
+    ap.add_argument("--r", type=int, default=R_TARGET, help="每张图的评分次数")
+    ap.add_argument("--k", type=int, default=None, help="每人张数（默认 N×R/P）")
+    ap.add_argument("--cover-m", type=int, default=COVER_M)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--dsn", default="", help="可选：把 exp_config 行写进 Postgres")
+    args = ap.parse_args()
+    main(args.manifest, args.out, args.config_out, args.p, args.r, args.k, args.cover_m, args.seed, dsn=args.dsn or None)
@@ -0,0 +1,260 @@
+# migrations.py
+# -*- coding: utf-8 -*-
+"""
+带版本号的建表 / 改表（app5 / app5_fixed 用 SQLite，app_pg 用 Postgres）
+
+原来 init_db / ensure_ratings_columns 每次 rerun 都跑一遍，ensure_schema_once 里是一串 DO 块
+现在：
+- schema_version 表记录已经应用到第几号
+- 每个 migration = (版本号, 名字, 步骤列表)；步骤是 SQL 字符串，或 callable(cur)（要先看表结构的）
+- 整个升级在一个事务里，先拿锁（SQLite: BEGIN IMMEDIATE；PG: advisory lock），
+  多个进程同时启动只有一个真正执行，其他的拿到锁后发现版本已经是最新，直接返回
+- 已有的库：前几号都是 IF NOT EXISTS，跑一遍不会动数据
+调用方负责“每个进程只调一次”（st.cache_resource）
+新加表 / 索引：在列表末尾追加新版本号，不要改已经发布的
+"""
+
+from datetime import datetime
+
+import image_stats
+import participant_progress
+
+
+def _sqlite_add_columns(table: str, cols: dict):
+    """SQLite 没有 ADD COLUMN IF NOT EXISTS：先看 PRAGMA table_info"""
+    def step(cur):
+        cur.execute(f"PRAGMA table_info({table})")
+        have = {row[1] for row in cur.fetchall()}
+        for name, decl in cols.items():
+            if name not in have:
+                cur.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
+    return step
+
+
+SQLITE_MIGRATIONS = [
+    (1, "base tables", [
+        """
+        CREATE TABLE IF NOT EXISTS participants (
+            participant_id TEXT PRIMARY KEY,
+            student_id TEXT,
+            device TEXT,
+            screen_resolution TEXT,
+            start_time TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS images (
+            image_id TEXT PRIMARY KEY,
+            rel_path TEXT NOT NULL,
+            category INTEGER NOT NULL,
+            category_name TEXT,
+            resolution TEXT NOT NULL,
+            distortion INTEGER NOT NULL,
+            distortion_name TEXT,
+            assigned_count INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS assignments (
+            participant_id TEXT NOT NULL,
+            image_id TEXT NOT NULL,
+            ord INTEGER NOT NULL,
+            assigned_time TEXT NOT NULL,
+            PRIMARY KEY (participant_id, image_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS ratings (
+            participant_id TEXT,
+            image_name TEXT,
+            score INTEGER,
+            label TEXT,
+            time TEXT,
+            text_clarity TEXT,
+            color_correctness TEXT,
+            image_id TEXT
+        )
+        """,
+    ]),
+    # 很早的库 ratings 只有前 5 列
+    (2, "ratings.text_clarity / image_id", [
+        _sqlite_add_columns("ratings", {"text_clarity": "TEXT", "image_id": "TEXT"}),
+    ]),
+    # sqlite_assign.py：StrataIndex 按 generation 判断要不要重新 load
+    (3, "assign_meta", [
+        """
+        CREATE TABLE IF NOT EXISTS assign_meta (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            generation INTEGER NOT NULL
+        )
+        """,
+        "INSERT OR IGNORE INTO assign_meta (id, generation) VALUES (1, 0)",
+    ]),
+    (4, "hot query indexes", [
+        # 进度 / 回收 / 评分去重：按 participant_id（+ image_id）
+        "CREATE INDEX IF NOT EXISTS idx_ratings_pid_image ON ratings (participant_id, image_id)",
+        # 每张图的 MOS / 评分次数：GROUP BY image_id 只读索引（覆盖 score）
+        "CREATE INDEX IF NOT EXISTS idx_ratings_image_score ON ratings (image_id, score)",
+        # 老同学回来按学号找最近一次
+        "CREATE INDEX IF NOT EXISTS idx_participants_student ON participants (student_id, start_time)",
+        # 评分页按 ord 取分配列表，不用再排序
+        "CREATE INDEX IF NOT EXISTS idx_assignments_pid_ord ON assignments (participant_id, ord)",
+    ]),
+    # 触发器维护的进度计数（participant_progress.py），建好后从原始表回填一次
+    (5, "participant_progress", participant_progress.SQLITE_SCHEMA + participant_progress.SQLITE_REBUILD),
+    # 老 app5 / app4 建的 ratings 都有 color_correctness（现在不再写，但导出 / 老查询还会读）；
+    # 早先按没有这一列的 v1 新建的库在这里补上
+    (6, "ratings.color_correctness", [
+        _sqlite_add_columns("ratings", {"color_correctness": "TEXT"}),
+    ]),
+]
+
+PG_MIGRATIONS = [
+    (1, "base tables", [
+        """
+        CREATE TABLE IF NOT EXISTS participants (
+            participant_id TEXT PRIMARY KEY,
+            student_id TEXT,
+            device TEXT,
+            screen_resolution TEXT,
+            start_time TIMESTAMP,
+            slot INTEGER
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS assignments (
+            participant_id TEXT NOT NULL,
+            image_id TEXT NOT NULL,
+            ord INTEGER NOT NULL,
+            assigned_time TIMESTAMP NOT NULL,
+            PRIMARY KEY (participant_id, image_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS ratings (
+            participant_id TEXT,
+            image_id TEXT,
+            image_name TEXT,
+            score INTEGER,
+            label TEXT,
+            time TIMESTAMP,
+            text_clarity TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS slot_counter (
+            id INTEGER PRIMARY KEY DEFAULT 1,
+            next_slot INTEGER NOT NULL
+        )
+        """,
+        "INSERT INTO slot_counter (id, next_slot) VALUES (1, 1) ON CONFLICT (id) DO NOTHING",
+        """
+        CREATE TABLE IF NOT EXISTS exp_config (
+            id INTEGER PRIMARY KEY DEFAULT 1,
+            p_total INTEGER NOT NULL,
+            r_target INTEGER NOT NULL,
+            n_images INTEGER NOT NULL,
+            k_per_person INTEGER NOT NULL,
+            updated_at TIMESTAMP NOT NULL
+        )
+        """,
+    ]),
+    # images 表由 import_plan_to_pg.py 创建；早期的 participants 没有 slot 列
+    (2, "images.content_hash / participants.slot", [
+        "ALTER TABLE IF EXISTS images ADD COLUMN IF NOT EXISTS content_hash TEXT",
+        "ALTER TABLE participants ADD COLUMN IF NOT EXISTS slot INTEGER",
+    ]),
+    (3, "hot query indexes", [
+        # get_progress / BOOTSTRAP_SQL / 评分去重 / lease 接手
+        "CREATE INDEX IF NOT EXISTS idx_ratings_pid_image ON ratings (participant_id, image_id)",
+        # adaptive 模式的每图统计：GROUP BY image_id 可以走 index-only scan
+        "CREATE INDEX IF NOT EXISTS idx_ratings_image_score ON ratings (image_id, score)",
+        "CREATE INDEX IF NOT EXISTS idx_participants_student ON participants (student_id, start_time DESC)",
+    ]),
+    (4, "participant_progress", participant_progress.PG_SCHEMA + participant_progress.PG_REBUILD),
+    # 评分写入（后台 writer 重试、日志回放）可能并发提交同一条；WHERE NOT EXISTS 在 READ COMMITTED 下挡不住，
+    # 改成唯一索引 + ON CONFLICT DO NOTHING。先删掉已有的重复（每对保留最早的一条），同名换成 UNIQUE
+    # 之后 lease 模式的 slots.n_rated 可能偏大：导入 plan 时的 sync_slots 会按评分重算
+    (5, "ratings unique (participant_id, image_id)", [
+        "LOCK TABLE ratings IN SHARE ROW EXCLUSIVE MODE",
+        """
+        DELETE FROM ratings r
+        USING (
+            SELECT ctid, ROW_NUMBER() OVER (PARTITION BY participant_id, image_id ORDER BY time, ctid) AS rn
+            FROM ratings
+            WHERE participant_id IS NOT NULL AND image_id IS NOT NULL
+        ) d
+        WHERE r.ctid = d.ctid AND d.rn > 1
+        """,
+        "DROP INDEX IF EXISTS idx_ratings_pid_image",
+        "CREATE UNIQUE INDEX idx_ratings_pid_image ON ratings (participant_id, image_id)",
+    ]),
+    # adaptive 模式：每图评分累计由触发器维护（image_stats.py）；
+    # pending 只算最近活跃的人，按 participant_progress.last_activity 找
+    (6, "image_stats / progress activity index", image_stats.PG_SCHEMA + image_stats.PG_REBUILD + [
+        "CREATE INDEX IF NOT EXISTS idx_progress_activity ON participant_progress (last_activity)",
+    ]),
+]
+
+# pg_advisory_xact_lock 的 key（任意常数，只要别和别的用途撞上）
+PG_MIGRATION_LOCK = 7_104_048
+
+
+def _current_version(cur) -> int:
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return int(cur.fetchone()[0])
+
+
+def _apply(cur, migrations, current: int, placeholder: str, now):
+    applied = []
+    for version, name, steps in migrations:
+        if version <= current:
+            continue
+        for step in steps:
+            if callable(step):
+                step(cur)
+            else:
+                cur.execute(step)
+        cur.execute(
+            f"INSERT INTO schema_version (version, name, applied_at) VALUES ({placeholder}, {placeholder}, {placeholder})",
+            (version, name, now)
+        )
+        applied.append(version)
+    return applied
+
+
+def migrate_sqlite(conn) -> list:
+    """返回这次应用的版本号列表；调用方持有 conn"""
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+        """)
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        applied = _apply(cur, SQLITE_MIGRATIONS, _current_version(cur), "?", now)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return applied
+
+
+def migrate_pg(conn) -> list:
+    """返回这次应用的版本号列表；在 conn 上提交"""
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (PG_MIGRATION_LOCK,))
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP NOT NULL
+        )
+        """)
+        applied = _apply(cur, PG_MIGRATIONS, _current_version(cur), "%s", datetime.now())
+    conn.commit()
+    return applied
@@ -0,0 +1,284 @@
+import time
+import math
+import argparse
+
+import numpy as np
+
+from make_assignment_plan_from_manifest import (
+    COVER_M,
+    read_manifest,
+    read_plan_csv,
+    validate_plan,
+    write_plan_csv,
+)
+
+# 在“计数正确”的 plan 上做交换式模拟退火，让它统计上更高效：
+#   co  ：任意两张图被同一个人评过的次数尽量平均
+#         Σ_{i≠j} C_ij²（C = AᵀA）= P·K² + 2·Σ_{p<q} O_pq² − N·R²，其中 O = AAᵀ 是 slot 两两重叠数
+#         Σ C_ij 是常数，所以最小化 Σ_{p<q} O_pq² 就是最小化图片对共现次数的方差；O 只有 P×P
+#   bal ：每个 slot 的 strata 构成贴近全局比例 Σ_p Σ_s (cnt[p,s] − K·n_s/N)²
+# 交换：slot p 的图 a ↔ slot q 的图 b（a∉q, b∉p），每张图次数和每人张数都不变
+# 覆盖约束：交换后每个 slot 在每个 strata 不能低于 min(COVER_M, 初始最小值)
+# 平衡约束：让 bal 变大的交换直接拒绝（不进退火的概率接受），所以 bal 只会不变或变小；
+#   同 strata 的两张图互换 bal 不变，始终可选
+
+
+class PlanState:
+    def __init__(self, plan: np.ndarray, strata: np.ndarray, n_strata: int):
+        self.plan = plan.copy()
+        self.p, self.k = plan.shape
+        self.n = len(strata)
+        self.strata = strata
+
+        # AT[i, p] = 图 i 是否在 slot p（按图片取一行是连续内存，交换时取列更快）
+        self.AT = np.zeros((self.n, self.p), dtype=np.int64)
+        self.AT[plan.ravel(), np.repeat(np.arange(self.p), self.k)] = 1
+        self.O = self.AT.T @ self.AT
+
+        self.cnt = np.zeros((self.p, n_strata), dtype=np.int64)
+        np.add.at(self.cnt, (np.repeat(np.arange(self.p), self.k), strata[plan.ravel()]), 1)
+        n_s = np.bincount(strata, minlength=n_strata)
+        self.target = self.k * n_s / self.n
+
+    # ---------- objectives ----------
+    def co_sum(self) -> float:
+        """Σ_{p<q} O_pq²"""
+        off = self.O.astype(np.float64)
+        return float((off ** 2).sum() - (np.diag(off) ** 2).sum()) / 2.0
+
+    def bal_sum(self) -> float:
+        return float(((self.cnt - self.target[None, :]) ** 2).sum())
+
+    # ---------- swap ----------
+    def delta(self, p, i, q, j):
+        a, b = self.plan[p, i], self.plan[q, j]
+        d = self.AT[b] - self.AT[a]
+        d[p] = 0
+        d[q] = 0
+        d_co = float(2 * np.dot(d, self.O[p] - self.O[q]) + 2 * np.dot(d, d))
+
+        sa, sb = self.strata[a], self.strata[b]
+        d_bal = 0.0
+        if sa != sb:
+            t = self.target
+            d_bal = (
+                -2 * (self.cnt[p, sa] - t[sa]) + 1
+                + 2 * (self.cnt[p, sb] - t[sb]) + 1
+                - 2 * (self.cnt[q, sb] - t[sb]) + 1
+                + 2 * (self.cnt[q, sa] - t[sa]) + 1
+            )
+        return d_co, d_bal, d
+
+    def apply(self, p, i, q, j, d):
+        a, b = self.plan[p, i], self.plan[q, j]
+        self.O[p] += d
+        self.O[:, p] += d
+        self.O[q] -= d
+        self.O[:, q] -= d
+        self.AT[a, p] = 0
+        self.AT[b, p] = 1
+        self.AT[b, q] = 0
+        self.AT[a, q] = 1
+        self.plan[p, i], self.plan[q, j] = b, a
+        sa, sb = self.strata[a], self.strata[b]
+        if sa != sb:
+            self.cnt[p, sa] -= 1
+            self.cnt[p, sb] += 1
+            self.cnt[q, sb] -= 1
+            self.cnt[q, sa] += 1
+
+
+def pair_cooccurrence_stats(state: PlanState, r: int):
+    """图片对共现次数的均值 / 方差（由 O 推出来，不用构造 N×N 的 C）"""
+    n, p, k = state.n, state.p, state.k
+    n_pairs = n * (n - 1)
+    sum_c2 = p * k * k + 2 * state.co_sum() - n * r * r
+    mean = p * k * (k - 1) / n_pairs
+    var = sum_c2 / n_pairs - mean ** 2
+    off = state.O[~np.eye(p, dtype=bool)]
+    return {
+        "pair_mean": mean,
+        "pair_var": var,
+        "slot_overlap_mean": float(off.mean()),
+        "slot_overlap_max": int(off.max()),
+        "balance": state.bal_sum(),
+    }
+
+
+def print_stats(title, s):
+    print(
+        f"{title}: pair co-occurrence var={s['pair_var']:.6f} (mean={s['pair_mean']:.4f}) | "
+        f"slot overlap mean={s['slot_overlap_mean']:.2f} max={s['slot_overlap_max']} | "
+        f"strata balance={s['balance']:.1f}"
+    )
+
+
+def initial_temperature(uphill, target: float) -> float:
+    """
+    二分找 T0，使抽样里上坡交换（ΔJ > 0）的平均接受概率 exp(−ΔJ/T0) ≈ target
+    只看上坡：初始 plan 没优化过，合格交换里九成以上本来就是下坡，按总接受率定温度会退化成贪心
+    """
+    uphill = np.asarray(uphill, dtype=np.float64)
+    if not len(uphill):
+        return 1e-6
+    lo, hi = np.log(uphill.min() * 1e-3 + 1e-12), np.log(uphill.max() * 1e3)
+    for _ in range(60):
+        mid = (lo + hi) / 2
+        if np.exp(-uphill / np.exp(mid)).mean() < target:
+            lo = mid
+        else:
+            hi = mid
+    return float(np.exp(hi))
+
+
+def optimize(state: PlanState, floor: np.ndarray, seconds: float, balance_weight: float, seed: int,
+             target_accept: float = 0.4, block: int = 4096):
+    rng = np.random.default_rng(seed)
+    p, k = state.p, state.k
+    strata, cnt, target = state.strata, state.cnt, state.target
+
+    # 两个目标各自归一化到“每个 slot 对”/“每个 slot”的量级，再加权
+    co_scale = 1.0 / (p * (p - 1) / 2)
+    bal_scale = balance_weight / p
+
+    def candidates():
+        """
+        一次抽 block 个候选交换，按当前状态向量化筛掉明显不合格的（同 slot、图已在对方 slot、
+        破坏覆盖下限、让 bal 变大——不同 strata 的随机交换大多属于这一类）
+        筛完的候选在用之前还要逐个按最新状态复查（前面接受的交换可能改了 cnt / AT）
+        """
+        while True:
+            sp = rng.integers(0, p, size=block)
+            sq = rng.integers(0, p, size=block)
+            i = rng.integers(0, k, size=block)
+            j = rng.integers(0, k, size=block)
+            a, b = state.plan[sp, i], state.plan[sq, j]
+            sa, sb = strata[a], strata[b]
+            ok = (sp != sq) & (state.AT[a, sq] == 0) & (state.AT[b, sp] == 0)
+            cross = sa != sb
+            d_bal = np.where(
+                cross,
+                -2 * (cnt[sp, sa] - target[sa]) + 2 * (cnt[sp, sb] - target[sb])
+                - 2 * (cnt[sq, sb] - target[sb]) + 2 * (cnt[sq, sa] - target[sa]) + 4,
+                0.0,
+            )
+            ok &= ~cross | ((cnt[sp, sa] - 1 >= floor[sa]) & (cnt[sq, sb] - 1 >= floor[sb]) & (d_bal <= 0))
+            u = rng.random(size=block)
+            for idx in np.flatnonzero(ok):
+                yield int(sp[idx]), int(i[idx]), int(sq[idx]), int(j[idx]), float(u[idx])
+
+    def check(sp, i, sq, j):
+        """按最新状态复查；合格返回 (d_co, d_bal, d)，否则 None"""
+        a, b = state.plan[sp, i], state.plan[sq, j]
+        if state.AT[a, sq] or state.AT[b, sp]:
+            return None
+        sa, sb = strata[a], strata[b]
+        if sa != sb and (cnt[sp, sa] - 1 < floor[sa] or cnt[sq, sb] - 1 < floor[sb]):
+            return None
+        d_co, d_bal, d = state.delta(sp, i, sq, j)
+        if d_bal > 0:
+            return None
+        return d_co, d_bal, d
+
+    gen = candidates()
+
+    # 初始温度：抽合格交换，直到有 200 个上坡的，按上坡初始接受率 target_accept（默认 40%）定 T0
+    # （原来取 |ΔJ| 中位数，上坡几乎全收，前半程基本是随机游走）
+    uphill, tries = [], 0
+    while len(uphill) < 200 and tries < 200_000:
+        sp, i, sq, j, _u = next(gen)
+        tries += 1
+        r = check(sp, i, sq, j)
+        if r is not None:
+            dj = r[0] * co_scale + r[1] * bal_scale
+            if dj > 0:
+                uphill.append(dj)
+    t0 = initial_temperature(uphill, target_accept)
+    t_end = t0 * 1e-3
+
+    start = time.perf_counter()
+    moves = accepted = 0
+    uphill_tried = uphill_accepted = early_uphill_tried = early_uphill_accepted = 0
+    temp = t0
+    for sp, i, sq, j, u in gen:
+        if moves % 256 == 0:
+            frac = (time.perf_counter() - start) / seconds
+            if frac >= 1.0:
+                break
+            temp = t0 * (t_end / t0) ** frac   # 几何降温
+
+        r = check(sp, i, sq, j)
+        if r is None:
+            continue
+        d_co, d_bal, d = r
+        dj = d_co * co_scale + d_bal * bal_scale
+        moves += 1
+        if dj <= 0:
+            state.apply(sp, i, sq, j, d)
+            accepted += 1
+        else:
+            uphill_tried += 1
+            if u < math.exp(-dj / temp):
+                state.apply(sp, i, sq, j, d)
+                accepted += 1
+                uphill_accepted += 1
+                if moves < 20_000:
+                    early_uphill_accepted += 1
+            if moves < 20_000:
+                early_uphill_tried += 1
+
+    return {
+        "moves": moves,
+        "accepted": accepted,
+        "t0": t0,
+        "uphill_accept": uphill_accepted / max(uphill_tried, 1),
+        "early_uphill_accept": early_uphill_accepted / max(early_uphill_tried, 1),
+    }
+
+
+def main(manifest, plan_path, out_path, seconds, balance_weight, cover_m, seed, target_accept=0.4):
+    image_ids, strata, strata_names = read_manifest(manifest)
+    plan = read_plan_csv(plan_path, image_ids)
+    p, k = plan.shape
+    counts = np.bincount(plan.ravel(), minlength=len(image_ids))
+    r = int(counts.max())
+    validate_plan(plan, strata, r, cover_m, strata_names)
+
+    state = PlanState(plan, strata, len(strata_names))
+    floor = np.minimum(cover_m, state.cnt.min(axis=0))
+
+    before = pair_cooccurrence_stats(state, r)
+    print_stats("before", before)
+
+    run = optimize(state, floor, seconds, balance_weight, seed, target_accept)
+
+    after = pair_cooccurrence_stats(state, r)
+    print_stats("after ", after)
+    print(f"✅ {run['moves']} swaps tried, {run['accepted']} accepted in {seconds:.0f}s "
+          f"({run['moves'] / seconds:.0f}/s) | T0={run['t0']:.3g}, uphill accepted "
+          f"{run['early_uphill_accept']:.0%} in the first 20k moves, {run['uphill_accept']:.0%} overall")
+    print(f"   strata balance {before['balance']:.1f} → {after['balance']:.1f} "
+          f"({after['balance'] - before['balance']:+.1f}); pair co-occurrence var "
+          f"{before['pair_var']:.6f} → {after['pair_var']:.6f}")
+    assert after["balance"] <= before["balance"] + 1e-6, "strata balance got worse"
+
+    # 交换不会破坏计数约束，这里再校验一遍再写出
+    validate_plan(state.plan, strata, r, cover_m, strata_names)
+    write_plan_csv(state.plan, image_ids, out_path)
+    print(f"✅ wrote optimized plan to {out_path}")
+    return before, after
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--manifest", default="manifest_6000.csv")
+    ap.add_argument("--plan", default="assignment_plan.csv", help="make_assignment_plan_from_manifest.py 的输出")
+    ap.add_argument("--out", default="assignment_plan_opt.csv")
+    ap.add_argument("--seconds", type=float, default=60.0, help="时间预算")
+    ap.add_argument("--balance-weight", type=float, default=5.0, help="strata 平衡项相对共现项的权重")
+    ap.add_argument("--cover-m", type=int, default=COVER_M)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--target-accept", type=float, default=0.4, help="上坡交换的初始接受率，用来定 T0")
+    args = ap.parse_args()
+    main(args.manifest, args.plan, args.out, args.seconds, args.balance_weight, args.cover_m, args.seed,
+         args.target_accept)
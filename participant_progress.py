@@ -0,0 +1,206 @@
+# participant_progress.py
+# -*- coding: utf-8 -*-
+"""
+每个参与者的进度计数：participant_progress (participant_id, done, total, last_activity)
+
+- done  = ratings 行数，total = assignments 行数（回收会删 assignments，total 跟着减）
+- last_activity = 最近一次分配或评分的时间（sqlite_assign 的掉队回收用它判断）
+- 由触发器在同一个事务里维护：不管评分走哪条路径写进来（同步写、后台 writer、日志回放、lease CTE），
+  计数都不会漏；读进度变成一次主键查询，不再 COUNT(*) 两张表
+  SQLite：行级触发器（UPSERT）
+  PG：语句级触发器 + transition table，一条 unnest 插 500 行 assignments 只 UPSERT 一次
+- 建表 / 触发器 / 首次回填由 migrations.py 做；计数对不上时用这里的 rebuild 从原始表重算：
+
+    python participant_progress.py sqlite --db results.db
+    python participant_progress.py pg --dsn postgresql://...
+"""
+
+import argparse
+import sqlite3
+
+SQLITE_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS participant_progress (
+        participant_id TEXT PRIMARY KEY,
+        done INTEGER NOT NULL DEFAULT 0,
+        total INTEGER NOT NULL DEFAULT 0,
+        last_activity TEXT
+    )
+    """,
+    # 掉队回收按 last_activity 找人
+    "CREATE INDEX IF NOT EXISTS idx_progress_activity ON participant_progress (last_activity)",
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_progress_rating_ins AFTER INSERT ON ratings
+    BEGIN
+        INSERT INTO participant_progress (participant_id, done, last_activity)
+        VALUES (NEW.participant_id, 1, NEW.time)
+        ON CONFLICT (participant_id) DO UPDATE SET
+            done = done + 1,
+            last_activity = MAX(COALESCE(last_activity, ''), COALESCE(excluded.last_activity, ''));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_progress_rating_del AFTER DELETE ON ratings
+    BEGIN
+        UPDATE participant_progress SET done = MAX(done - 1, 0) WHERE participant_id = OLD.participant_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_progress_assign_ins AFTER INSERT ON assignments
+    BEGIN
+        INSERT INTO participant_progress (participant_id, total, last_activity)
+        VALUES (NEW.participant_id, 1, NEW.assigned_time)
+        ON CONFLICT (participant_id) DO UPDATE SET
+            total = total + 1,
+            last_activity = MAX(COALESCE(last_activity, ''), COALESCE(excluded.last_activity, ''));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_progress_assign_del AFTER DELETE ON assignments
+    BEGIN
+        UPDATE participant_progress SET total = MAX(total - 1, 0) WHERE participant_id = OLD.participant_id;
+    END
+    """,
+]
+
+SQLITE_REBUILD = [
+    "DELETE FROM participant_progress",
+    """
+    INSERT INTO participant_progress (participant_id, done, total, last_activity)
+    SELECT participant_id, SUM(done), SUM(total), MAX(t)
+    FROM (
+        SELECT participant_id, COUNT(*) AS done, 0 AS total, MAX(time) AS t
+        FROM ratings WHERE participant_id IS NOT NULL GROUP BY participant_id
+        UNION ALL
+        SELECT participant_id, 0, COUNT(*), MAX(assigned_time)
+        FROM assignments GROUP BY participant_id
+    )
+    GROUP BY participant_id
+    """,
+]
+
+PG_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS participant_progress (
+        participant_id TEXT PRIMARY KEY,
+        done INTEGER NOT NULL DEFAULT 0,
+        total INTEGER NOT NULL DEFAULT 0,
+        last_activity TIMESTAMP
+    )
+    """,
+    # TG_ARGV[0]：'done' / 'total'；TG_ARGV[1]：时间列名。INSERT 加、DELETE 减
+    """
+    CREATE OR REPLACE FUNCTION progress_apply() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            EXECUTE format($q$
+                INSERT INTO participant_progress AS pp (participant_id, %1$I, last_activity)
+                SELECT participant_id, COUNT(*), MAX(%2$I)
+                FROM new_rows
+                WHERE participant_id IS NOT NULL
+                GROUP BY participant_id
+                ORDER BY participant_id
+                ON CONFLICT (participant_id) DO UPDATE SET
+                    %1$I = pp.%1$I + EXCLUDED.%1$I,
+                    last_activity = GREATEST(pp.last_activity, EXCLUDED.last_activity)
+            $q$, TG_ARGV[0], TG_ARGV[1]);
+        ELSE
+            EXECUTE format($q$
+                UPDATE participant_progress AS pp
+                SET %1$I = GREATEST(pp.%1$I - d.n, 0)
+                FROM (SELECT participant_id, COUNT(*) AS n FROM old_rows GROUP BY participant_id) d
+                WHERE pp.participant_id = d.participant_id
+            $q$, TG_ARGV[0]);
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS trg_progress_rating_ins ON ratings",
+    """
+    CREATE TRIGGER trg_progress_rating_ins AFTER INSERT ON ratings
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT
+    EXECUTE FUNCTION progress_apply('done', 'time')
+    """,
+    "DROP TRIGGER IF EXISTS trg_progress_rating_del ON ratings",
+    """
+    CREATE TRIGGER trg_progress_rating_del AFTER DELETE ON ratings
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT
+    EXECUTE FUNCTION progress_apply('done', 'time')
+    """,
+    "DROP TRIGGER IF EXISTS trg_progress_assign_ins ON assignments",
+    """
+    CREATE TRIGGER trg_progress_assign_ins AFTER INSERT ON assignments
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT
+    EXECUTE FUNCTION progress_apply('total', 'assigned_time')
+    """,
+    "DROP TRIGGER IF EXISTS trg_progress_assign_del ON assignments",
+    """
+    CREATE TRIGGER trg_progress_assign_del AFTER DELETE ON assignments
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT
+    EXECUTE FUNCTION progress_apply('total', 'assigned_time')
+    """,
+]
+
+PG_REBUILD = [
+    # 重算期间挡住新的评分 / 分配，避免算到一半被改
+    "LOCK TABLE ratings, assignments IN SHARE MODE",
+    "DELETE FROM participant_progress",
+    """
+    INSERT INTO participant_progress (participant_id, done, total, last_activity)
+    SELECT participant_id, SUM(done), SUM(total), MAX(t)
+    FROM (
+        SELECT participant_id, COUNT(*) AS done, 0 AS total, MAX(time) AS t
+        FROM ratings WHERE participant_id IS NOT NULL GROUP BY participant_id
+        UNION ALL
+        SELECT participant_id, 0, COUNT(*), MAX(assigned_time)
+        FROM assignments GROUP BY participant_id
+    ) x
+    GROUP BY participant_id
+    """,
+]
+
+
+def rebuild_sqlite(conn) -> int:
+    """从 ratings / assignments 重算全部计数；返回参与者数"""
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        for sql in SQLITE_REBUILD:
+            cur.execute(sql)
+        n = cur.execute("SELECT COUNT(*) FROM participant_progress").fetchone()[0]
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return int(n)
+
+
+def rebuild_pg(conn) -> int:
+    with conn.cursor() as cur:
+        for sql in PG_REBUILD:
+            cur.execute(sql)
+        cur.execute("SELECT COUNT(*) FROM participant_progress")
+        n = cur.fetchone()[0]
+    conn.commit()
+    return int(n)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("backend", choices=["sqlite", "pg"])
+    ap.add_argument("--db", default="results.db")
+    ap.add_argument("--dsn", default="")
+    args = ap.parse_args()
+
+    if args.backend == "sqlite":
+        conn = sqlite3.connect(args.db, timeout=30)
+        n = rebuild_sqlite(conn)
+        conn.close()
+    else:
+        if not args.dsn:
+            ap.error("pg 模式需要 --dsn")
+        import psycopg
+        with psycopg.connect(args.dsn) as conn:
+            n = rebuild_pg(conn)
+    print(f"✅ participant_progress rebuilt: {n} participants")
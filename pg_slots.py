@@ -0,0 +1,157 @@
+# pg_slots.py
+# -*- coding: utf-8 -*-
+"""
+app_pg 的 slot 分配（PG_SLOT_MODE）
+
+- counter  : slot_counter 单行 SELECT ... FOR UPDATE 后 +1 —— 所有注册排队等这一行的锁
+- sequence : nextval('slot_seq') 取模 —— 序列不进事务、不拿行锁，100 人同时点开始也不排队
+- lease    : 租约（见下）；选 slot 用 FOR UPDATE SKIP LOCKED，并发的人各拿各的行，不互相等
+
+slot_counter / slot_seq 的做法都是对 p_total 取模轮转：中途放弃的 slot 不会被补，
+做完的 slot 反而会被下一轮重复拿到。租约模式：
+- slots 表：每个 slot 一行，holder / lease_until / n_rated（这个 slot 的 plan 图已经被评过几张）
+- 新参与者：一条 UPDATE 拿“没人持有或租约过期、且没做完”的 slot 里 n_rated 最小的
+  （被别的事务锁住的行直接跳过，拿下一条）
+- 每提交一条评分，同一条语句（CTE）里给 slot 的 n_rated +1，并给持有者续租；
+  只算当前持有者的评分：租约被接手后，原持有者继续评的图新持有者的列表里也有，不能算两次
+- 接手过期 slot 的人只拿这个 slot 里还没人评过的 plan 图
+只适用于 ASSIGN_MODE=plan（adaptive 模式不按 slot 发图）
+"""
+
+SLOT_LEASE_MIN = 30   # 默认租约（分钟）；app_pg 用 PG_SLOT_LEASE_MIN 覆盖
+
+
+# 参数：(p_total,)
+COUNTER_SLOT_SQL = """
+WITH s AS (
+    SELECT next_slot
+    FROM slot_counter
+    WHERE id=1
+    FOR UPDATE
+),
+u AS (
+    UPDATE slot_counter
+    SET next_slot = (s.next_slot %% %s) + 1
+    FROM s
+    WHERE id=1
+    RETURNING s.next_slot AS slot_assigned
+)
+SELECT slot_assigned FROM u;
+"""
+
+# 参数：(p_total,)；nextval 从 1 开始，slot 也从 1 开始
+# nextval 不是事务性的：事务回滚或被 _with_pool_or_fallback 重跑时号已经用掉，对应的 slot 被跳过
+SEQUENCE_SLOT_SQL = "SELECT ((nextval('slot_seq') - 1) %% %s) + 1;"
+
+
+def init_slot_seq(cur):
+    """第一次创建 slot_seq 时从 slot_counter.next_slot 接着往下发，切换模式不会从 1 重来"""
+    cur.execute("""
+    DO $$
+    BEGIN
+        IF to_regclass('slot_seq') IS NULL THEN
+            CREATE SEQUENCE slot_seq;
+            PERFORM setval('slot_seq', COALESCE((SELECT next_slot FROM slot_counter WHERE id=1), 1), false);
+        END IF;
+    END $$;
+    """)
+
+
+def init_slots(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS slots (
+        slot INTEGER PRIMARY KEY,
+        holder TEXT,
+        leased_at TIMESTAMPTZ,
+        lease_until TIMESTAMPTZ,
+        n_rated INTEGER NOT NULL DEFAULT 0,
+        n_total INTEGER NOT NULL
+    );
+    """)
+    # 选 slot：按 (n_rated, slot) 顺序扫，碰到第一条空闲的就停
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_slots_n_rated ON slots (n_rated, slot);")
+    # 接手时判断“这个 slot 的图谁评过”
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_participants_slot ON participants (slot);")
+    # 评分去重的唯一索引（migrations.py 已建；这里只是兜底，同名 IF NOT EXISTS 不会重复建）
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_ratings_pid_image ON ratings (participant_id, image_id);")
+
+
+def sync_slots(cur):
+    """按 assignment_plan 重建 n_total，按已有评分重算 n_rated（导入新 plan 后调用）；holder 保留"""
+    cur.execute("""
+    INSERT INTO slots (slot, n_total)
+    SELECT slot, COUNT(*) FROM assignment_plan GROUP BY slot
+    ON CONFLICT (slot) DO UPDATE SET n_total = EXCLUDED.n_total, n_rated = 0;
+    """)
+    cur.execute("DELETE FROM slots WHERE slot NOT IN (SELECT DISTINCT slot FROM assignment_plan);")
+    cur.execute("""
+    UPDATE slots s
+    SET n_rated = x.n
+    FROM (
+        SELECT ap.slot, COUNT(DISTINCT ap.image_id) AS n
+        FROM assignment_plan ap
+        JOIN participants p ON p.slot = ap.slot
+        JOIN ratings r ON r.participant_id = p.participant_id AND r.image_id = ap.image_id
+        GROUP BY ap.slot
+    ) x
+    WHERE s.slot = x.slot;
+    """)
+
+
+# 参数：(participant_id, lease_min)；没有可用 slot 返回空
+# SKIP LOCKED：别的注册正在拿的行直接跳过，不排队
+# 外层 WHERE 重复一遍空闲条件：万一拿到的行已经被抢（子查询快照较旧），PG 按最新行重新判断，返回 0 行
+LEASE_SLOT_SQL = """
+UPDATE slots
+SET holder = %s,
+    leased_at = now(),
+    lease_until = now() + make_interval(mins => %s)
+WHERE slot = (
+    SELECT slot
+    FROM slots
+    WHERE n_rated < n_total
+      AND (holder IS NULL OR lease_until < now())
+    ORDER BY n_rated, slot
+    LIMIT 1
+    FOR UPDATE SKIP LOCKED
+)
+  AND (holder IS NULL OR lease_until < now())
+RETURNING slot;
+"""
+
+# 参数：(slot,)；这个 slot 的 plan 图里还没有任何持有者评过的
+UNRATED_PLAN_IMAGES_SQL = """
+SELECT ap.image_id
+FROM assignment_plan ap
+WHERE ap.slot = %s
+  AND NOT EXISTS (
+      SELECT 1
+      FROM participants p
+      JOIN ratings r ON r.participant_id = p.participant_id
+      WHERE p.slot = ap.slot AND r.image_id = ap.image_id
+  )
+ORDER BY ap.ord ASC;
+"""
+
+# 参数：(participant_id, image_id, image_name, score, label, time, text_clarity,
+#        participant_id, lease_min, slot)
+# 评分和续租在同一条语句里：不多一次 round-trip，也不会只写了一半
+# (participant_id, image_id) 已经有评分就不插入、也不 +1（评分日志回放时会重复提交）：
+#   唯一索引 + ON CONFLICT DO NOTHING，并发提交同一条也只有一条进 ins，n_rated 只 +1
+# 评分人不是这个 slot 的当前持有者（租约已被接手）：评分照写，但不 +1、不续租
+INSERT_RATING_AND_RENEW_SQL = """
+WITH v (participant_id, image_id, image_name, score, label, time, text_clarity) AS (
+    VALUES (%s::text, %s::text, %s::text, %s::int, %s::text, %s::timestamp, %s::text)
+),
+ins AS (
+    INSERT INTO ratings (participant_id, image_id, image_name, score, label, time, text_clarity)
+    SELECT * FROM v
+    ON CONFLICT (participant_id, image_id) DO NOTHING
+    RETURNING 1
+)
+UPDATE slots
+SET n_rated = n_rated + 1,
+    lease_until = now() + make_interval(mins => h.lease_min)
+FROM (VALUES (%s::text, %s::int, %s::int)) AS h (holder, lease_min, slot)
+WHERE slots.slot = h.slot AND slots.holder = h.holder AND EXISTS (SELECT 1 FROM ins);
+"""
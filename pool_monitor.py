@@ -0,0 +1,181 @@
+# pool_monitor.py
+# -*- coding: utf-8 -*-
+"""
+app_pg 连接池的统计 / 启动预热 / 自动调 max_size
+
+原来池是固定 min_size=2、max_size=PG_POOL_MAX_SIZE，等了多久、超时几次都看不到，只能猜
+- PoolMetrics：每个进程一份，记 checkout 次数、等待时间直方图、池超时、降级直连次数、当前 / 峰值占用
+  （psycopg_pool 的 get_stats() 只有累计毫秒，看不出分布）
+- warmup(pool)：启动时借一条连接跑 SELECT 1，再 check 一遍空闲连接；失败不挡启动（之后交给熔断器）
+  不用 pool.wait()：它超时的时候会把池 close 掉，缓存下来的池之后每次都是 PoolClosed
+- PoolAutosizer（可选）：后台线程每 interval_sec 看一次
+  有人排队 / 超时 / 等待超过 slow_wait_ms → 服务端 max_connections 还有余量（> reserve）就 max_size +1
+  连续 idle_ticks 次没压力且有空闲连接 → max_size −1（不低于 floor）
+  每次只动 1，避免几个进程同时扩把库撑满
+"""
+
+import threading
+import time
+from bisect import bisect_left
+
+from psycopg_pool import PoolTimeout
+
+# 等待时间直方图的桶上界（ms），最后一个桶是 > 5000
+WAIT_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+class PoolMetrics:
+    def __init__(self, slow_wait_ms: float = 100):
+        self.slow_wait_ms = float(slow_wait_ms)
+        self._lock = threading.Lock()
+        self._hist = [0] * (len(WAIT_BUCKETS_MS) + 1)
+        self._c = {"checkouts": 0, "slow_waits": 0, "timeouts": 0, "fallbacks": 0, "active": 0, "peak_active": 0}
+        self._wait_total_ms = 0.0
+
+    def checkout(self, wait_sec: float):
+        ms = wait_sec * 1000
+        with self._lock:
+            self._hist[bisect_left(WAIT_BUCKETS_MS, ms)] += 1
+            self._wait_total_ms += ms
+            c = self._c
+            c["checkouts"] += 1
+            if ms >= self.slow_wait_ms:
+                c["slow_waits"] += 1
+            c["active"] += 1
+            c["peak_active"] = max(c["peak_active"], c["active"])
+
+    def checkin(self):
+        with self._lock:
+            self._c["active"] -= 1
+
+    def timeout(self):
+        with self._lock:
+            self._c["timeouts"] += 1
+
+    def fallback(self):
+        with self._lock:
+            self._c["fallbacks"] += 1
+
+    def counters(self) -> dict:
+        with self._lock:
+            return dict(self._c)
+
+    def _quantile_ms(self, hist, q: float) -> float:
+        """按桶估分位数（取所在桶的上界；落在最后一个桶就报最大上界）"""
+        n = sum(hist)
+        if not n:
+            return 0.0
+        seen = 0
+        for i, cnt in enumerate(hist):
+            seen += cnt
+            if seen >= q * n:
+                return float(WAIT_BUCKETS_MS[min(i, len(WAIT_BUCKETS_MS) - 1)])
+        return float(WAIT_BUCKETS_MS[-1])
+
+    def stats(self) -> dict:
+        with self._lock:
+            hist = list(self._hist)
+            c = dict(self._c)
+            total_ms = self._wait_total_ms
+        labels = [f"≤{b}ms" for b in WAIT_BUCKETS_MS] + [f">{WAIT_BUCKETS_MS[-1]}ms"]
+        return {
+            **c,
+            "wait_avg_ms": total_ms / c["checkouts"] if c["checkouts"] else 0.0,
+            "wait_p95_ms": self._quantile_ms(hist, 0.95),
+            "wait_hist": dict(zip(labels, hist)),
+        }
+
+
+def warmup(pool, timeout_sec: float) -> dict:
+    """借一条连接探一下，再 check 掉坏的空闲连接；返回结果给 admin 页，不抛异常，池始终保持打开"""
+    t0 = time.perf_counter()
+    try:
+        with pool.connection(timeout=timeout_sec) as conn:
+            conn.execute("SELECT 1")
+        pool.check()
+        ok, error = True, None
+    except PoolTimeout as e:
+        ok, error = False, f"PoolTimeout: {e}"
+    except Exception as e:
+        ok, error = False, f"{type(e).__name__}: {e}"
+    return {"ok": ok, "ms": (time.perf_counter() - t0) * 1000, "error": error}
+
+
+class PoolAutosizer:
+    def __init__(self, pool, metrics: PoolMetrics, headroom, floor: int, ceiling: int,
+                 reserve: int = 10, interval_sec: float = 30, idle_ticks: int = 4):
+        """headroom()：服务端还能再开几条连接（查不到就抛异常，这一轮不扩）"""
+        self.pool = pool
+        self.metrics = metrics
+        self.headroom = headroom
+        self.floor = max(int(floor), pool.min_size)
+        self.ceiling = max(int(ceiling), self.floor)
+        self.reserve = int(reserve)
+        self.interval_sec = float(interval_sec)
+        self.idle_ticks = int(idle_ticks)
+
+        self._lock = threading.Lock()
+        self._last = metrics.counters()
+        self._idle = 0
+        self._stats = {"ticks": 0, "grown": 0, "shrunk": 0, "last_headroom": None, "last_decision": "—"}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="pg-pool-autosizer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval_sec):
+            try:
+                self.tick()
+            except Exception as e:
+                with self._lock:
+                    self._stats["last_decision"] = f"error: {type(e).__name__}: {e}"
+
+    def tick(self) -> str:
+        now = self.metrics.counters()
+        last, self._last = self._last, now
+        p = self.pool.get_stats()
+        waiting = p.get("requests_waiting", 0)
+        slow = now["slow_waits"] - last["slow_waits"]
+        timeouts = now["timeouts"] - last["timeouts"]
+        size = self.pool.max_size
+
+        if waiting or slow or timeouts:
+            self._idle = 0
+            if size >= self.ceiling:
+                decision = f"pressure, at ceiling {self.ceiling}"
+            else:
+                room = int(self.headroom())
+                with self._lock:
+                    self._stats["last_headroom"] = room
+                if room > self.reserve:
+                    self.pool.resize(self.pool.min_size, size + 1)
+                    with self._lock:
+                        self._stats["grown"] += 1
+                    decision = f"grow {size} → {size + 1} (waiting={waiting} slow={slow} timeouts={timeouts})"
+                else:
+                    decision = f"pressure, server headroom {room} ≤ reserve {self.reserve}"
+        elif p.get("pool_available", 0) >= 2 and size > self.floor:
+            self._idle += 1
+            if self._idle >= self.idle_ticks:
+                self._idle = 0
+                self.pool.resize(self.pool.min_size, size - 1)
+                with self._lock:
+                    self._stats["shrunk"] += 1
+                decision = f"shrink {size} → {size - 1}"
+            else:
+                decision = f"idle {self._idle}/{self.idle_ticks}"
+        else:
+            self._idle = 0
+            decision = "steady"
+
+        with self._lock:
+            self._stats["ticks"] += 1
+            self._stats["last_decision"] = decision
+        return decision
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "max_size": self.pool.max_size, "floor": self.floor, "ceiling": self.ceiling}
+
+    def close(self):
+        self._stop.set()
@@ -0,0 +1,212 @@
+# rating_journal.py
+# -*- coding: utf-8 -*-
+"""
+评分的本地预写日志（RATING_JOURNAL）
+
+数据库写不进去时（SQLite 锁死、Supabase 挂了、进程被杀）评分不能丢：
+- 每条评分先 append 一行 JSON 到本地文件（{"t": 时间戳, "id": ..., "schema": ..., "row": [...]}），再交给数据库写入
+  多个进程共用一个文件，O_APPEND 单次 write 一整行，不会交错
+- schema 标明 row 的列顺序（app5 和 app_pg 不一样）；回放只认自己的 schema，别的行跳过不写
+- 写库成功后调用方 ack(ids)，追加一行 {"ack": [...]}；回放跳过已 ack 的行，checkpoint 照样推进，
+  正常情况下不会把 writer 已经写进去的评分再发一遍
+- fsync 按 fsync_ms 攒批：热路径只付一次本地 write，后台线程定期 fsync
+- 回放（replay）：从 checkpoint 读到文件尾，没 ack 的行整批用“(participant_id, image_id) 已存在就跳过”的语句写入，
+  然后把 checkpoint 推进；所以重复回放、和正常写入重叠都不会多出评分
+- 没 ack 的行只回放 min_age_sec 之前的：刚写的那些大概率正在被本进程的 writer 写，不去抢
+- 回放在启动时做一次，之后每 interval 秒一次；多进程用文件锁保证同一时间只有一个在回放
+文件只追加不截断（300 人 × 500 条约 30MB），实验结束后可以连同 .checkpoint 一起删掉
+"""
+
+import json
+import os
+import threading
+import time
+from uuid import uuid4
+
+try:
+    import fcntl
+except ImportError:   # Windows：没有 flock，回放不加跨进程锁（去重语句保证结果仍然正确）
+    fcntl = None
+
+
+class RatingJournal:
+    def __init__(self, path: str, schema: str, fsync_ms: float = 50):
+        self.path = path
+        self.schema = schema
+        self.checkpoint_path = path + ".checkpoint"
+        self.fsync_sec = float(fsync_ms) / 1000
+        # 行 id = 本实例随机前缀 + 序号：多进程、重启后都不会撞
+        self._id_prefix = uuid4().hex[:8] + "-"
+        self._seq = 0
+
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._stopping = False
+        self._stats = {"appended": 0, "acks": 0, "fsyncs": 0, "replayed": 0, "skipped_acked": 0,
+                       "foreign": 0, "replay_runs": 0, "replay_errors": 0}
+        self.last_error = None
+
+        self._fsync_thread = threading.Thread(target=self._fsync_loop, name="rating-journal-fsync", daemon=True)
+        self._fsync_thread.start()
+
+    # ---------- append ----------
+    def append(self, row) -> str:
+        """row 必须能 JSON 序列化（时间用字符串）；返回行 id，写库成功后交给 ack"""
+        with self._lock:
+            self._seq += 1
+            rid = f"{self._id_prefix}{self._seq}"
+            line = json.dumps({"t": time.time(), "id": rid, "schema": self.schema, "row": list(row)},
+                              ensure_ascii=False) + "\n"
+            os.write(self._fd, line.encode("utf-8"))
+            self._dirty = True
+            self._stats["appended"] += 1
+        return rid
+
+    def ack(self, ids):
+        """这些行已经写进库（或进了 dead-letter），回放时跳过；不单独 fsync，丢了最多多回放一次"""
+        ids = [i for i in ids if i]
+        if not ids:
+            return
+        line = json.dumps({"t": time.time(), "ack": ids}) + "\n"
+        with self._lock:
+            os.write(self._fd, line.encode("utf-8"))
+            self._dirty = True
+            self._stats["acks"] += len(ids)
+
+    def _fsync_loop(self):
+        while not self._stopping:
+            time.sleep(self.fsync_sec)
+            self.sync()
+
+    def sync(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+        os.fsync(self._fd)
+        with self._lock:
+            self._stats["fsyncs"] += 1
+
+    def close(self):
+        self._stopping = True
+        self.sync()
+        os.close(self._fd)
+
+    # ---------- replay ----------
+    def _read_checkpoint(self) -> int:
+        try:
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _write_checkpoint(self, offset: int):
+        tmp = self.checkpoint_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.checkpoint_path)
+
+    def _pending_rows(self, start: int, min_age_sec: float):
+        """
+        从 start 读到文件尾，返回 ([(row, 这行之后的 offset)], 可以推进到的 offset, 计数)
+        ack 行要看到文件尾（ack 一般在评分行之后几毫秒）；评分行遇到“没 ack 且太新”的就不再往后推进
+        """
+        cutoff = time.time() - min_age_sec
+        lines = []
+        acked = set()
+        offset = start
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            for raw in f:
+                if not raw.endswith(b"\n"):   # 半行：正在写
+                    break
+                offset += len(raw)
+                try:
+                    rec = json.loads(raw)
+                except ValueError:   # 坏行（比如磁盘满时写了一半）跳过
+                    rec = None
+                if rec is not None and "ack" in rec:
+                    acked.update(rec["ack"])
+                lines.append((rec, offset))
+
+        rows, end = [], start
+        counts = {"skipped_acked": 0, "foreign": 0}
+        for rec, after in lines:
+            if rec is not None and "row" in rec:
+                if rec.get("schema") != self.schema:
+                    counts["foreign"] += 1
+                elif rec.get("id") in acked:
+                    counts["skipped_acked"] += 1
+                elif rec["t"] > cutoff:
+                    break
+                else:
+                    rows.append((rec["row"], after))
+            end = after
+        return rows, end, counts
+
+    def replay(self, insert_many, min_age_sec: float = 30, batch_size: int = 500) -> int:
+        """
+        insert_many(rows)：一个事务里按去重语句写一批；抛异常时 checkpoint 停在上一批之后，下次重来
+        返回本次回放（尝试写入）的行数；别的进程正在回放时返回 0
+        """
+        lock_f = open(self.checkpoint_path + ".lock", "a")
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return 0
+            offset = self._read_checkpoint()
+            rows, end, counts = self._pending_rows(offset, min_age_sec)
+            with self._lock:
+                for k, v in counts.items():
+                    self._stats[k] += v
+            total = 0
+            for i in range(0, len(rows), batch_size):
+                chunk = rows[i:i + batch_size]
+                insert_many([row for row, _after in chunk])
+                total += len(chunk)
+                with self._lock:
+                    self._stats["replayed"] += len(chunk)
+                # 最后一批之后直接推进到 end（中间跳过的 ack / 别的 schema 的行一起越过）
+                self._write_checkpoint(end if i + batch_size >= len(rows) else chunk[-1][1])
+            if not rows and end != offset:
+                self._write_checkpoint(end)
+            with self._lock:
+                self._stats["replay_runs"] += 1
+            return total
+        finally:
+            lock_f.close()   # 关文件同时释放 flock
+
+    def start_replayer(self, insert_many, interval_sec: float = 30, min_age_sec: float = 30):
+        """后台线程：马上回放一次（接上次进程没写完的），之后每 interval_sec 一次"""
+        def loop():
+            while not self._stopping:
+                try:
+                    self.replay(insert_many, min_age_sec)
+                    self.last_error = None
+                except Exception as e:   # 数据库不可用时下一轮再试
+                    with self._lock:
+                        self._stats["replay_errors"] += 1
+                    self.last_error = repr(e)
+                time.sleep(interval_sec)
+
+        t = threading.Thread(target=loop, name="rating-journal-replay", daemon=True)
+        t.start()
+        return t
+
+    def stats(self) -> dict:
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            size = 0
+        with self._lock:
+            return {
+                **self._stats,
+                "bytes": size,
+                "backlog_bytes": max(size - self._read_checkpoint(), 0),
+                "last_error": self.last_error,
+            }
@@ -0,0 +1,225 @@
+# rating_writer.py
+# -*- coding: utf-8 -*-
+"""
+后台批量写评分（RATING_WRITER=async）
+
+原来点 Next 要同步等 INSERT + commit（SQLite 的 fsync / 写锁重试，PG 的池等待），才能 st.rerun()
+这里每个进程一个后台线程：
+- submit(record) 只是放进队列，立刻返回一个递增的 ticket
+- 后台线程攒够 batch_size 条或等满 flush_ms 毫秒就调用一次 flush(records)（一个事务写一批）
+- flush 抛 transient_errors（连不上 / 锁超时）：这批还没落定的行保留、退避后重试（按提交顺序，不丢也不乱序）；
+  二分时已经写成功或进了 dead_letter 的行记在 _settled 里，重试不再发，不会重复 dead-letter / ack
+- 其他异常说明数据本身有问题（约束 / 类型错误）：二分找出坏行，好的照写，坏的交给 dead_letter，
+  不让一条坏行挡住这个进程后面所有的评分；last_error 给页面 / admin 看
+- 写成功（或进了 dead_letter）后 acked 推进到这批最后一个 ticket：ticket <= acked 就是处理完了
+- 传了 journal 时，写完的行在评分日志里记 ack，回放就不会再发一遍
+- 进程退出时（atexit）把队列里剩下的尽量写完
+"""
+
+import atexit
+import json
+import queue
+import threading
+import time
+
+
+def write_splitting(flush, records, transient_errors, on_bad) -> int:
+    """
+    flush(records)；transient_errors 原样抛给调用方重试
+    其他异常：二分重写，最后剩下的单条坏行交给 on_bad(record, exc)；返回坏行数
+    二分到一半遇到 transient 错误时，已经写成功 / 交给 on_bad 的部分由调用方自己记下，重试时不要再发
+    """
+    try:
+        flush(records)
+        return 0
+    except transient_errors:
+        raise
+    except Exception as e:
+        if len(records) == 1:
+            on_bad(records[0], e)
+            return 1
+    mid = len(records) // 2
+    return (write_splitting(flush, records[:mid], transient_errors, on_bad)
+            + write_splitting(flush, records[mid:], transient_errors, on_bad))
+
+
+class DeadLetterFile:
+    """
+    写不进库的坏行：追加一行 JSON（时间、错误、原始行）到 path，并打一行日志；修好后可以手动补录
+    同一进程里同一行只记一次：日志回放二分到一半遇到 transient 错误时，下一轮会把同一批重新读出来再拆
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    def __call__(self, record, exc):
+        key = json.dumps(list(record), ensure_ascii=False, default=str)
+        line = json.dumps({"t": time.time(), "error": repr(exc), "record": list(record)},
+                          ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            if key in self._seen:
+                return
+            self._seen.add(key)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+            self.count += 1
+        print(f"⚠️ rating moved to dead-letter file {self.path}: {exc!r}", flush=True)
+
+
+class RatingWriter:
+    def __init__(self, flush, batch_size: int = 50, flush_ms: float = 20,
+                 max_backoff_sec: float = 5.0, name: str = "rating-writer",
+                 transient_errors=(Exception,), dead_letter=None, journal=None):
+        """
+        dead_letter(record, exc)：坏行去处；不传时任何错误都当 transient 重试（坏行会一直挡着）
+        journal：RatingJournal，submit 时带上 journal_id，写完后在日志里 ack
+        """
+        self.flush = flush
+        self.transient_errors = transient_errors if dead_letter is not None else (Exception,)
+        self.dead_letter = dead_letter
+        self.journal = journal
+        self.batch_size = int(batch_size)
+        self.flush_sec = float(flush_ms) / 1000
+        self.max_backoff_sec = float(max_backoff_sec)
+
+        self._q = queue.Queue()
+        self._lock = threading.Lock()
+        self._acked_cond = threading.Condition(self._lock)
+        self._next_ticket = 1
+        self._acked = 0
+        self._settled = {}   # 当前这批里已经落定的 ticket -> None（写成功）/ dead-letter 的原因，只有写线程用
+        self._stopping = False
+        self._stats = {"submitted": 0, "written": 0, "batches": 0, "flush_errors": 0, "dead_lettered": 0}
+        self.last_error = None
+        self.last_flush_ms = 0.0
+
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # ---------- caller side ----------
+    def submit(self, record, journal_id=None) -> int:
+        with self._lock:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            self._stats["submitted"] += 1
+            # 入队放在锁里：保证队列顺序和 ticket 顺序一致
+            self._q.put((ticket, record, journal_id))
+        return ticket
+
+    def acked(self, ticket: int) -> bool:
+        with self._lock:
+            return ticket <= self._acked
+
+    def pending(self, tickets) -> list:
+        """tickets 里还没落库的"""
+        with self._lock:
+            return [t for t in tickets if t > self._acked]
+
+    def wait(self, ticket: int, timeout: float) -> bool:
+        """等到 ticket 落库或超时；返回是否已落库"""
+        deadline = time.time() + timeout
+        with self._acked_cond:
+            while ticket > self._acked:
+                left = deadline - time.time()
+                if left <= 0:
+                    return False
+                self._acked_cond.wait(left)
+            return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "queued": self._q.qsize(),
+                "acked": self._acked,
+                "last_flush_ms": self.last_flush_ms,
+                "last_error": self.last_error,
+            }
+
+    # ---------- writer thread ----------
+    def _take_batch(self):
+        """阻塞等第一条，然后在 flush_sec 内尽量攒满 batch_size"""
+        try:
+            first = self._q.get(timeout=0.5)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.time() + self.flush_sec
+        while len(batch) < self.batch_size:
+            left = deadline - time.time()
+            try:
+                batch.append(self._q.get(timeout=left) if left > 0 else self._q.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _ack_journal(self, items):
+        """日志 ack 失败只意味着回放时会再发一遍（去重语句兜底），不影响这批算写成功"""
+        ids = [jid for _t, _rec, jid in items if jid]
+        if self.journal is None or not ids:
+            return
+        try:
+            self.journal.ack(ids)
+        except OSError:
+            pass
+
+    def _flush_items(self, items):
+        self.flush([rec for _t, rec, _jid in items])
+        self._settled.update((t, None) for t, _rec, _jid in items)
+        with self._lock:
+            self._stats["written"] += len(items)
+        self._ack_journal(items)
+
+    def _dead_letter_item(self, item, exc):
+        self.dead_letter(item[1], exc)
+        self._settled[item[0]] = f"dead-lettered: {exc!r}"
+        self._ack_journal([item])
+        with self._lock:
+            self._stats["dead_lettered"] += 1
+            self.last_error = self._settled[item[0]]
+
+    def _write(self, batch) -> bool:
+        t0 = time.perf_counter()
+        todo = [it for it in batch if it[0] not in self._settled]
+        try:
+            if todo:
+                write_splitting(self._flush_items, todo, self.transient_errors, self._dead_letter_item)
+        except Exception as e:   # transient：没落定的留着重试，不让线程退出
+            with self._lock:
+                self._stats["flush_errors"] += 1
+                self.last_error = repr(e)
+            return False
+        dead = [why for why in self._settled.values() if why]
+        self._settled.clear()
+        with self._acked_cond:
+            # 落定的行可能在上一次尝试里，ack 到整批最后一个 ticket
+            self._acked = batch[-1][0]
+            self._stats["batches"] += 1
+            self.last_flush_ms = (time.perf_counter() - t0) * 1000
+            self.last_error = dead[-1] if dead else None
+            self._acked_cond.notify_all()
+        return True
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                if self._stopping:
+                    return
+                continue
+            backoff = 0.1
+            while not self._write(batch):
+                if self._stopping:
+                    return
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff_sec)
+
+    def close(self, timeout: float = 5.0):
+        with self._lock:
+            last = self._next_ticket - 1
+        self.wait(last, timeout)
+        self._stopping = True
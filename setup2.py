@@ -6,6 +6,8 @@ import io
 import streamlit.components.v1 as components
 from openpyxl import Workbook, load_workbook
 
+from image_cache import ImageCache, IMAGE_CACHE_MAX_MB
+
 st.set_page_config(layout="wide")
 
 # =======================
@@ -26,8 +28,12 @@ def list_images(img_dir: str):
         if f.lower().endswith(VALID_EXTS) and not f.startswith(".")
     )
 
-@st.cache_data(show_spinner=False)
-def load_image_bytes(img_path: str, max_side: int = 1800) -> bytes:
+@st.cache_resource
+def get_image_cache():
+    # 有字节上限 + LRU，替代无上限的 st.cache_data
+    return ImageCache(max_bytes=IMAGE_CACHE_MAX_MB * 1024 * 1024)
+
+def _encode_jpeg(img_path: str, max_side: int) -> bytes:
     with Image.open(img_path) as im:
         im = im.convert("RGB")
         im.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
@@ -35,6 +41,10 @@ def load_image_bytes(img_path: str, max_side: int = 1800) -> bytes:
         im.save(buf, format="JPEG", quality=90, optimize=True)
         return buf.getvalue()
 
+def load_image_bytes(img_path: str, max_side: int = 1800) -> bytes:
+    key = ("jpeg", img_path, max_side)
+    return get_image_cache().get_or_compute(key, lambda: _encode_jpeg(img_path, max_side))
+
 def append_to_excel_fast(path: str, row: dict):
     headers = ["image", "score", "label", "time"]
     values = [row.get(h, "") for h in headers]
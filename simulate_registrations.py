@@ -0,0 +1,327 @@
+import os
+import time
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from uuid import uuid4
+
+import numpy as np
+
+import sqlite_assign
+import migrations
+from strata_index import StrataIndex
+from adaptive_assign import AdaptiveAllocator
+from import_plan_to_pg import read_manifest
+from make_assignment_plan_from_manifest import P, R_TARGET, COVER_M
+
+# 无界面压测注册路径：P 个人在很短时间内一起注册
+#   sqlite : 临时 DB 文件，多进程 × 多线程调用 sqlite_assign（每个进程一份 StrataIndex，和多个 Streamlit 进程一样）
+#   pg     : 独立 schema 里放 plan，多线程走 pg_slots 的 slot 分配 + unnest 插入 assignments（和 app_pg 一样）
+# 报告：吞吐、p50/p95/p99、写锁重试次数、最终每张图被分配次数的分布
+#
+#   python simulate_registrations.py sqlite --participants 300 --procs 4 --threads 8
+#   python simulate_registrations.py pg --dsn postgresql://localhost/iqa_test --participants 300 --threads 32
+#
+# 参考（本机 PG 16，300 人 / 100 并发，含进度触发器）：三种 slot 模式都是 ~100 次/s，p99 ≈ 1.0–1.1s，
+# 池从 4 加到 10 基本不变——瓶颈是每人 500 行 assignments 的插入，不是 slot 分配
+
+K_PER_PERSON = 500
+
+SQLITE_TIMEOUT_SEC = 30
+SQLITE_BUSY_TIMEOUT_MS = 8000
+
+
+# =========================
+# SQLite
+# =========================
+def sqlite_connect(path):
+    # 和 app5 的 get_conn 一样的参数
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=SQLITE_TIMEOUT_SEC)
+    conn.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
+
+def sqlite_setup(path, images):
+    # 和 app5 启动时一样：migrations 建表 + 索引，再导入 manifest
+    conn = sqlite_connect(path)
+    migrations.migrate_sqlite(conn)
+    conn.executemany(
+        "INSERT INTO images (image_id, rel_path, category, category_name, resolution, distortion, distortion_name) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [r[:7] for r in images]
+    )
+    conn.commit()
+    conn.close()
+
+
+def _sqlite_worker(path, pids, threads, mode, k, cover_m, r_target, chunk, retries):
+    """一个进程：threads 个线程并发注册 pids；返回 (latencies, lock_stats, errors)"""
+    index = StrataIndex(r_target)
+    alloc = AdaptiveAllocator(10, r_target, 0.3)
+    lat = []
+    errors = []
+    lat_lock = threading.Lock()
+
+    def register(pid):
+        t0 = time.perf_counter()
+        conn = sqlite_connect(path)
+        try:
+            conn.execute(
+                "INSERT INTO participants VALUES (?, ?, 'sim', 'sim', datetime('now'))",
+                (pid, pid[:8])
+            )
+            conn.commit()
+            if mode == "adaptive":
+                sqlite_assign.assign_images_adaptive(conn, pid, alloc, k, cover_m, retries=retries, chunk=chunk)
+            else:
+                sqlite_assign.assign_images_for_participant(conn, pid, index, k, cover_m, retries=retries, chunk=chunk)
+        except sqlite3.OperationalError as e:
+            with lat_lock:
+                errors.append(repr(e))
+        finally:
+            conn.close()
+        with lat_lock:
+            lat.append(time.perf_counter() - t0)
+
+    with ThreadPoolExecutor(max_workers=threads) as ex:
+        list(ex.map(register, pids))
+    return lat, sqlite_assign.lock_stats(), errors
+
+
+def run_sqlite(args, images):
+    tmp = tempfile.mkdtemp(prefix="iqa_sim_")
+    path = os.path.join(tmp, "sim.db")
+    try:
+        sqlite_setup(path, images)
+        pids = [str(uuid4()) for _ in range(args.participants)]
+        groups = [pids[i::args.procs] for i in range(args.procs)]
+
+        t0 = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=args.procs) as ex:
+            futs = [
+                ex.submit(_sqlite_worker, path, g, args.threads, args.mode, args.k, args.cover_m,
+                          args.r, args.chunk, args.retries)
+                for g in groups
+            ]
+            results = [f.result() for f in futs]
+        wall = time.perf_counter() - t0
+
+        lat = [x for r in results for x in r[0]]
+        retries = sum(r[1]["retries"] for r in results)
+        gave_up = sum(r[1]["gave_up"] for r in results)
+        errors = [e for r in results for e in r[2]]
+
+        conn = sqlite_connect(path)
+        counts = [r[0] for r in conn.execute("SELECT assigned_count FROM images")]
+        per_person = [r[0] for r in conn.execute(
+            "SELECT COUNT(*) FROM assignments GROUP BY participant_id"
+        )]
+        cover = conn.execute("""
+            SELECT MIN(n) FROM (
+                SELECT a.participant_id, i.category, i.resolution, i.distortion, COUNT(*) AS n
+                FROM assignments a JOIN images i USING (image_id)
+                GROUP BY 1, 2, 3, 4
+            )
+        """).fetchone()[0]
+        conn.close()
+
+        report(
+            f"sqlite · {args.mode} · procs={args.procs} threads={args.threads} chunk={args.chunk or 'all'}",
+            wall, lat, errors, counts, per_person,
+            extra=f"lock retries={retries} gave_up={gave_up} · min per-person strata count={cover}",
+        )
+    finally:
+        if args.keep:
+            print(f"   DB kept at {path}")
+        else:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+# =========================
+# Postgres
+# =========================
+def run_pg(args, images):
+    import psycopg
+    from psycopg_pool import ConnectionPool
+
+    import participant_progress
+    import pg_slots
+    from make_assignment_plan_from_manifest import build_plan
+
+    schema = args.schema
+    image_ids = [r[0] for r in images]
+    strata_names = sorted({(r[2], r[4], r[5]) for r in images})
+    code_of = {s: i for i, s in enumerate(strata_names)}
+    strata = np.array([code_of[(r[2], r[4], r[5])] for r in images], dtype=np.int32)
+    plan = build_plan(strata, args.p, args.r, args.k)
+
+    with psycopg.connect(args.dsn) as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+            cur.execute(f"CREATE SCHEMA {schema}")
+            cur.execute(f"SET search_path TO {schema}")
+            cur.execute("""
+            CREATE TABLE participants (
+                participant_id TEXT PRIMARY KEY, student_id TEXT, device TEXT,
+                screen_resolution TEXT, start_time TIMESTAMP, slot INTEGER
+            )
+            """)
+            cur.execute("""
+            CREATE TABLE assignments (
+                participant_id TEXT NOT NULL, image_id TEXT NOT NULL, ord INTEGER NOT NULL,
+                assigned_time TIMESTAMP NOT NULL, PRIMARY KEY (participant_id, image_id)
+            )
+            """)
+            cur.execute("CREATE TABLE ratings (participant_id TEXT, image_id TEXT, score INTEGER, time TIMESTAMP)")
+            # app_pg 的 assignments 上挂着进度计数触发器，注册的 500 行插入要算上它
+            for sql in participant_progress.PG_SCHEMA:
+                cur.execute(sql)
+            cur.execute("CREATE TABLE assignment_plan (slot INTEGER NOT NULL, ord INTEGER NOT NULL, image_id TEXT NOT NULL, PRIMARY KEY (slot, ord))")
+            with cur.copy("COPY assignment_plan (slot, ord, image_id) FROM STDIN") as cp:
+                for s, row in enumerate(plan, 1):
+                    for o, i in enumerate(row):
+                        cp.write_row((s, o, image_ids[i]))
+            cur.execute("CREATE TABLE slot_counter (id INTEGER PRIMARY KEY DEFAULT 1, next_slot INTEGER NOT NULL)")
+            cur.execute("INSERT INTO slot_counter VALUES (1, 1)")
+            pg_slots.init_slot_seq(cur)
+            pg_slots.init_slots(cur)
+            pg_slots.sync_slots(cur)
+        conn.commit()
+
+    pool = ConnectionPool(
+        conninfo=args.dsn, min_size=args.pool, max_size=args.pool, timeout=120,
+        kwargs={"options": f"-c search_path={schema}"},
+    )
+    pool.wait()
+    lat, errors, lease_misses = [], [], Counter()
+    lat_lock = threading.Lock()
+
+    def register(pid):
+        t0 = time.perf_counter()
+        try:
+            with pool.connection() as conn:
+                with conn.cursor() as cur:
+                    slot = None
+                    if args.slot_mode == "lease":
+                        for _ in range(3):
+                            cur.execute(pg_slots.LEASE_SLOT_SQL, (pid, pg_slots.SLOT_LEASE_MIN), prepare=False)
+                            row = cur.fetchone()
+                            if row:
+                                slot = row[0]
+                                break
+                            with lat_lock:
+                                lease_misses["retry"] += 1
+                    if slot is None:
+                        sql = pg_slots.COUNTER_SLOT_SQL if args.slot_mode == "counter" else pg_slots.SEQUENCE_SLOT_SQL
+                        cur.execute(sql, (args.p,), prepare=False)
+                        slot = cur.fetchone()[0]
+                    cur.execute(
+                        "INSERT INTO participants VALUES (%s, %s, 'sim', 'sim', now(), %s)",
+                        (pid, pid[:8], slot), prepare=False,
+                    )
+                    cur.execute("SELECT image_id FROM assignment_plan WHERE slot=%s ORDER BY ord", (slot,), prepare=False)
+                    ids = [r[0] for r in cur.fetchall()]
+                    cur.execute(
+                        """
+                        INSERT INTO assignments (participant_id, image_id, ord, assigned_time)
+                        SELECT %s, x.image_id, x.ord, now()
+                        FROM unnest(%s::text[], %s::int[]) AS x(image_id, ord)
+                        ON CONFLICT DO NOTHING
+                        """,
+                        (pid, ids, list(range(len(ids)))), prepare=False,
+                    )
+        except psycopg.Error as e:
+            with lat_lock:
+                errors.append(repr(e))
+        with lat_lock:
+            lat.append(time.perf_counter() - t0)
+
+    pids = [str(uuid4()) for _ in range(args.participants)]
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as ex:
+        list(ex.map(register, pids))
+    wall = time.perf_counter() - t0
+    pool.close()
+
+    with psycopg.connect(args.dsn) as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"SET search_path TO {schema}")
+            cur.execute("""
+                SELECT COALESCE(c.n, 0)
+                FROM (SELECT DISTINCT image_id FROM assignment_plan) i
+                LEFT JOIN (SELECT image_id, COUNT(*) AS n FROM assignments GROUP BY image_id) c USING (image_id)
+            """)
+            counts = [r[0] for r in cur.fetchall()]
+            cur.execute("SELECT COUNT(*) FROM assignments GROUP BY participant_id")
+            per_person = [r[0] for r in cur.fetchall()]
+            if not args.keep:
+                cur.execute(f"DROP SCHEMA {schema} CASCADE")
+        conn.commit()
+
+    report(
+        f"pg · slot={args.slot_mode} · threads={args.threads} pool={args.pool}",
+        wall, lat, errors, counts, per_person,
+        extra=f"lease re-tries={lease_misses['retry']}",
+    )
+
+
+# =========================
+# Report
+# =========================
+def report(title, wall, lat, errors, counts, per_person, extra=""):
+    ms = np.array(lat) * 1000
+    counts = np.array(counts)
+    print(f"== {title}")
+    print(f"   {len(lat)} registrations in {wall:.2f}s → {len(lat) / wall:.1f}/s")
+    print(f"   latency ms: p50={np.percentile(ms, 50):.1f}  p95={np.percentile(ms, 95):.1f}  "
+          f"p99={np.percentile(ms, 99):.1f}  max={ms.max():.1f}")
+    if extra:
+        print(f"   {extra}")
+    if errors:
+        print(f"   ⚠️ {len(errors)} errors, e.g. {errors[0]}")
+    pp = np.array(per_person) if per_person else np.array([0])
+    print(f"   per person: min={pp.min()} max={pp.max()}")
+    print(f"   per image assigned: min={counts.min()} mean={counts.mean():.2f} max={counts.max()} std={counts.std():.2f}")
+    hist = Counter(counts.tolist())
+    print("   histogram: " + "  ".join(f"{v}:{hist[v]}" for v in sorted(hist)))
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("backend", choices=["sqlite", "pg"])
+    ap.add_argument("--manifest", default="manifest_6000.csv")
+    ap.add_argument("--participants", type=int, default=P)
+    ap.add_argument("--threads", type=int, default=8, help="每个进程的并发线程数（pg：总并发）")
+    ap.add_argument("--k", type=int, default=K_PER_PERSON)
+    ap.add_argument("--r", type=int, default=R_TARGET)
+    ap.add_argument("--cover-m", type=int, default=COVER_M)
+    ap.add_argument("--keep", action="store_true", help="保留临时 DB / schema 方便事后查看")
+    # sqlite
+    ap.add_argument("--procs", type=int, default=4)
+    ap.add_argument("--mode", choices=["strata", "adaptive"], default="strata")
+    ap.add_argument("--chunk", type=int, default=0, help="只发第一块（0 = 一次发完 K 张）")
+    ap.add_argument("--retries", type=int, default=6)
+    # pg
+    ap.add_argument("--dsn", default="", help="本地 / 测试 Postgres；会建删 --schema")
+    ap.add_argument("--schema", default="sim_registrations")
+    ap.add_argument("--pool", type=int, default=4)
+    ap.add_argument("--p", type=int, default=P, help="plan 的 slot 数")
+    ap.add_argument("--slot-mode", choices=["counter", "sequence", "lease"], default="counter", help="和 app_pg 的 PG_SLOT_MODE 默认一致")
+    args = ap.parse_args()
+
+    images = read_manifest(args.manifest, {})
+    if args.backend == "sqlite":
+        run_sqlite(args, images)
+    else:
+        if not args.dsn:
+            ap.error("pg 模式需要 --dsn")
+        if args.mode != "strata":
+            ap.error("pg 模式只模拟 plan 分配（--mode 只对 sqlite 有效）")
+        run_pg(args, images)
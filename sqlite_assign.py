@@ -0,0 +1,302 @@
+# sqlite_assign.py
+# -*- coding: utf-8 -*-
+"""
+SQLite 版 assign_images_for_participant（app4 / app5 / app5_fixed 共用）
+
+给参与者 pid 分配 K 张：
+- coverage：每个 (cat×res×dist) 取 COVER_M
+- fill：补齐到 K，优先 assigned_count 少
+选择走进程内的 StrataIndex（strata_index.py），写锁里只剩“读 generation + 写回”
+ASSIGN_MODE=adaptive 时改用 assign_images_adaptive（按 MOS 置信区间宽度选图）
+
+分块分配（chunk > 0）：注册时只发一块，快做完时再要下一块
+- 覆盖包按剩余名额比例摊到每一块，全部块发完时每个 strata 仍然够 COVER_M
+- 长时间没动静的参与者，没评的那部分 assignments 收回（assigned_count −1），图回到池子里
+"""
+
+import json
+import random
+import sqlite3
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+# 回收检查本身要扫 assignments，进程内限频
+RECLAIM_INTERVAL_SEC = 60
+_last_reclaim_at = 0.0
+
+# 进程内累计的写锁重试次数（admin 页 / simulate_registrations.py 用）
+_stats_lock = threading.Lock()
+_lock_stats = {"retries": 0, "gave_up": 0}
+
+
+def init_assign_tables(conn):
+    """
+    assign_meta.generation：每次分配提交都 +1
+    进程内的 StrataIndex 发现 generation 不一致（别的进程分配过）就重新 load
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS assign_meta (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        generation INTEGER NOT NULL
+    )
+    """)
+    conn.execute("INSERT OR IGNORE INTO assign_meta (id, generation) VALUES (1, 0)")
+    # 回收时按 (participant_id, image_id) 判断“评过没有”
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ratings_pid_image ON ratings (participant_id, image_id)")
+    conn.commit()
+
+
+def lock_stats() -> dict:
+    with _stats_lock:
+        return dict(_lock_stats)
+
+
+def _count(key: str):
+    with _stats_lock:
+        _lock_stats[key] += 1
+
+
+def _retry_locked(fn, retries: int):
+    """遇到 locked 就指数退避重试；返回 (结果, 重试次数)"""
+    for i in range(retries):
+        try:
+            return fn(), i
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e).lower() and i + 1 < retries:
+                _count("retries")
+                time.sleep(0.15 * (2 ** i))
+                continue
+            if "locked" in str(e).lower():
+                _count("gave_up")
+            raise
+    raise sqlite3.OperationalError("database is locked (exceeded retries)")
+
+
+def next_chunk_size(have: int, k: int, chunk: int) -> int:
+    """这次该发几张；chunk <= 0 表示一次发完"""
+    left = max(k - have, 0)
+    return left if chunk <= 0 else min(chunk, left)
+
+
+def chunk_cover_need(have: dict, keys, cover_m: int, remaining_k: int, n_new: int) -> dict:
+    """
+    have：strata -> 这个参与者已有张数
+    还差的覆盖张数按 n_new / remaining_k 的比例放进这一块（向上取整），最后一块全部补齐
+    预算一张一张地发给当前还差得最多的 strata（同样多的一轮各给一张）：
+    按 keys 顺序贪心的话，前面的 strata 在第一块就补满，后面的全挤到最后几块，掉队者的覆盖就偏了
+    """
+    left = {key: cover_m - have.get(key, 0) for key in keys if cover_m - have.get(key, 0) > 0}
+    total = sum(left.values())
+    if n_new >= remaining_k:
+        budget = total
+    else:
+        budget = min(total, -(-total * n_new // max(remaining_k, 1)))
+
+    out = {}
+    while budget > 0:
+        top = max(left.values())
+        for key in [key for key, n in left.items() if n == top][:budget]:
+            out[key] = out.get(key, 0) + 1
+            left[key] -= 1
+            budget -= 1
+    return out
+
+
+def _write_assignments(cur, pid: str, chosen, first_ord: int, now: str, retries: int):
+    """
+    assignments 插入 + assigned_count +1 各只用一条语句：id 列表作为一个 JSON 参数，json_each 展开
+    （原来是 2×K 次 executemany 的单行语句，全在写锁里）
+    """
+    ids = json.dumps(chosen)
+    _retry_locked(lambda: cur.execute(
+        "INSERT OR IGNORE INTO assignments (participant_id, image_id, ord, assigned_time) "
+        "SELECT ?, value, ? + key, ? FROM json_each(?)",
+        (pid, first_ord, now, ids)
+    ), retries)
+    _retry_locked(lambda: cur.execute(
+        "UPDATE images SET assigned_count = assigned_count + 1 "
+        "WHERE image_id IN (SELECT value FROM json_each(?))",
+        (ids,)
+    ), retries)
+
+
+def _participant_assigned(cur, pid: str):
+    """返回 (已有 image_id 列表, 最大 ord)"""
+    cur.execute("SELECT image_id, ord FROM assignments WHERE participant_id=?", (pid,))
+    rows = cur.fetchall()
+    return [r[0] for r in rows], max((int(r[1]) for r in rows), default=-1)
+
+
+def reclaim_due(stale_min: int) -> bool:
+    return stale_min > 0 and time.time() - _last_reclaim_at >= RECLAIM_INTERVAL_SEC
+
+
+def reclaim_committed():
+    """调用方的事务提交成功后再记时间；回滚了（比如写锁重试耗尽）下一次分配会重新回收"""
+    global _last_reclaim_at
+    _last_reclaim_at = time.time()
+
+
+def reclaim_stale_assignments(cur, stale_min: int) -> int:
+    """
+    在调用方的写事务里执行：最后一次活动（分配或评分）早于 stale_min 分钟、还没做完的参与者，
+    删掉他们没评的 assignments，并把对应图片的 assigned_count −1
+    返回收回的行数；时间都是 "%Y-%m-%d %H:%M:%S" 字符串，可以直接比较
+    限频由调用方做：reclaim_due() 为真才调，提交后调 reclaim_committed()
+    """
+    cutoff = (datetime.now() - timedelta(minutes=stale_min)).strftime("%Y-%m-%d %H:%M:%S")
+    # 最后活动时间 / 是否做完 读 participant_progress（触发器维护，见 participant_progress.py）
+    cur.execute(
+        """
+        WITH idle AS (
+            SELECT participant_id FROM participant_progress
+            WHERE last_activity < ? AND done < total
+        )
+        SELECT a.rowid, a.image_id
+        FROM assignments a
+        JOIN idle USING (participant_id)
+        WHERE NOT EXISTS (
+            SELECT 1 FROM ratings r
+            WHERE r.participant_id = a.participant_id AND r.image_id = a.image_id
+        )
+        """,
+        (cutoff,)
+    )
+    rows = cur.fetchall()
+    if not rows:
+        return 0
+    cur.execute(
+        "DELETE FROM assignments WHERE rowid IN (SELECT value FROM json_each(?))",
+        (json.dumps([r[0] for r in rows]),)
+    )
+    # 同一张图可能被几个掉队者同时占着：按“要减几”分组，每组一条 UPDATE
+    by_times = {}
+    for image_id, times in Counter(r[1] for r in rows).items():
+        by_times.setdefault(times, []).append(image_id)
+    for times, ids in by_times.items():
+        cur.execute(
+            "UPDATE images SET assigned_count = MAX(assigned_count - ?, 0) "
+            "WHERE image_id IN (SELECT value FROM json_each(?))",
+            (times, json.dumps(ids))
+        )
+    return len(rows)
+
+
+def assign_images_for_participant(conn, pid: str, index, k: int, cover_m: int, retries: int = 6,
+                                  chunk: int = 0, stale_min: int = 0):
+    """
+    返回本次分配的 image_id 列表；已经分配满（>= k）返回 None
+    chunk > 0 时只发一块（新图的 ord 接在已有的后面）；stale_min > 0 时顺便回收掉队者的图
+    调用方负责 conn 的生命周期，以及“分到的不足一块”时的提示
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*) FROM assignments WHERE participant_id=?", (pid,))
+    if int(cur.fetchone()[0]) >= k:
+        return None
+
+    # 先拿进程内锁，再拿 SQLite 写锁（别的进程只会拿后者，不会死锁）
+    with index.lock:
+        _retry_locked(lambda: cur.execute("BEGIN IMMEDIATE"), retries)
+        popped = []
+        due = reclaim_due(stale_min)
+        try:
+            reclaimed = reclaim_stale_assignments(cur, stale_min) if due else 0
+            if reclaimed:
+                index.generation = None   # assigned_count 变了，下面重新 load（能读到本事务的改动）
+
+            cur.execute("SELECT generation FROM assign_meta WHERE id=1")
+            generation = int(cur.fetchone()[0])
+            index.ensure_fresh(conn, generation)
+
+            mine, max_ord = _participant_assigned(cur, pid)
+            n_new = next_chunk_size(len(mine), k, chunk)
+            have = Counter(index.strata_of.get(x) for x in mine)
+            need = chunk_cover_need(have, index.keys, cover_m, k - len(mine), n_new)
+
+            popped = index.pick(n_new, cover_m, need=need, exclude=set(mine))
+            chosen = [image_id for _c, image_id in popped]
+
+            now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            random.shuffle(chosen)
+
+            _write_assignments(cur, pid, chosen, max_ord + 1, now, retries)
+
+            cur.execute("UPDATE assign_meta SET generation = generation + 1 WHERE id=1")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            index.restore(popped)
+            # 状态不确定时下次强制重新 load
+            index.generation = None
+            raise
+
+        if due:
+            reclaim_committed()
+        index.commit(popped)
+        index.generation = generation + 1
+        return chosen
+
+
+def _sync_adaptive_ratings(cur, alloc):
+    """首次加载图片目录；之后每次只读 rowid 之后新增的评分"""
+    if not alloc.loaded:
+        cur.execute("SELECT image_id, category, resolution, distortion FROM images")
+        alloc.load_catalog(cur.fetchall())
+    cur.execute(
+        "SELECT rowid, image_id, score FROM ratings "
+        "WHERE rowid > ? AND image_id IS NOT NULL AND score IS NOT NULL ORDER BY rowid",
+        (alloc.last_rowid,)
+    )
+    rows = cur.fetchall()
+    if rows:
+        alloc.add_scores((image_id, score) for _rowid, image_id, score in rows)
+        alloc.last_rowid = rows[-1][0]
+
+
+def assign_images_adaptive(conn, pid: str, alloc, k: int, cover_m: int, retries: int = 6,
+                           chunk: int = 0, stale_min: int = 0):
+    """
+    ASSIGN_MODE=adaptive：按 CI 半宽选图（adaptive_assign.py），写库 / 分块 / 回收方式和上面相同
+    assigned_count 照常 +1（pending = assigned_count − 已评次数），generation 照常 +1
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*) FROM assignments WHERE participant_id=?", (pid,))
+    if int(cur.fetchone()[0]) >= k:
+        return None
+
+    with alloc.lock:
+        # 评分增量在写锁外读；assigned_count 必须在写锁里读，才不会和别的进程的分配交错
+        _sync_adaptive_ratings(cur, alloc)
+        _retry_locked(lambda: cur.execute("BEGIN IMMEDIATE"), retries)
+        due = reclaim_due(stale_min)
+        try:
+            if due:
+                reclaim_stale_assignments(cur, stale_min)
+            cur.execute("SELECT image_id, assigned_count FROM images WHERE assigned_count > 0")
+            alloc.set_assigned(cur.fetchall())
+
+            mine, max_ord = _participant_assigned(cur, pid)
+            n_new = next_chunk_size(len(mine), k, chunk)
+            need = chunk_cover_need(alloc.strata_counts(mine), range(alloc.n_strata),
+                                    cover_m, k - len(mine), n_new)
+
+            idx = alloc.select(n_new, cover_m, exclude=mine, need=need)
+            chosen = alloc.ids(idx)
+
+            now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            random.shuffle(chosen)
+
+            _write_assignments(cur, pid, chosen, max_ord + 1, now, retries)
+
+            cur.execute("UPDATE assign_meta SET generation = generation + 1 WHERE id=1")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        if due:
+            reclaim_committed()
+        alloc.add_pending(idx)
+        return chosen
@@ -0,0 +1,108 @@
+# sqlite_pool.py
+# -*- coding: utf-8 -*-
+"""
+SQLite 连接复用（app5 / app5_fixed 的 get_conn / release_conn）
+
+原来每次 get_conn() 都新开连接、重跑 4 条 PRAGMA，用完 close，页缓存也跟着丢掉
+这里保留一小撮配置好的空闲连接：
+- acquire：先拿空闲的（后进先出，缓存最热），没有就新开一条并执行一次 PRAGMA
+- 拿出来先 SELECT 1 做健康检查，坏了就丢掉重开
+- release：还没提交的事务先 rollback 再放回；空闲数超过 max_idle 的直接 close
+- 进程退出时（atexit）关掉所有空闲连接
+不按线程绑定：Streamlit 每次 rerun 换一个脚本线程，线程局部的连接会越积越多
+同一条连接同一时刻只会被一个调用方拿着，所以 check_same_thread=False 是安全的
+"""
+
+import atexit
+import sqlite3
+import threading
+
+
+class SQLitePool:
+    def __init__(self, path: str, timeout: float = 30, busy_timeout_ms: int = 8000, max_idle: int = 8):
+        self.path = path
+        self.timeout = timeout
+        self.busy_timeout_ms = int(busy_timeout_ms)
+        self.max_idle = int(max_idle)
+
+        self._lock = threading.Lock()
+        self._idle = []
+        self._in_use = 0
+        self._stats = {"opened": 0, "reused": 0, "closed": 0, "health_failed": 0, "rolled_back": 0}
+        self._closed = False
+        atexit.register(self.close_all)
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=self.timeout)
+        conn.execute(f"PRAGMA busy_timeout = {self.busy_timeout_ms}")
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        return conn
+
+    @staticmethod
+    def _healthy(conn) -> bool:
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+                self._in_use += 1
+            if conn is None:
+                conn = self._open()
+                with self._lock:
+                    self._stats["opened"] += 1
+                return conn
+            if self._healthy(conn):
+                with self._lock:
+                    self._stats["reused"] += 1
+                return conn
+            with self._lock:
+                self._stats["health_failed"] += 1
+                self._in_use -= 1
+            self._close(conn)
+
+    def release(self, conn):
+        if conn is None:
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+                with self._lock:
+                    self._stats["rolled_back"] += 1
+        except sqlite3.Error:
+            with self._lock:
+                self._in_use -= 1
+            self._close(conn)
+            return
+
+        with self._lock:
+            self._in_use -= 1
+            if not self._closed and len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        self._close(conn)
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._stats["closed"] += 1
+
+    def close_all(self):
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._close(conn)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"idle": len(self._idle), "in_use": self._in_use, **self._stats}
@@ -0,0 +1,132 @@
+# strata_index.py
+# -*- coding: utf-8 -*-
+"""
+进程内的 strata 索引：每个 (category|resolution|distortion) 一个最小堆 (assigned_count, image_id)
+
+旧实现每来一个参与者都要全表读 images、每个 strata 排序、candidates.pop(0)（O(n)）、
+再用 list 判断 `image_id not in chosen`（O(K²)），而且这些都在 BEGIN IMMEDIATE 写锁里。
+现在：
+- 只在 generation 变化时（别的进程改过 assigned_count）才重新 load
+- 选 K 张：覆盖包每个 strata heappop COVER_M 次，补齐阶段用“堆的堆”做多路归并，O(K log n)
+- 分块分配：覆盖包可以按 strata 指定张数（need），并跳过参与者已有的图（exclude）
+- 事务提交后 commit()（计数 +1 放回），失败则 restore()（原样放回）
+"""
+
+import heapq
+import threading
+
+
+def build_strata_key(cat: int, res: str, dist: int) -> str:
+    return f"{cat}|{res}|{dist}"
+
+
+class StrataIndex:
+    def __init__(self, r_target: int):
+        self.r_target = int(r_target)
+        self.lock = threading.Lock()   # 调用方在整个分配事务期间持有
+        self.generation = None         # 和 assign_meta.generation 对齐
+        self.keys = []                 # 覆盖包遍历顺序：cat × res × dist 升序（与旧实现一致）
+        self.heaps = {}                # key -> [(assigned_count, image_id), ...]
+        self.strata_of = {}            # image_id -> key
+
+    # ---------- load ----------
+    def load(self, conn, generation):
+        cur = conn.cursor()
+        cur.execute("SELECT image_id, category, resolution, distortion, assigned_count FROM images")
+        axes = set()
+        heaps = {}
+        strata_of = {}
+        for image_id, cat, res, dist, assigned_count in cur.fetchall():
+            cat, res, dist = int(cat), str(res), int(dist)
+            axes.add((cat, res, dist))
+            key = build_strata_key(cat, res, dist)
+            strata_of[image_id] = key
+            if int(assigned_count) < self.r_target:
+                heaps.setdefault(key, []).append((int(assigned_count), image_id))
+        for h in heaps.values():
+            heapq.heapify(h)
+
+        cats = sorted({a[0] for a in axes})
+        ress = sorted({a[1] for a in axes})
+        dists = sorted({a[2] for a in axes})
+        self.keys = [build_strata_key(c, r, d) for c in cats for r in ress for d in dists]
+        self.heaps = heaps
+        self.strata_of = strata_of
+        self.generation = generation
+
+    def ensure_fresh(self, conn, generation):
+        if self.generation != generation:
+            self.load(conn, generation)
+
+    # ---------- pick ----------
+    def pick(self, k: int, cover_m: int, need=None, exclude=()):
+        """
+        返回 popped：[(assigned_count, image_id), ...]，前面是覆盖包，后面是补齐
+        这些条目已经从堆里拿出来了，调用方必须 commit() 或 restore()
+        need：key -> 这次覆盖包要几张（分块分配时由调用方按剩余需求算）；None 表示每个 strata cover_m 张
+        exclude：这个参与者已经有的图，跳过（跳过的条目最后原样放回堆里）
+        """
+        popped = []
+        skipped = []
+
+        def pop_from(h):
+            while h:
+                entry = heapq.heappop(h)
+                if entry[1] in exclude:
+                    skipped.append(entry)
+                    continue
+                return entry
+            return None
+
+        # 1) coverage pack：每个 strata 取 need 张 assigned_count 最小的
+        for key in self.keys:
+            h = self.heaps.get(key)
+            if not h:
+                continue
+            want = cover_m if need is None else need.get(key, 0)
+            for _ in range(want):
+                if len(popped) >= k:
+                    break
+                entry = pop_from(h)
+                if entry is None:
+                    break
+                popped.append(entry)
+
+        # 2) fill：全局 assigned_count 最小的补齐到 K（各 strata 堆顶做多路归并）
+        need_n = k - len(popped)
+        if need_n > 0:
+            heads = [(h[0][0], h[0][1], key) for key, h in self.heaps.items() if h]
+            heapq.heapify(heads)
+            while need_n > 0 and heads:
+                _c, _i, key = heapq.heappop(heads)
+                h = self.heaps[key]
+                entry = heapq.heappop(h)
+                if entry[1] in exclude:
+                    skipped.append(entry)
+                else:
+                    popped.append(entry)
+                    need_n -= 1
+                if h:
+                    heapq.heappush(heads, (h[0][0], h[0][1], key))
+
+        self.restore(skipped)
+        return popped
+
+    # ---------- after transaction ----------
+    def commit(self, popped):
+        """事务已提交：assigned_count + 1，没到 R_TARGET 的放回堆里"""
+        for count, image_id in popped:
+            if count + 1 < self.r_target:
+                heapq.heappush(self.heaps[self.strata_of[image_id]], (count + 1, image_id))
+
+    def restore(self, popped):
+        """事务回滚：原样放回"""
+        for entry in popped:
+            heapq.heappush(self.heaps[self.strata_of[entry[1]]], entry)
+
+    def stats(self) -> dict:
+        return {
+            "generation": self.generation,
+            "strata": len(self.keys),
+            "available": sum(len(h) for h in self.heaps.values()),
+        }
@@ -0,0 +1,136 @@
+# training_page.py
+# -*- coding: utf-8 -*-
+"""
+Training 页渲染：只引用 build_training_assets.py 预生成好的素材 URL
+- 不再每次 rerun 编码 data URL，websocket 里只有几百字节的 HTML
+- <link rel=preload> 提前拉 5 张图，切换时不闪
+- 本地（Streamlit static serving）和 R2 都能用，只是 base URL 不同
+"""
+
+import os
+import json
+
+import streamlit.components.v1 as components
+from streamlit import config as st_config
+
+TRAIN_ASSET_DIR = os.path.join("static", "training")
+TRAIN_MANIFEST = os.path.join(TRAIN_ASSET_DIR, "manifest.json")
+
+# Streamlit enableStaticServing：./static/xxx 对外是 <baseUrlPath>/app/static/xxx
+# 用绝对路径：相对路径在多级页面路径下会解析错
+LOCAL_TRAIN_PATH = "app/static/training"
+# R2 上约定的目录：把 static/training 上传到 <bucket>/training_assets/
+R2_TRAIN_PREFIX = "training_assets"
+
+
+def training_manifest_version(path: str = TRAIN_MANIFEST):
+    """manifest 的 mtime，没有就 None；调用方拿它做缓存 key（不缓存“还没生成”）"""
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def load_training_manifest(path: str = TRAIN_MANIFEST):
+    """没跑过 build_training_assets.py 时返回 None，调用方自己退回旧逻辑"""
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def training_base_url(r2_public_base_url: str = "") -> str:
+    override = os.environ.get("TRAIN_ASSET_BASE_URL", "").rstrip("/")
+    if override:
+        return override
+    if r2_public_base_url:
+        return f"{r2_public_base_url.rstrip('/')}/{R2_TRAIN_PREFIX}"
+    base_path = (st_config.get_option("server.baseUrlPath") or "").strip("/")
+    return "/" + (f"{base_path}/" if base_path else "") + LOCAL_TRAIN_PATH
+
+
+def _srcset(base_url: str, item: dict) -> str:
+    return ", ".join(f"{base_url}/{v['file']} {v['w']}w" for v in item["variants"])
+
+
+def render_training_carousel(manifest: dict, captions, base_url: str,
+                             interval_ms: int = 0, height: int = 820):
+    """
+    interval_ms > 0：自动轮播（SQLite 版的体验）
+    interval_ms = 0：只用 iframe 里的 Prev / Next 切换（app_pg 的体验），都不触发 rerun
+    """
+    items = manifest["items"][:len(captions)]
+    srcsets = [_srcset(base_url, it) for it in items]
+    fallbacks = [f"{base_url}/{it['variants'][-1]['file']}" for it in items]
+    sizes = "min(1600px, 98vw)"
+
+    preload = "\n".join(
+        f'<link rel="preload" as="image" href="{fb}" imagesrcset="{ss}" imagesizes="{sizes}">'
+        for fb, ss in zip(fallbacks, srcsets)
+    )
+
+    components.html(
+        f"""
+        <head>
+          {preload}
+        </head>
+        <div style="width:100%; display:flex; justify-content:center;">
+          <div style="width:min(1800px, 98vw); text-align:center;">
+            <div id="trainCap" style="font-size:22px; font-weight:950; margin-bottom:10px;"></div>
+            <div style="display:flex; align-items:center; gap:12px;">
+              <button id="prevBtn" style="padding:10px 16px; border-radius:10px; font-weight:800;">← Prev</button>
+              <div style="
+                  flex:1;
+                  height:72vh;
+                  border:1px solid #eee;
+                  border-radius:8px;
+                  display:flex;
+                  justify-content:center;
+                  align-items:center;
+                  background:#fafafa;
+                  overflow:hidden;
+              ">
+                <img id="trainImg" sizes="{sizes}"
+                     style="max-width:1600px; max-height:100%; width:auto; height:auto; object-fit:contain;"
+                     decoding="async" loading="eager" />
+              </div>
+              <button id="nextBtn" style="padding:10px 16px; border-radius:10px; font-weight:800;">Next →</button>
+            </div>
+            <div style="opacity:0.65; font-weight:800; font-size:13px; margin-top:6px;">
+              Training only · No scores recorded
+            </div>
+          </div>
+        </div>
+
+        <script>
+          const srcsets = {json.dumps(srcsets)};
+          const fallbacks = {json.dumps(fallbacks)};
+          const caps = {json.dumps(list(captions)[:len(items)], ensure_ascii=False)};
+          const interval = {int(interval_ms)};
+
+          const img = document.getElementById("trainImg");
+          const cap = document.getElementById("trainCap");
+
+          let i = 0;
+          function show() {{
+            img.srcset = srcsets[i];
+            img.src = fallbacks[i];
+            cap.textContent = caps[i];
+          }}
+          document.getElementById("prevBtn").onclick = () => {{ i = (i - 1 + caps.length) % caps.length; show(); }};
+          document.getElementById("nextBtn").onclick = () => {{ i = (i + 1) % caps.length; show(); }};
+
+          show();
+
+          if (interval > 0) {{
+            setTimeout(() => {{
+              setInterval(() => {{
+                i = (i + 1) % caps.length;
+                show();
+              }}, interval);
+            }}, 700);
+          }}
+        </script>
+        """,
+        height=height,
+    )